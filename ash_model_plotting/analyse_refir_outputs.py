@@ -12,24 +12,53 @@ montage \
 ```
 """
 import argparse
+from functools import partial
+import itertools
+import os
+
 import matplotlib
 import matplotlib.pyplot as plt
 from pathlib import Path
 
+import dask.array as da
 import iris
+import numpy as np
 import pandas as pd
 
-from ash_model_plotting import AshModelResult
+from ash_model_plotting import NameAshModelResult
+from ash_model_plotting.plotting import running_pool, worker_pool
 
 EXPERIMENTS = ['30MinAv']
 MODELS = ['AllModels', 'WindOnly', 'EmpOnly', 'MastinOnly']
-LABELS = ['ALL', 'WA', 'NWA', 'Mastin']
+LABELS = {'AllModels': 'ALL', 'WindOnly': 'WA', 'EmpOnly': 'NWA',
+          'MastinOnly': 'Mastin'}
 RUNS = ['Av', 'Max', 'Min']
 
 matplotlib.use('agg')
 
 
-def main(data_dir, output_dir):
+def main(data_dir, output_dir, experiments=EXPERIMENTS, models=MODELS,
+         runs=RUNS, workers=None, cache_dir=None):
+    """
+    Analyse every run of every model of every experiment and write a summary
+    CSV file and bar charts.  Runs are analysed in parallel, but the rows of
+    the CSV file are always in experiment, model, run order.
+
+    :param data_dir: str, directory containing experiment/model/run
+        subdirectories of NAME files
+    :param output_dir: str, output directory (default is data_dir)
+    :param experiments: list of str, experiment names
+    :param models: list of str, model names
+    :param runs: list of str, run names.  Bar charts need 'Av', 'Max' and
+        'Min' runs.
+    :param workers: int, number of worker processes (default is number of
+        available cores).  Runs are analysed in the current process if 1.
+        A plotting pool that is already running is used as it is, and left
+        running for the caller.
+    :param cache_dir: str, directory for cache of parsed NAME files, so that
+        later analyses of the same files do not parse them again (default is
+        no cache)
+    """
     # Configure directories
     data_dir = Path(data_dir)
     if output_dir:
@@ -40,13 +69,9 @@ def main(data_dir, output_dir):
         output_dir = data_dir
 
     # Analyse runs
-    all_results = []
-    for experiment in EXPERIMENTS:
-        for model in MODELS:
-            for run in RUNS:
-                print(experiment, model, run)
-                results = analyse_run(data_dir, experiment, model, run)
-                all_results.append(results)
+    tasks = [(data_dir, experiment, model, run) for experiment, model, run
+             in itertools.product(experiments, models, runs)]
+    all_results = analyse_runs(tasks, workers=workers, cache_dir=cache_dir)
 
     # Convert to dataframe to export csv
     df = pd.DataFrame(all_results)
@@ -54,7 +79,44 @@ def main(data_dir, output_dir):
     df.to_csv(output_dir / 'REFIR_summary.csv')
 
     # Plot results
-    plot_results(df, output_dir)
+    if set(RUNS).issubset(runs):
+        plot_results(df, output_dir)
+    else:
+        print(f"Bar charts need runs {', '.join(RUNS)}; not plotted")
+
+
+def analyse_runs(tasks, workers=None, cache_dir=None):
+    """
+    Analyse model runs in a pool of worker processes.
+
+    :param tasks: list of tuple, (data_dir, experiment, model, run) arguments
+        for analyse_run
+    :param workers: int, number of worker processes (default is number of
+        available cores).  Runs are analysed in the current process if 1.
+        A plotting pool that is already running is used as it is, and left
+        running for the caller.
+    :param cache_dir: str, directory for cache of parsed NAME files
+    :return: list of dict, results of analyse_run in the same order as tasks
+    """
+    run_task = partial(_analyse_run_task, cache_dir=cache_dir)
+    processes = min(workers or len(os.sched_getaffinity(0)), len(tasks))
+    if processes <= 1:
+        return [run_task(task) for task in tasks]
+
+    # imap returns results in task order, whichever run finishes first
+    pool = running_pool()
+    if pool is not None:
+        return list(pool.imap(run_task, tasks, chunksize=1))
+
+    with worker_pool(processes) as pool:
+        return list(pool.imap(run_task, tasks, chunksize=1))
+
+
+def _analyse_run_task(task, cache_dir=None):
+    """Analyse run from (data_dir, experiment, model, run) tuple."""
+    data_dir, experiment, model, run = task
+    print(experiment, model, run, flush=True)
+    return analyse_run(data_dir, experiment, model, run, cache_dir=cache_dir)
 
 
 def plot_results(results_df, output_dir):
@@ -93,7 +155,8 @@ def plot_bar_with_errors(df, label=None):
 
     # Labels for bars
     ax.set_xticks(x_pos)
-    ax.set_xticklabels(LABELS)
+    models = heights.index.get_level_values('model')
+    ax.set_xticklabels([LABELS.get(model, model) for model in models])
     plt.grid()
 
     # Label for chart
@@ -105,20 +168,28 @@ def plot_bar_with_errors(df, label=None):
     return fig, ax
 
 
-def analyse_run(data_dir, experiment, model, run):
+def analyse_run(data_dir, experiment, model, run, cache_dir=None):
     """
     Analyse the outputs from a single model run.
 
-    :param run_dir: str, directory containing NAME *.txt files
+    :param data_dir: Path, directory containing experiment directories
+    :param experiment: str, experiment name
+    :param model: str, model name
+    :param run: str, run name; NAME Fields_grid88*.txt files are in
+        data_dir/experiment/model/run
+    :param cache_dir: str, directory for cache of parsed NAME files (default
+        is no cache)
     """
     # Locate data
-    run_dir = data_dir / experiment / model / run
-    name_files = [str(f.absolute()) for f in run_dir.glob("Fields_grid88*.txt")]
+    run_dir = Path(data_dir) / experiment / model / run
+    name_files = sorted(str(f.absolute()) for f in run_dir.glob("Fields_grid88*.txt"))
 
-    # Calculate outputs
-    ash_model_result = AshModelResult(name_files)
-    advisory_area_params = advisory_area(ash_model_result)
-    max_concentration_params = max_concentration_data(ash_model_result)
+    # Calculate outputs.  Files are loaded in this process, as runs are
+    # already spread across the worker processes.
+    with NameAshModelResult(name_files, workers=1,
+                            cache_dir=cache_dir) as ash_model_result:
+        advisory_area_params = advisory_area(ash_model_result)
+        max_concentration_params = max_concentration_data(ash_model_result)
 
     # Prepare for return
     results = {
@@ -131,6 +202,8 @@ def analyse_run(data_dir, experiment, model, run):
         "max_concentration": max_concentration_params['max_concentration'],
         "max_concentration_z": max_concentration_params['flight_level'],
         "max_concentration_t": max_concentration_params['time'],
+        "max_concentration_lat": max_concentration_params['latitude'],
+        "max_concentration_lon": max_concentration_params['longitude'],
         }
 
     return results
@@ -144,48 +217,129 @@ def advisory_area(ash_model_result, threshold=0.002):
     :param ash_model_result: AshModelResult for model run
     :param threshold: threshold concentration
     """
+    return advisory_areas(ash_model_result, [threshold])[0]
+
+
+def advisory_areas(ash_model_result, thresholds):
+    """
+    Extract area and z, t coordinates for maximum area of concentration
+    above each of several thresholds.  The areas above every threshold for
+    every (t, z) slice are calculated together in one pass over the data.
+    Where no concentration exceeds a threshold, the area is 0 and z and t
+    are None.
+
+    :param ash_model_result: AshModelResult for model run
+    :param thresholds: list of threshold concentrations
+    :return: list of dict; flight_level, time and advisory_area for each
+        threshold
+    """
     cube = ash_model_result.air_concentration
+    areas = exceedance_areas(cube, thresholds)
+    lead_dims = [dim for dim in range(cube.ndim)
+                 if dim not in _yx_dims(cube)]
+
+    results = []
+    for threshold_areas in areas:
+        index = np.unravel_index(np.argmax(threshold_areas), threshold_areas.shape)
+        max_area = threshold_areas[index]
+        if max_area > 0:
+            position = dict(zip(lead_dims, index))
+            flight_level = _coord_value(cube, 'flight_level', position)
+            timestamp = _coord_value(cube, 'time', position)
+        else:
+            flight_level = timestamp = None
+
+        results.append({'flight_level': flight_level,
+                        'time': timestamp,
+                        'advisory_area': max_area})
+
+    return results
+
+
+def exceedance_areas(cube, thresholds):
+    """
+    Return area of grid cells with concentration above each threshold, for
+    every (latitude, longitude) slice of cube.  Masked values do not exceed
+    any threshold.  Lazy data are reduced chunk by chunk.
+
+    :param cube: iris.cube.Cube with latitude and longitude dimensions
+    :param thresholds: list of threshold concentrations
+    :return: np.ndarray; areas in m2 with shape (threshold, *other dims), with
+        the other dimensions in cube order
+    """
+    yx_dims = _yx_dims(cube)
     cell_areas = iris.analysis.cartography.area_weights(
-        cube.slices(['latitude', 'longitude']).next())
-    max_area = 0
+        next(cube.slices(['latitude', 'longitude'])))
 
-    for xy_slice in cube.slices(['latitude', 'longitude']):
-        flight_level = xy_slice.coord('flight_level').points[0]
-        timestamp = xy_slice.coord('time').points[0]
-        timestamp = xy_slice.coord('time').units.num2date(timestamp)
+    # Put latitude and longitude last, in the order of cell_areas
+    data = cube.core_data()
+    xp = da if isinstance(data, da.Array) else np
+    data = xp.moveaxis(data, yx_dims, (-2, -1))
+    values = xp.ma.getdata(data)
+    mask = xp.ma.getmaskarray(data)
 
-        advisory_area = cell_areas[xy_slice.data > threshold].sum()
-        if advisory_area > max_area:
-            max_flight_level = flight_level
-            max_timestamp = timestamp
-            max_area = advisory_area
+    # Sum of cell areas where each threshold is exceeded, without building a
+    # weighted copy of the data
+    areas = [xp.einsum('...ij,ij->...', (values > threshold) & ~mask, cell_areas)
+             for threshold in thresholds]
+    if xp is da:
+        areas = da.compute(*areas)
 
-    data = {'flight_level': max_flight_level,
-            'time': max_timestamp,
-            'advisory_area': max_area}
+    return np.stack(areas)
 
-    return data
+
+def _yx_dims(cube):
+    """Return dimensions of cube for latitude and longitude."""
+    return cube.coord_dims('latitude') + cube.coord_dims('longitude')
+
+
+def _coord_value(cube, name, position):
+    """
+    Return value of a 1D coordinate at a position in cube, with times
+    converted to datetimes.
+
+    :param cube: iris.cube.Cube
+    :param name: str; coordinate name
+    :param position: dict; {dimension: index}
+    """
+    coord = cube.coord(name)
+    value = coord.points[position[cube.coord_dims(coord)[0]]]
+    if name == 'time':
+        value = coord.units.num2date(value)
+
+    return value
 
 
 def max_concentration_data(ash_model_result):
     """
     Extract magnitude and z, t, x, y coordinates for maximum air
-    concentration.
+    concentration.  The position is found with a single argmax over the
+    data, which is reduced chunk by chunk if lazy.  The first of equal
+    maxima in cube order is used.
 
     :param ash_model_result: AshModelResult for model run
+    :return: dict; flight_level, time, latitude, longitude and
+        max_concentration
     """
     cube = ash_model_result.air_concentration
-    max_concentration = cube.data.max()
-
-    for xy_slice in cube.slices(['latitude', 'longitude']):
-        flight_level = xy_slice.coord('flight_level').points[0]
-        timestamp = xy_slice.coord('time').points[0]
-        timestamp = xy_slice.coord('time').units.num2date(timestamp)
-        if xy_slice.data.max() == max_concentration:
-            break
-
-    data = {'flight_level': flight_level,
-            'time': timestamp,
+    data = cube.core_data()
+    lazy = isinstance(data, da.Array)
+
+    flat_index = data.argmax()
+    if lazy:
+        flat_index = flat_index.compute()
+    index = np.unravel_index(flat_index, cube.shape)
+
+    # Only the chunk holding the maximum is read again
+    max_concentration = data[index]
+    if lazy:
+        max_concentration = max_concentration.compute()
+
+    position = dict(enumerate(index))
+    data = {'flight_level': _coord_value(cube, 'flight_level', position),
+            'time': _coord_value(cube, 'time', position),
+            'latitude': _coord_value(cube, 'latitude', position),
+            'longitude': _coord_value(cube, 'longitude', position),
             'max_concentration': max_concentration}
 
     return data
@@ -198,5 +352,19 @@ if __name__ == '__main__':
                         help='directory containing REFIR experiment output data')
     parser.add_argument('--output_dir', type=str,
                         help='output directory for results')
+    parser.add_argument('--experiments', nargs='+', default=EXPERIMENTS,
+                        help='experiment names')
+    parser.add_argument('--models', nargs='+', default=MODELS,
+                        help='model names')
+    parser.add_argument('--runs', nargs='+', default=RUNS,
+                        help='run names')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='number of worker processes (default is number '
+                             'of available cores)')
+    parser.add_argument('--cache_dir', type=str, default=None,
+                        help='directory for cache of parsed NAME files, '
+                             'which are not parsed again on later runs')
     args = parser.parse_args()
-    main(args.data_dir, args.output_dir)
+    main(args.data_dir, args.output_dir, experiments=args.experiments,
+         models=args.models, runs=args.runs, workers=args.workers,
+         cache_dir=args.cache_dir)
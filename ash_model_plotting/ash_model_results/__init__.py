@@ -8,3 +8,10 @@ from ash_model_plotting.ash_model_results.name import NameAshModelResult
 from ash_model_plotting.ash_model_results.fall3d import Fall3DAshModelResult
 from ash_model_plotting.ash_model_results.hysplit import HysplitAshModelResult
 
+# AshModelResult class for each model type name used by the scripts
+MODEL_TYPES = {
+    'name': NameAshModelResult,
+    'fall3d': Fall3DAshModelResult,
+    'hysplit': HysplitAshModelResult
+}
+
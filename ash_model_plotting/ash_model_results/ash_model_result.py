@@ -3,18 +3,39 @@ Class to store ash model results.
 """
 # coding: utf-8
 from abc import ABCMeta, abstractmethod
-from pathlib import Path
+from contextlib import nullcontext
+import os
 
-from netCDF4 import Dataset
+import dask
+from dask.utils import parse_bytes
 
 # Import matplotlib-based code before iris to allow backend setting
 from ash_model_plotting.plotting import (
+    colour_scale_limits,
     plot_3d_cube,
     plot_4d_cube,
-    render_html,
+    write_html,
 )
 
 import iris
+import iris.cube
+import iris.exceptions
+
+from ash_model_plotting.ash_model_results.cube_cache import CubeCache
+
+
+# Label and CF standard name of each quantity
+QUANTITIES = {
+    'air_concentration': ('Air Concentration',
+                          "mass_concentration_of_volcanic_ash_in_air"),
+    'total_column': ('Total Column Mass',
+                     "atmosphere_mass_content_of_volcanic_ash"),
+    'total_deposition': ('Total Deposition', "surface_volcanic_ash_amount"),
+}
+
+# Number of chunk-sized arrays each worker may hold at once in out-of-core
+# mode e.g. data, mask, masked view and float64 intermediate results
+CHUNK_COPIES = 4
 
 
 class AshModelResultError(Exception):
@@ -31,10 +52,38 @@ class AshModelResult(metaclass=ABCMeta):
     _zlevel_names = {'altitude', 'alt', 'flight_level',
                      'z coordinate of x-y plane cuts'}
 
-    def __init__(self, source_data):
+    def __init__(self, source_data, workers=None, cache_bytes=None,
+                 memory_limit=None):
+        """
+        :param source_data: path, or list of paths, to model output
+        :param workers: int; number of processes used to load data, for
+            formats that are loaded in parallel (default is all available
+            cores)
+        :param cache_bytes: int; memory budget for realised data of cached
+            quantity cubes, beyond which the least recently used are evicted
+            (default is no limit).  Data shared with the loaded cubes are not
+            counted, as evicting them frees no memory.
+        :param memory_limit: int or str e.g. '16GB'; run out-of-core, with
+            data read lazily in chunks sized so that the chunks held by all
+            workers fit within this limit (default is to use dask and iris
+            chunk sizes).  Only chunk sizes are set from the limit; memory
+            use is not checked against it and can exceed it.
+        """
         self.source_data = source_data
+        self.workers = workers
+        self.memory_limit = (None if memory_limit is None
+                             else parse_bytes(memory_limit))
+        self._quantity_cache = CubeCache(max_bytes=cache_bytes,
+                                         shared_arrays=self._realised_source_data)
+        self._quantity_groups = None
         self._load_cubes()
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
     @abstractmethod
     def __repr__(self):
         return f"AshModelResult({self.source_data})"
@@ -48,35 +97,155 @@ class AshModelResult(metaclass=ABCMeta):
         pass
 
     @property
-    @abstractmethod
+    def cubes(self):
+        """
+        Cubes loaded from data files.  Setting new cubes evicts all
+        quantities extracted from the old ones.
+        :return: iris.cube.CubeList
+        """
+        return self._cubes
+
+    @cubes.setter
+    def cubes(self, cubes):
+        self._cubes = cubes
+        self.evict()
+
+    @property
     def air_concentration(self):
         """
-        Cube containing air concentration data.  Override to extract specific
-        attribute names used by different model formats.
-        :return: iris.cube.Cube
+        Cube containing air concentration data.  Cubes are selected by the
+        names in _air_concentration_names.
+        :return: iris.cube.Cube or None
         """
-        pass
+        return self._get_quantity('air_concentration')
 
     @property
-    @abstractmethod
     def total_column(self):
         """
-        Cube containing total_column loading data. Override to extract specific
-        attribute names used by different model formats.
-
-        :return: iris.cube.Cube
+        Cube containing total_column loading data.  Cubes are selected by
+        the names in _total_column_names.
+        :return: iris.cube.Cube or None
         """
-        pass
+        return self._get_quantity('total_column')
 
     @property
-    @abstractmethod
     def total_deposition(self):
         """
-        Cube containing total deposition loading data.  Override to extract specific
-        attribute names used by different model formats.
+        Cube containing total deposition loading data.  Cubes are selected
+        by the names in _total_deposition_names.
+        :return: iris.cube.Cube or None
+        """
+        return self._get_quantity('total_deposition')
+
+    def evict(self, *quantities):
+        """
+        Remove extracted quantities from the cache, so that they are
+        extracted again when next used.  All are removed if none are given.
+
+        :param quantities: str; e.g. 'air_concentration'
+        """
+        if not quantities:
+            self._quantity_groups = None
+            quantities = tuple(QUANTITIES)
+
+        for quantity in quantities:
+            self._quantity_cache.pop(quantity)
+
+    def release(self):
+        """
+        Free the memory used by cubes, so that a driver can process many
+        results in bounded memory.  The result has no data afterwards.  This
+        is called on leaving a with block.
+        """
+        self.cubes = iris.cube.CubeList()
+
+    def _realised_source_data(self):
+        """
+        Yield realised data of loaded cubes, which quantities can share.
+        Nothing is yielded if called while cubes are being loaded.
+        """
+        for cube in getattr(self, 'cubes', ()):
+            if not cube.has_lazy_data():
+                yield cube.data
+
+    def _get_quantity(self, quantity):
+        """
+        Return cube for quantity, extracting it if not in the cache.
+
+        :param quantity: str; key of QUANTITIES
+        :return: iris.cube.Cube or None
+        """
+        if quantity not in self._quantity_cache:
+            self._quantity_cache.put(quantity, self._build_quantity(quantity))
+
+        return self._quantity_cache.get(quantity)
+
+    def _build_quantity(self, quantity):
+        """
+        Concatenate the cubes for quantity into one cube.  Override to
+        derive quantities that are not in the source data.
+
+        :param quantity: str; key of QUANTITIES
+        :return: iris.cube.Cube or None if no cubes present
+        """
+        if self._quantity_groups is None:
+            self._quantity_groups = self._group_cubes(self.cubes)
+
+        try:
+            cube = self._quantity_groups[quantity].concatenate_cube()
+        except ValueError:
+            # Return None if no cubes present
+            return
+
+        # A single cube is returned as is, so copy the metadata to leave
+        # self.cubes unchanged.  The data are shared.
+        cube = cube.copy(data=cube.core_data())
+        return self._prepare_quantity(quantity, cube)
+
+    def _group_cubes(self, cubes):
+        """
+        Sort cubes into quantities in a single pass.
+
+        :param cubes: iris.cube.CubeList
+        :return: dict; {quantity: iris.cube.CubeList}
+        """
+        groups = {quantity: iris.cube.CubeList() for quantity in QUANTITIES}
+        for cube in cubes:
+            for quantity, quantity_cube in self._classify_cube(cube):
+                groups[quantity].append(quantity_cube)
+
+        return groups
+
+    def _classify_cube(self, cube):
+        """
+        Yield (quantity, cube) for each quantity that cube holds data for.
+        Override for formats where one cube holds several quantities.
+
+        :param cube: iris.cube.Cube
+        """
+        name = cube.name()
+        if name in self._air_concentration_names and self._has_zlevels(cube):
+            yield 'air_concentration', cube
+        if name in self._total_column_names:
+            yield 'total_column', cube
+        if name in self._total_deposition_names:
+            yield 'total_deposition', cube
+
+    def _prepare_quantity(self, quantity, cube):
+        """
+        Set attributes used for plotting on a quantity cube.  Override to
+        correct names or units for specific model formats.
+
+        :param quantity: str; key of QUANTITIES
+        :param cube: iris.cube.Cube
         :return: iris.cube.Cube
         """
-        pass
+        label, standard_name = QUANTITIES[quantity]
+        cube.attributes['model_run_title'] = self._get_model_run_title(cube)
+        cube.attributes['quantity'] = label
+        cube.attributes['CF Standard Name'] = standard_name
+
+        return cube
 
     def _has_zlevels(self, cube):
         """
@@ -106,20 +275,77 @@ class AshModelResult(metaclass=ABCMeta):
 
         return title
 
+    @property
+    def _quantity_names(self):
+        """
+        Names of cubes used for any of the quantities.
+
+        :return: set of str
+        """
+        return (self._air_concentration_names | self._total_column_names
+                | self._total_deposition_names)
+
     def _load_from_netcdf(self):
         """
-        Load cubes from NetCDF4 file with minor error-checking for valid file
+        Load cubes from NetCDF4 file with minor error-checking for valid file.
+        Only cubes for the quantities are kept, with lazy data, and the file
+        is opened once.
         """
-        # Check that NetCDF4 driver can open file
+        # iris builds a lazy cube for every data variable and the constraint
+        # then keeps the quantity cubes, so the data of other variables are
+        # never read but their metadata are.  iris only skips variables
+        # before building cubes for a single NameConstraint, and loading once
+        # per quantity name was slower for the test files.  A single
+        # constraint matches each variable at most once, even if its long
+        # name and variable name are both quantity names.
+        constraint = iris.Constraint(cube_func=self._is_quantity_cube)
         try:
-            nc = Dataset(self.source_data)
-            nc.close()
-        except (OSError, FileNotFoundError) as e:
+            with self._chunk_config():
+                self.cubes = iris.load(str(self.source_data), constraint)
+        except (OSError, ValueError, iris.exceptions.TranslationError) as e:
             msg = (f"{self.source_data.absolute()} is not a valid '"
                    f"NetCDF4 file:\n{e}")
             raise AshModelResultError(msg)
 
-        self.cubes = iris.load(str(self.source_data))
+    def _is_quantity_cube(self, cube):
+        """
+        Determines if a cube loaded from NetCDF is used for any of the
+        quantities.  Quantity names are long names or variable names; none
+        are CF standard names.
+
+        :param cube: iris.cube.Cube
+        :return: bool
+        """
+        return (cube.long_name in self._quantity_names
+                or cube.var_name in self._quantity_names)
+
+    def _chunk_config(self):
+        """
+        Return context in which lazy data are loaded.  In out-of-core mode,
+        the dask chunk size is limited so that each worker can hold
+        CHUNK_COPIES chunks within memory_limit.  iris keeps (latitude,
+        longitude) slices whole unless a single slice exceeds the limit.
+
+        :return: context manager
+        """
+        chunk_bytes = self._chunk_bytes()
+        if chunk_bytes is None:
+            return nullcontext()
+
+        return dask.config.set({'array.chunk-size': f'{chunk_bytes}B'})
+
+    def _chunk_bytes(self):
+        """
+        Return the size of data that each worker may hold CHUNK_COPIES of
+        within memory_limit, or None if not in out-of-core mode.
+
+        :return: int or None
+        """
+        if self.memory_limit is None:
+            return None
+
+        processes = self.workers or len(os.sched_getaffinity(0))
+        return max(self.memory_limit // (processes * CHUNK_COPIES), 1)
 
     def plot_air_concentration(self, output_dir, file_ext='png',
                                html=True, vaac_colours=False, **kwargs):
@@ -133,7 +359,11 @@ class AshModelResult(metaclass=ABCMeta):
         :param html: bool, set whether html page is created or not
         :param vaac_colors: bool, use vaac_colors for plot
         :param kwargs: dict; extra arguments to pass to plot_2d_cube and
-            plt.savefig e.g. limits, vaac_colours, dpi, bbox_inches
+            plt.savefig e.g. limits, vaac_colours, dpi, bbox_inches, and
+            parallel options e.g. serial, workers, chunksize, schedule.
+            Each slice is autoscaled unless vmin or vmax is given, or
+            shared_scale=True sets one scale from the whole cube (see
+            plotting.colour_scale_limits for vmax_percentile).
         """
         kwargs.update(vaac_colours=vaac_colours)
         cube = self.air_concentration
@@ -142,14 +372,14 @@ class AshModelResult(metaclass=ABCMeta):
             msg = 'AshModelResult has no air concentration data'
             raise AshModelResultError(msg)
 
-        if len(cube.data.shape) == 3:
+        if cube.ndim == 3:
             plot_func = plot_3d_cube
         else:
             plot_func = plot_4d_cube
 
+        limits = self._get_colour_scale_limits(cube, kwargs)
         metadata = plot_func(
-            cube, output_dir, file_ext=file_ext, vmin=0, vmax=cube.data.max(),
-            **kwargs)
+            cube, output_dir, file_ext=file_ext, **limits, **kwargs)
 
         if html:
             self._write_html(output_dir, metadata)
@@ -165,7 +395,11 @@ class AshModelResult(metaclass=ABCMeta):
         :param file_ext: File extension
         :param html: bool, set whether html page is created or not
         :param kwargs: dict; extra arguments to pass to plot_2d_cube and
-            plt.savefig e.g. limits, vaac_colours, dpi, bbox_inches
+            plt.savefig e.g. limits, vaac_colours, dpi, bbox_inches, and
+            parallel options e.g. serial, workers, chunksize, schedule.
+            Each slice is autoscaled unless vmin or vmax is given, or
+            shared_scale=True sets one scale from the whole cube (see
+            plotting.colour_scale_limits for vmax_percentile).
         """
         cube = self.total_column
 
@@ -173,9 +407,9 @@ class AshModelResult(metaclass=ABCMeta):
             msg = 'AshModelResult has no total column data'
             raise AshModelResultError(msg)
 
+        limits = self._get_colour_scale_limits(cube, kwargs)
         metadata = plot_3d_cube(
-            cube, output_dir, file_ext=file_ext,
-            vmin=0, vmax=cube.data.max(), **kwargs)
+            cube, output_dir, file_ext=file_ext, **limits, **kwargs)
 
         if html:
             self._write_html(output_dir, metadata)
@@ -191,7 +425,11 @@ class AshModelResult(metaclass=ABCMeta):
         :param file_ext: File extension
         :param html: bool, set whether html page is created or not
         :param kwargs: dict; extra arguments to pass to plot_2d_cube and
-            plt.savefig e.g. limits, vaac_colours, dpi, bbox_inches
+            plt.savefig e.g. limits, vaac_colours, dpi, bbox_inches, and
+            parallel options e.g. serial, workers, chunksize, schedule.
+            Each slice is autoscaled unless vmin or vmax is given, or
+            shared_scale=True sets one scale from the whole cube (see
+            plotting.colour_scale_limits for vmax_percentile).
         """
         cube = self.total_deposition
 
@@ -199,13 +437,36 @@ class AshModelResult(metaclass=ABCMeta):
             msg = 'AshModelResult has no total deposition data'
             raise AshModelResultError(msg)
 
+        limits = self._get_colour_scale_limits(cube, kwargs)
         metadata = plot_3d_cube(
-            cube, output_dir, file_ext=file_ext,
-            vmin=0, vmax=cube.data.max(), **kwargs)
+            cube, output_dir, file_ext=file_ext, **limits, **kwargs)
 
         if html:
             self._write_html(output_dir, metadata)
 
+    @staticmethod
+    def _get_colour_scale_limits(cube, kwargs):
+        """
+        Return vmin and vmax for plotting cube, removing the options used to
+        calculate them from the plotting kwargs.  Limits that are not given
+        are None, so that each slice is autoscaled, unless shared_scale is
+        True or vmax_percentile is given.  Then one scale is calculated from
+        the whole cube.
+
+        :param cube: iris.cube.Cube to be plotted
+        :param kwargs: dict; plotting arguments
+        :return: dict; vmin and vmax
+        """
+        vmin = kwargs.pop('vmin', None)
+        vmax = kwargs.pop('vmax', None)
+        vmax_percentile = kwargs.pop('vmax_percentile', None)
+        if kwargs.pop('shared_scale', False) or vmax_percentile is not None:
+            vmin, vmax = colour_scale_limits(
+                cube, vmin=0 if vmin is None else vmin, vmax=vmax,
+                vmax_percentile=vmax_percentile)
+
+        return {'vmin': vmin, 'vmax': vmax}
+
     def _write_html(self, output_dir, metadata):
         """
         Write HTML page for plots using metadata outputs from plotting
@@ -214,13 +475,4 @@ class AshModelResult(metaclass=ABCMeta):
         :param output_dir: str, target directory for html file
         :param metadata: dict, metadata produced by plot function
         """
-        # Prepare HTML
-        html = render_html(self.source_data, metadata)
-
-        # Write to file
-        name = '_'.join(filter(None, (
-            metadata['attributes'].get('model_run_title'),
-            metadata['attributes'].get('quantity'),
-            "summary.html"))).replace(' ', '_')
-        output_file = Path(output_dir) / name
-        output_file.write_text(html)
+        write_html(self.source_data, output_dir, metadata)
@@ -0,0 +1,139 @@
+"""
+Least-recently-used cache of cubes with a memory budget.
+"""
+# coding: utf-8
+from collections import OrderedDict
+
+import numpy as np
+
+
+class CubeCache:
+    """
+    Cache of cubes, or None values, that keeps its realised data within a
+    memory budget by removing the least recently used cubes.  Lazy data are
+    not counted, as they are only read when used, and nor are data shared
+    with arrays held outside the cache, as removing their cubes would not
+    free them.  Cubes can be realised after they are added, so the size is
+    checked on every access.  The size of each cube, and whether it shares
+    its data, is found once for its realised data and kept.
+    """
+
+    def __init__(self, max_bytes=None, shared_arrays=None):
+        """
+        :param max_bytes: int; memory budget for realised data (default is
+            no limit).  The most recently used cube is always kept, even if
+            it is larger than the budget.
+        :param shared_arrays: callable returning iterable of np.ndarray;
+            arrays held outside the cache, e.g. source data that cached
+            cubes are views of (default is none).  It is only called when a
+            cube is first found with realised data.
+        """
+        self.max_bytes = max_bytes
+        self.shared_arrays = shared_arrays
+        self._cubes = OrderedDict()
+        # (realised data, bytes freed by removing the cube) for each key
+        self._sizes = {}
+
+    def __contains__(self, key):
+        return key in self._cubes
+
+    def __len__(self):
+        return len(self._cubes)
+
+    def get(self, key):
+        """
+        Return cube stored under key and mark it as most recently used.
+
+        :param key: hashable
+        :return: iris.cube.Cube or None
+        :raises KeyError: if key is not in the cache
+        """
+        self._cubes.move_to_end(key)
+        cube = self._cubes[key]
+        self._shrink()
+        return cube
+
+    def put(self, key, cube):
+        """
+        Store cube under key as most recently used, removing older cubes if
+        over budget.
+
+        :param key: hashable
+        :param cube: iris.cube.Cube or None
+        """
+        self._cubes[key] = cube
+        self._cubes.move_to_end(key)
+        self._shrink()
+
+    def pop(self, key, default=None):
+        """Remove and return cube stored under key, or default."""
+        self._sizes.pop(key, None)
+        return self._cubes.pop(key, default)
+
+    def clear(self):
+        """Remove all cubes."""
+        self._cubes.clear()
+        self._sizes.clear()
+
+    @property
+    def nbytes(self):
+        """
+        Memory used by realised data of cached cubes, that would be freed
+        by removing them.
+        """
+        return sum(self._freed_nbytes(key, cube) for key, cube in self._cubes.items())
+
+    def _freed_nbytes(self, key, cube):
+        """
+        Return memory freed by removing cube stored under key.  This is
+        calculated once for the realised data of the cube, as checking for
+        shared arrays goes through every one.
+        """
+        if cube is None or cube.has_lazy_data():
+            return 0
+
+        data = cube.data
+        kept = self._sizes.get(key)
+        if kept is None or kept[0] is not data:
+            shared = list(self.shared_arrays()) if self.shared_arrays else []
+            nbytes = 0 if _shares_data(cube, shared) else cube_nbytes(cube)
+            kept = self._sizes[key] = (data, nbytes)
+
+        return kept[1]
+
+    def _shrink(self):
+        """Remove least recently used cubes until within budget."""
+        if self.max_bytes is None:
+            return
+
+        while len(self._cubes) > 1 and self.nbytes > self.max_bytes:
+            key, _ = self._cubes.popitem(last=False)
+            self._sizes.pop(key, None)
+
+
+def cube_nbytes(cube):
+    """
+    Return memory used by the realised data of cube, including the mask, or
+    zero for lazy data.
+
+    :param cube: iris.cube.Cube or None
+    :return: int
+    """
+    if cube is None or cube.has_lazy_data():
+        return 0
+
+    data = cube.data
+    nbytes = data.nbytes
+    if np.ma.isMaskedArray(data) and data.mask is not np.ma.nomask:
+        nbytes += data.mask.nbytes
+
+    return nbytes
+
+
+def _shares_data(cube, arrays):
+    """Return whether realised data of cube may share memory with arrays."""
+    if cube is None or cube.has_lazy_data():
+        return False
+
+    data = cube.data
+    return any(np.may_share_memory(data, array) for array in arrays)
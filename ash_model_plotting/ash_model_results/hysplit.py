@@ -2,11 +2,15 @@
 Class to store ash model results.
 """
 # coding: utf-8
-from functools import lru_cache
+from collections import OrderedDict
 from pathlib import Path
+import threading
 from warnings import warn
 
 from cf_units import Unit
+import dask
+import dask.array as da
+import dask.system
 import iris
 import numpy as np
 
@@ -36,117 +40,212 @@ class HysplitAshModelResult(AshModelResult):
         self.source_data = Path(self.source_data)
         self._load_from_netcdf()
 
-    @property  # type: ignore
-    @lru_cache(maxsize=1)
-    def air_concentration(self):
+    def _classify_cube(self, cube):
         """
-        Cube containing air concentration data.
-        The lowest altitude in the cube corresponds to deposition.
-        :return: iris.cube.Cube
+        Yield (quantity, cube) for each quantity in cube.  The lowest
+        altitude corresponds to deposition and the others to air
+        concentration.
         """
-        air_concentration = iris.Constraint(
-            cube_func=lambda c: c.name() in self._air_concentration_names
-            )
+        if cube.name() not in self._air_concentration_names:
+            return
 
         above_ground = iris.Constraint(
             coord_values={'Top height of each layer': lambda cell: cell > 0})
+        ground_level = iris.Constraint(
+            coord_values={'Top height of each layer': lambda cell: cell == 0})
 
-        try:
-            valid_cubes = self.cubes.extract(air_concentration & above_ground)
-            cube = valid_cubes.concatenate_cube()
-        except ValueError:
-            # Return None if no cubes present
-            return
-
-        # Set attributes
-        cube.attributes['model_run_title'] = self._get_model_run_title(cube)
-        cube.attributes['quantity'] = 'Air Concentration'
-        cube.attributes['CF Standard Name'] = (
-            "mass_concentration_of_volcanic_ash_in_air")
-        cube.rename("mass_concentration_of_volcanic_ash_in_air")
-
-        if cube.units == '1' or cube.units == 'unknown':
-            new_units = Unit('g/m3')
-            warn(f"Source data has no units for air_concentration, "
-                 f"using {new_units}.")
-            cube.units = new_units
-
-        return cube
+        for quantity, constraint in (('air_concentration', above_ground),
+                                     ('total_deposition', ground_level)):
+            quantity_cube = cube.extract(constraint)
+            if quantity_cube is not None:
+                yield quantity, quantity_cube
 
-    @property  # type: ignore
-    @lru_cache(maxsize=1)
-    def total_column(self):
+    def _build_quantity(self, quantity):
         """
-        Cube containing total_column loading data.
-        For Hysplit data, the total column loading must be calculated
-        on-the-fly by summing the mass of volcanic ash at each zlevel.
-        :return: iris.cube.Cube
+        Concatenate the cubes for quantity into one cube.  For Hysplit data,
+        the total column loading must be calculated on-the-fly by summing the
+        mass of volcanic ash at each zlevel.
         """
+        if quantity != 'total_column':
+            return super()._build_quantity(quantity)
+
         if not self.air_concentration:
             # Return None if no cubes present
             return
 
         cube = self._calculate_total_column(self.air_concentration)
+        return self._prepare_quantity(quantity, cube)
 
-        cube.attributes['model_run_title'] = self._get_model_run_title(cube)
-        cube.attributes['quantity'] = 'Total Column Mass'
-        cube.attributes['CF Standard Name'] = (
-            "atmosphere_mass_content_of_volcanic_ash")
-        cube.rename("atmosphere_mass_content_of_volcanic_ash")
-
-        cube.units = self.air_concentration.units * Unit('m')
-        # cube.convert_units('g m-2')
+    def _prepare_quantity(self, quantity, cube):
+        """
+        Set attributes used for plotting and rename cube to standard name.
+        Missing air concentration units are assumed to be g/m3, and deposition
+        is converted to the cumulative sum (as original is per step).
+        """
+        cube = super()._prepare_quantity(quantity, cube)
+        cube.rename(cube.attributes['CF Standard Name'])
+
+        if quantity == 'air_concentration':
+            if cube.units == '1' or cube.units == 'unknown':
+                new_units = Unit('g/m3')
+                warn(f"Source data has no units for air_concentration, "
+                     f"using {new_units}.")
+                cube.units = new_units
+        else:
+            if quantity == 'total_deposition':
+                # Overwrite data to give cumulative sum (as original is per step)
+                cube.data = cumulative_sum(cube.lazy_data())
+            cube.units = self.air_concentration.units * Unit('m')
+            # cube.convert_units('g m-2')
 
         return cube
 
+    def plot_total_deposition(self, output_dir, file_ext='png',
+                              html=True, **kwargs):
+        """
+        Plot total deposition data to output directory.  The cumulative sum
+        is read one slice at a time in the parent process, in the order that
+        slices are plotted, so that each timestep is added to the running
+        total once (see cumulative_sum).  Schedules that do not plot the
+        earliest time first sum the earlier timesteps again for each slice.
+
+        See AshModelResult.plot_total_deposition for details.
+        """
+        kwargs.setdefault('realise_slices', True)
+        super().plot_total_deposition(output_dir, file_ext=file_ext,
+                                      html=html, **kwargs)
+
     @staticmethod
     def _calculate_total_column(cube):
         """
         Collapse a cube of air_concentration by summing the mass of volcanic ash at each zlevel.
+        The data stay lazy, so the sum is calculated chunk by chunk when used.
         """
         # Get thicknesses of zlevels
         zlevels = cube.coord('Top height of each layer')
         zlevel_thicknesses = np.concatenate((zlevels.points[:1],
-                                             np.diff(zlevels.points)))
+                                             np.diff(zlevels.points))).astype(np.float64)
 
-        # Setting weights for collapsed cube (should match shape of data array)
-        weights = np.ones(cube.data.shape)
-        for i, thickness in enumerate(zlevel_thicknesses):
-            weights[:, i, :, :] *= thickness
+        # Weight each layer by broadcasting thicknesses along the z axis
+        shape = np.ones(cube.ndim, dtype=int)
+        shape[cube.coord_dims(zlevels)[0]] = -1
+        weighted = cube.copy(data=cube.lazy_data() * zlevel_thicknesses.reshape(shape))
 
         # Collapsing cube
-        return cube.collapsed('Top height of each layer', iris.analysis.SUM,
-                              weights=weights)
+        return weighted.collapsed('Top height of each layer', iris.analysis.SUM)
 
-    @property  # type: ignore
-    @lru_cache(maxsize=1)
-    def total_deposition(self):
-        """
-        Cube containing total deposition loading data
-        :return: iris.cube.Cube
-        """
-        ash_data = iris.Constraint(
-            cube_func=lambda c: c.name() in self._air_concentration_names
-            )
 
-        ground_level = iris.Constraint(
-            coord_values={'Top height of each layer': lambda cell: cell == 0})
+def cumulative_sum(data, initial=None):
+    """
+    Return lazy cumulative sum of data along the time (first) axis.  Each
+    timestep is a separate chunk, read from a RunningSum, so computing the
+    sum at a timestep reads only the data up to that timestep, and
+    computing the timesteps one after another reads each of them once.
+
+    When new timesteps are appended to a run, pass the last timestep of the
+    earlier cumulative sum as initial and the new timesteps as data to
+    extend it without summing the earlier timesteps again.
+
+    :param data: np.ndarray or dask.array.Array; values for each timestep
+    :param initial: array with shape data.shape[1:]; total before the first
+        timestep (default is zero)
+    :return: dask.array.Array
+    """
+    running_sum = RunningSum(data, initial=initial)
+    meta = np.empty((0,) * running_sum.ndim, dtype=running_sum.dtype)
+    if running_sum.masked:
+        meta = np.ma.masked_array(meta)
 
-        try:
-            valid_cubes = self.cubes.extract(ash_data & ground_level)
-            cube = valid_cubes.concatenate_cube()
-        except ValueError:
-            # Return None if no cubes present
-            return
+    return da.from_array(running_sum, chunks=(1, *running_sum.shape[1:]),
+                         asarray=False, meta=meta, name=False)
 
-        # Set attributes
-        cube.attributes['model_run_title'] = self._get_model_run_title(cube)
-        cube.attributes['quantity'] = 'Total Deposition'
-        cube.attributes['CF Standard Name'] = "surface_volcanic_ash_amount"
-        cube.rename("surface_volcanic_ash_amount")
-        # Overwrite data to give cumulative sum (as original is per step)
-        cube.data = np.cumsum(cube.data, axis=0)
 
-        cube.units = self.air_concentration.units * Unit('m')
+class RunningSum:
+    """
+    Array-like cumulative sum of data along the time (first) axis, for use
+    with dask.array.from_array.  The totals of the last few timesteps read
+    are kept, so that reading a timestep after the one before it adds only
+    its own values.  Reading an earlier timestep than those kept sums again
+    from the start.
+
+    As by np.cumsum of masked data, masked values count as zero and the
+    total at a timestep is masked where the data at that timestep are.
+    """
+    def __init__(self, data, initial=None, window=None):
+        """
+        :param data: np.ndarray or dask.array.Array; values for each timestep
+        :param initial: array with shape data.shape[1:]; total before the
+            first timestep (default is zero)
+        :param window: int; number of timestep totals kept (default is 8, or
+            twice the number of dask threads if more).  Dask may read the
+            chunks of a whole array a little out of order, and these are
+            still found.
+        """
+        self.data = data
+        self.initial = initial
+        self.window = window or max(8, 2 * dask.system.CPU_COUNT)
+        self.shape = data.shape
+        self.ndim = data.ndim
+        self.dtype = np.cumsum(np.zeros(1, dtype=data.dtype)).dtype
+        if initial is not None:
+            self.dtype = np.result_type(self.dtype, np.asanyarray(initial).dtype)
+        self.masked = isinstance(da.utils.meta_from_array(data), np.ma.MaskedArray)
+        self._totals = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # Totals and the lock are not sent to other processes
+        state = self.__dict__.copy()
+        state.update(_totals=OrderedDict(), _lock=None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def __getitem__(self, key):
+        key = key if isinstance(key, tuple) else (key,)
+        steps, other = key[0], key[1:]
+        if not isinstance(steps, slice):
+            return self._total(steps)[other]
+
+        totals = [self._total(step)[other]
+                  for step in range(*steps.indices(self.shape[0]))]
+        if not totals:
+            return np.zeros((0, *self.shape[1:]), dtype=self.dtype)[(slice(None), *other)]
+        return np.ma.stack(totals) if self.masked else np.stack(totals)
+
+    def _total(self, step):
+        """
+        Return a copy of the cumulative sum at step, starting from the
+        latest total kept before it.
 
-        return cube
+        :param step: int; index along the time axis
+        :return: np.ndarray or np.ma.MaskedArray
+        """
+        step = range(self.shape[0])[step]
+        with self._lock:
+            if step not in self._totals:
+                earlier = [kept for kept in self._totals if kept < step]
+                start = max(earlier, default=-1)
+                if start >= 0:
+                    total = np.ma.getdata(self._totals[start])
+                elif self.initial is not None:
+                    total = np.ma.filled(self.initial, 0).astype(self.dtype)
+                else:
+                    total = np.zeros(self.shape[1:], dtype=self.dtype)
+
+                for position in range(start + 1, step + 1):
+                    values, = dask.compute(self.data[position])
+                    total = total + np.ma.filled(values, 0)
+                    self._keep(position, np.ma.masked_array(total, mask=np.ma.getmaskarray(values))
+                               if self.masked else total)
+
+            self._totals.move_to_end(step)
+            return self._totals[step].copy()
+
+    def _keep(self, step, total):
+        """Keep total of step, dropping the least recently used totals."""
+        self._totals[step] = total
+        while len(self._totals) > self.window:
+            self._totals.popitem(last=False)
@@ -2,15 +2,24 @@
 Class to store ash model results.
 """
 # coding: utf-8
-from functools import lru_cache
+from functools import partial
+from itertools import chain
 from pathlib import Path
 
 import iris
+from iris.cube import CubeList
 
 from ash_model_plotting.ash_model_results import (
     AshModelResult,
     AshModelResultError,
 )
+from ash_model_plotting.ash_model_results.name_cache import (
+    cache_key,
+    read_cached_cubes,
+    write_cached_cubes,
+)
+from ash_model_plotting.ash_model_results.name_fields import load_name_file
+from ash_model_plotting.plotting import close_pool, get_pool, running_pool
 
 
 class NameAshModelResult(AshModelResult):
@@ -29,9 +38,40 @@ class NameAshModelResult(AshModelResult):
         'VOLCANIC_ASH_TOTAL_DEPOSITION'
     }
 
+    def __init__(self, source_data, workers=None, fast_reader=False, cache_dir=None,
+                 cache_bytes=None, memory_limit=None):
+        """
+        :param source_data: path to NetCDF file or NAME .txt file, or list of
+            paths to NAME .txt files
+        :param workers: int; number of processes used to load lists of NAME
+            files (default is the shared worker pool if it is running, e.g.
+            inside plotting.worker_pool, otherwise the current process)
+        :param fast_reader: bool; parse the data lines of NAME Fields files
+            with the NumPy-based reader in name_fields
+        :param cache_dir: str or Path; directory for cache of parsed NAME .txt
+            files, which are read from the cache if unchanged (default is no
+            cache)
+        :param cache_bytes: int; memory budget for realised data of cached
+            quantity cubes (default is no limit)
+        :param memory_limit: int or str e.g. '16GB'; run out-of-core.  NAME
+            .txt files that are not read from cache_dir are loaded lazily and
+            each file is parsed when its data are used.  The data lines of
+            NAME files are parsed in blocks sized to fit the limit.  The limit
+            only sizes chunks and blocks and is not an enforced ceiling.
+        """
+        self.fast_reader = fast_reader
+        self.cache_dir = cache_dir
+        super().__init__(source_data, workers=workers, cache_bytes=cache_bytes,
+                         memory_limit=memory_limit)
+
     def __repr__(self):
         return f"NameAshModelResult({self.source_data})"
 
+    @property
+    def _lazy_text(self):
+        """Load NAME .txt files lazily in out-of-core mode without cache."""
+        return self.memory_limit is not None and not self.cache_dir
+
     def _load_cubes(self):
         """
         Load cubes from single NetCDF file or list of NAME-format .txt files
@@ -39,7 +79,11 @@ class NameAshModelResult(AshModelResult):
         # TODO: improve error handling here
         # Load from many NAME files
         if isinstance(self.source_data, list):
-            self.cubes = iris.load(self.source_data)
+            self.cubes = load_name_files(self.source_data, workers=self.workers,
+                                         fast_reader=self.fast_reader,
+                                         cache_dir=self.cache_dir,
+                                         lazy=self._lazy_text,
+                                         block_bytes=self._chunk_bytes())
             return
 
         # Load from NetCDF
@@ -49,77 +93,93 @@ class NameAshModelResult(AshModelResult):
         else:
             # Assuming single NAME .txt file
             try:
-                self.cubes = iris.load(str(source_data))
+                self.cubes = load_name_files([source_data], workers=1,
+                                             fast_reader=self.fast_reader,
+                                             cache_dir=self.cache_dir,
+                                             lazy=self._lazy_text,
+                                             block_bytes=self._chunk_bytes())
             except OSError:
                 msg = f"{source_data.absolute()} not found"
                 raise AshModelResultError(msg)
 
-    @property  # type: ignore
-    @lru_cache(maxsize=1)
-    def air_concentration(self):
-        """
-        Cube containing air concentration data
-        :return: iris.cube.Cube
-        """
-        air_concentration = iris.Constraint(
-            cube_func=lambda c: c.name() in self._air_concentration_names
-            )
-
-        has_zlevel = iris.Constraint(cube_func=self._has_zlevels)
-
-        try:
-            valid_cubes = self.cubes.extract(air_concentration & has_zlevel)
-            cube = valid_cubes.concatenate_cube()
-            cube.attributes['model_run_title'] = self._get_model_run_title(cube)
-            cube.attributes['quantity'] = 'Air Concentration'
-            cube.attributes['CF Standard Name'] = (
-                "mass_concentration_of_volcanic_ash_in_air")
-            return cube
-        except ValueError:
-            # Return None if no cubes present
-            return
-
-    @property  # type: ignore
-    @lru_cache(maxsize=1)
-    def total_column(self):
-        """
-        Cube containing total_column loading data
-        :return: iris.cube.Cube
-        """
-        total_column = iris.Constraint(
-            cube_func=lambda c: c.name() in self._total_column_names
-        )
-
-        try:
-            valid_cubes = self.cubes.extract(total_column)
-            cube = valid_cubes.concatenate_cube()
-            cube.attributes['model_run_title'] = self._get_model_run_title(cube)
-            cube.attributes['quantity'] = 'Total Column Mass'
-            cube.attributes['CF Standard Name'] = (
-                "atmosphere_mass_content_of_volcanic_ash")
-            return cube
-        except ValueError:
-            # Return None if no cubes present
-            return
-
-    @property  # type: ignore
-    @lru_cache(maxsize=1)
-    def total_deposition(self):
-        """
-        Cube containing total deposition loading data
-        :return: iris.cube.Cube
-        """
-        total_deposition = iris.Constraint(
-            cube_func=lambda c: c.name() in self._total_deposition_names
-        )
 
+def load_name_files(filenames, workers=None, fast_reader=False, cache_dir=None,
+                    lazy=False, block_bytes=None):
+    """
+    Load cubes from NAME-format .txt files, optionally parsing files in
+    parallel in the shared worker pool.  The cubes from each file are merged
+    in the parent process, so the result is the same as iris.load(filenames),
+    including the order of the cubes, which does not depend on the order of
+    filenames.
+
+    :param filenames: list of str or Path; NAME files
+    :param workers: int; number of worker processes.  By default the shared
+        worker pool is used if it is already running, e.g. inside
+        plotting.worker_pool, and files are otherwise loaded in the current
+        process, so that scripts without a __main__ guard can load files.
+        Files are loaded in the current process if this is 1.  A pool that
+        is started for this call is stopped before it returns.
+    :param fast_reader: bool; read Fields files with name_fields.load_name_file
+    :param cache_dir: str or Path; directory for cache of parsed files.  Files
+        in the cache are not parsed again and newly parsed files are added.
+    :param lazy: bool; only read file headers, and give cubes lazy data that
+        parse each file when its data are used.  Options other than
+        block_bytes are ignored.
+    :param block_bytes: int; parse the data lines of Fields files in blocks
+        whose values take at most this many bytes.  Files are then read with
+        name_fields.load_name_file, as the iris loader cannot limit memory.
+    :return: iris.cube.CubeList
+    """
+    # iris.load sorts the filenames before loading them (see
+    # iris.loading._generate_cubes), so the files are merged in sorted order
+    # whatever the order given
+    filenames = sorted(str(filename) for filename in filenames)
+    if lazy:
+        return CubeList(chain.from_iterable(
+            load_name_file(filename, lazy=True, block_bytes=block_bytes)
+            for filename in filenames)).merge(unique=False)
+    fast_reader = fast_reader or block_bytes is not None
+    load_raw = (partial(load_name_file, block_bytes=block_bytes) if fast_reader
+                else iris.load_raw)
+
+    raw_cubes = {}
+    if cache_dir:
+        keys = {filename: cache_key(filename) for filename in filenames}
+        for filename, key in keys.items():
+            cubes = read_cached_cubes(cache_dir, key)
+            if cubes is not None:
+                raw_cubes[filename] = cubes
+    to_parse = [filename for filename in filenames if filename not in raw_cubes]
+
+    # A pool is only used for 2 or more files, and one started here is
+    # stopped again, so that no worker processes are left running
+    pool = None
+    started = False
+    if len(to_parse) > 1:
+        if workers is None:
+            pool = running_pool()
+        elif workers > 1:
+            previous = running_pool()
+            pool = get_pool(workers)
+            started = pool is not previous
+
+    if pool is None:
+        if not (fast_reader or cache_dir):
+            return iris.load(filenames)
+        parsed = map(load_raw, to_parse)
+    else:
         try:
-            valid_cubes = self.cubes.extract(total_deposition)
-            cube = valid_cubes.concatenate_cube()
-            cube.attributes['model_run_title'] = self._get_model_run_title(cube)
-            cube.attributes['quantity'] = 'Total Deposition'
-            cube.attributes['CF Standard Name'] = "surface_volcanic_ash_amount"
-            return cube
-        except ValueError:
-            # Return None if no cubes present
-            return
+            parsed = pool.map(load_raw, to_parse)
+        finally:
+            if started:
+                close_pool()
+
+    for filename, cubes in zip(to_parse, parsed):
+        if cache_dir:
+            write_cached_cubes(cache_dir, keys[filename], cubes)
+        raw_cubes[filename] = cubes
+
+    # Merging is how iris.load combines the raw cubes from all files, which
+    # keeps duplicate fields as separate cubes
+    return CubeList(chain.from_iterable(
+        raw_cubes[filename] for filename in filenames)).merge(unique=False)
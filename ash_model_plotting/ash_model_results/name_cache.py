@@ -0,0 +1,120 @@
+"""
+On-disk cache of cubes parsed from NAME text files.  Each file is stored in a
+directory named by a hash of its path, size, modification time and contents,
+with the data of each cube in a .npy file that is memory-mapped on reading
+and the cubes without their data in a pickle file.
+
+Pickle files can run arbitrary code when loaded, so only use cache
+directories that are not writable by other users.
+"""
+# coding: utf-8
+import hashlib
+import os
+from pathlib import Path
+import pickle
+import shutil
+import tempfile
+
+import dask
+import dask.array as da
+import iris
+from iris.cube import CubeList
+import numpy as np
+
+CACHE_VERSION = 1
+CUBES_FILE = 'cubes.pkl'
+
+
+def cache_key(filename):
+    """
+    Return key that identifies the contents of filename.  The key changes if
+    the file is moved, modified or replaced, or if the versions of the
+    libraries whose objects are pickled change.
+
+    :param filename: str or Path; NAME file
+    :return: str; hexadecimal digest
+    """
+    filename = Path(filename).absolute()
+    stat = filename.stat()
+
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"{CACHE_VERSION}|{iris.__version__}|{dask.__version__}|{np.__version__}|"
+                  f"{filename}|{stat.st_size}|{stat.st_mtime_ns}|".encode('utf-8'))
+    with open(filename, 'rb') as file_handle:
+        for block in iter(lambda: file_handle.read(2 ** 20), b''):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+
+def read_cached_cubes(cache_dir, key):
+    """
+    Return cubes stored under key, with data memory-mapped from the cache,
+    or None if they are not in the cache or the entry cannot be read.
+
+    :param cache_dir: str or Path; cache directory
+    :param key: str; from cache_key
+    :return: iris.cube.CubeList or None
+    """
+    entry = Path(cache_dir) / key
+    try:
+        with open(entry / CUBES_FILE, 'rb') as file_handle:
+            cubes = pickle.load(file_handle)
+
+        for i, cube in enumerate(cubes):
+            # Copy-on-write mapping so that changes to the data never reach the
+            # cache
+            data = np.load(entry / f'{i}.npy', mmap_mode='c')
+            mask_file = entry / f'{i}_mask.npy'
+            if mask_file.exists():
+                data = np.ma.MaskedArray(data, mask=np.load(mask_file, mmap_mode='c'))
+            cube.data = data
+    except Exception:
+        # Missing, partial or corrupt entries, or entries pickled by other
+        # library versions (e.g. AttributeError, ImportError), are parsed and
+        # written again
+        return None
+
+    return cubes
+
+
+def write_cached_cubes(cache_dir, key, cubes):
+    """
+    Store cubes under key.  The entry is written to a temporary directory and
+    renamed into place, so that readers never see partial entries.  An
+    existing entry that cannot be read is replaced.
+
+    :param cache_dir: str or Path; cache directory
+    :param key: str; from cache_key
+    :param cubes: iris.cube.CubeList
+    """
+    cache_dir = Path(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    entry = cache_dir / key
+
+    tmp_entry = Path(tempfile.mkdtemp(dir=cache_dir, prefix=f'.{key}.'))
+    try:
+        stripped = CubeList()
+        for i, cube in enumerate(cubes):
+            data = cube.data
+            np.save(tmp_entry / f'{i}.npy', np.ma.getdata(data))
+            if np.ma.is_masked(data):
+                np.save(tmp_entry / f'{i}_mask.npy', np.ma.getmaskarray(data))
+            # Small lazy placeholder keeps the pickle independent of data size
+            stripped.append(cube.copy(data=da.zeros(cube.shape, dtype=data.dtype)))
+
+        with open(tmp_entry / CUBES_FILE, 'wb') as file_handle:
+            pickle.dump(stripped, file_handle, protocol=pickle.HIGHEST_PROTOCOL)
+
+        try:
+            os.replace(tmp_entry, entry)
+        except OSError:
+            if read_cached_cubes(cache_dir, key) is not None:
+                # Another process stored the same entry first
+                return
+            # Partial or corrupt entry, e.g. from an interrupted copy of the
+            # cache directory
+            shutil.rmtree(entry, ignore_errors=True)
+            os.replace(tmp_entry, entry)
+    finally:
+        shutil.rmtree(tmp_entry, ignore_errors=True)
@@ -0,0 +1,227 @@
+"""
+Reader for NAME Fields (gridded) output files that parses the data block
+with NumPy in one pass, instead of line by line as in the iris NAME loader.
+Files are loaded by iris, which parses the header and builds the cubes, with
+only the data-line parser swapped for the one here.
+"""
+# coding: utf-8
+from collections import OrderedDict
+from contextlib import contextmanager
+import inspect
+from itertools import chain, islice
+import os
+import threading
+import warnings
+
+import dask
+import dask.array as da
+import dask.system
+import iris
+from iris.fileformats import name_loaders
+import numpy as np
+
+# Data of Fields files parsed for lazy cubes, so that the fields of a file,
+# which may be computed one by one, share a single parse.  A file is dropped
+# once each of its fields has been read, and the least recently used file is
+# dropped when more than _MAX_PARSED_FILES are kept, e.g. when a field is
+# read again and the others are not.
+_parsed_files = OrderedDict()
+_parsed_files_lock = threading.Lock()
+_MAX_PARSED_FILES = max(8, 2 * dask.system.CPU_COUNT)
+
+# The iris NAME Fields loaders read the data lines of a file with this
+# function, which is replaced while loading.  It is private to iris, so the
+# NumPy reader is only used if it has the signature that this module was
+# tested with (iris 3.x) and iris is used unchanged otherwise.
+_IRIS_READER = '_read_data_arrays'
+_IRIS_READER_PARAMETERS = ('file_handle', 'n_arrays', 'shape')
+_iris_reader_lock = threading.Lock()
+
+
+def load_name_file(filename, lazy=False, block_bytes=None):
+    """
+    Load raw cubes from a NAME file, as iris.load_raw(filename).  The data
+    lines of NAME Fields files (e.g. Air_Conc_grid, Fields_grid)
+    are parsed with the NumPy reader and everything else by iris.
+
+    :param filename: str or Path; NAME file
+    :param lazy: bool; only read the header of Fields files, and give the
+        cubes lazy data that reads the data block of the file when computed
+    :param block_bytes: int; parse the data block of Fields files in blocks
+        of lines whose values take at most this many bytes (default is all
+        lines at once)
+    :return: iris.cube.CubeList
+    """
+    filename = str(filename)
+
+    def read_data_arrays(file_handle, n_arrays, shape):
+        if lazy:
+            # The fields share one parse of the file, whether they are
+            # computed together or one by one, e.g. when plotting slices
+            return [da.from_delayed(
+                        dask.delayed(_read_field)(filename, i, n_arrays, shape, block_bytes),
+                        shape=shape, dtype=np.float32)
+                    for i in range(n_arrays)]
+        return list(_read_data_arrays(file_handle, n_arrays, shape,
+                                      block_bytes=block_bytes))
+
+    with _iris_reader(read_data_arrays):
+        return iris.load_raw(filename)
+
+
+def has_iris_reader():
+    """
+    Return True if the iris NAME loader parses data lines with a function of
+    the expected signature, which load_name_file can replace.
+    """
+    reader = getattr(name_loaders, _IRIS_READER, None)
+    if not callable(reader):
+        return False
+    try:
+        parameters = tuple(inspect.signature(reader).parameters)
+    except (TypeError, ValueError):
+        return False
+    return parameters == _IRIS_READER_PARAMETERS
+
+
+@contextmanager
+def _iris_reader(read_data_arrays):
+    """
+    Replace the data-line reader of the iris NAME loader with
+    read_data_arrays within the block.  Loads are serialised, as the reader is
+    a module attribute of iris.  If iris does not have the expected reader, a
+    warning is given and iris parses the data lines itself.
+    """
+    if not has_iris_reader():
+        warnings.warn(f"iris {iris.__version__} NAME loader has no "
+                      f"{_IRIS_READER}{_IRIS_READER_PARAMETERS}; "
+                      "data lines are parsed by iris")
+        yield
+        return
+
+    with _iris_reader_lock:
+        original = getattr(name_loaders, _IRIS_READER)
+        setattr(name_loaders, _IRIS_READER, read_data_arrays)
+        try:
+            yield
+        finally:
+            setattr(name_loaders, _IRIS_READER, original)
+
+
+class _ParsedFile:
+    """
+    Data arrays of a Fields file, parsed on first use, and the indices of the
+    fields not yet read.  The lock is per file, so that different files are
+    parsed concurrently.
+    """
+    def __init__(self, n_arrays):
+        self.lock = threading.Lock()
+        self.data_arrays = None
+        self.unread = set(range(n_arrays))
+
+
+def _read_field(filename, index, n_arrays, shape, block_bytes=None):
+    """
+    Return a copy of one field of a NAME Fields file.  The file is parsed
+    once for all of its fields and kept until each field has been read.
+
+    :param filename: str; NAME file
+    :param index: int; field to return
+    :param n_arrays: int; number of fields in the file
+    :param shape: tuple; (Y grid size, X grid size)
+    :param block_bytes: int; see _read_data_arrays
+    :return: np.ndarray of float32; (Y, X)
+    """
+    stat = os.stat(filename)
+    key = (filename, stat.st_size, stat.st_mtime_ns)
+    with _parsed_files_lock:
+        parsed = _parsed_files.get(key)
+        if parsed is None:
+            parsed = _parsed_files[key] = _ParsedFile(n_arrays)
+            while len(_parsed_files) > _MAX_PARSED_FILES:
+                _parsed_files.popitem(last=False)
+        _parsed_files.move_to_end(key)
+
+    with parsed.lock:
+        if parsed.data_arrays is None:
+            parsed.data_arrays = _read_stacked_data_arrays(filename, n_arrays, shape,
+                                                           block_bytes)
+        field = parsed.data_arrays[index].copy()
+        parsed.unread.discard(index)
+        done = not parsed.unread
+
+    if done:
+        with _parsed_files_lock:
+            if _parsed_files.get(key) is parsed:
+                del _parsed_files[key]
+    return field
+
+
+def _read_stacked_data_arrays(filename, n_arrays, shape, block_bytes=None):
+    """
+    Return the data arrays of a NAME Fields file stacked into one 3D array.
+
+    :param filename: str; NAME file
+    :param n_arrays: int; number of fields
+    :param shape: tuple; (Y grid size, X grid size)
+    :param block_bytes: int; see _read_data_arrays
+    :return: np.ndarray of float32; (field, Y, X)
+    """
+    with open(filename, "r") as file_handle:
+        name_loaders.read_header(file_handle)
+        return _read_data_arrays(_data_lines(file_handle), n_arrays, shape,
+                                 block_bytes=block_bytes)
+
+
+def _data_lines(file_handle):
+    """
+    Return iterator over the data lines of a Fields file, skipping the
+    column headings after the header, which do not start with a grid index.
+    """
+    for line in file_handle:
+        try:
+            float(line.split(",", 1)[0])
+        except ValueError:
+            continue
+        return chain([line], file_handle)
+    return iter(())
+
+
+def _read_data_arrays(file_handle, n_arrays, shape, block_bytes=None):
+    """
+    Return the data in the remaining lines of file_handle as a 2D array for
+    each field.  Each line holds the 1-based X and Y grid indices, the
+    longitude and latitude and a value for each field.  Grid cells without a
+    line are zero.
+
+    :param file_handle: file object positioned at first line of data, or
+        iterator over the data lines
+    :param n_arrays: int; number of fields
+    :param shape: tuple; (Y grid size, X grid size)
+    :param block_bytes: int; parse the lines in blocks whose parsed values
+        take at most this many bytes, so that the memory used on top of the
+        data arrays is bounded (default is all lines at once)
+    :return: np.ndarray of float32; (field, Y, X)
+    """
+    # Longitude and latitude columns are not needed
+    usecols = (0, 1, *range(4, 4 + n_arrays))
+    # Values are parsed as float64
+    rows = None if block_bytes is None else max(block_bytes // (8 * len(usecols)), 1)
+    data_arrays = np.zeros((n_arrays, *shape), dtype=np.float32)
+
+    # Files where every value is zero have no data lines, as does the block
+    # after the last line
+    with warnings.catch_warnings():
+        warnings.filterwarnings('ignore', message='loadtxt: input contained no data')
+        while True:
+            lines = file_handle if rows is None else islice(file_handle, rows)
+            table = np.loadtxt(lines, delimiter=",", ndmin=2, usecols=usecols)
+
+            # Grid positions are truncated to integers as by iris
+            x = table[:, 0].astype(int) - 1
+            y = table[:, 1].astype(int) - 1
+            for i in range(n_arrays):
+                data_arrays[i, y, x] = table[:, 2 + i]
+
+            if rows is None or len(table) < rows:
+                return data_arrays
@@ -0,0 +1,553 @@
+"""
+Statistics across an ensemble of ash model results, calculated for each grid
+cell.  Members are read one at a time and folded into running accumulators,
+so memory use does not grow with the number of members.  The mean and
+standard deviation are exact, using Welford's algorithm.  The standard
+deviation is that of the members as a population (ddof=0, as np.std), not
+the sample estimate.  Percentiles are exact for small ensembles and are
+otherwise estimated from a histogram of the values in each cell, which is
+never larger than the values of the members it counts.  Estimates are within
+one histogram bin, a factor of about 2.2 with BIN_EDGES, of the nearest-rank
+percentile (see HistogramSketch.percentile).  The probability of
+exceeding concentration thresholds is the fraction of members above each
+threshold, from integer counts.
+
+Run as a script to calculate and plot exceedance probabilities.
+"""
+# coding: utf-8
+import argparse
+from pathlib import Path
+
+import cf_units
+import iris.coords
+from iris.cube import CubeList
+import numpy as np
+
+from ash_model_plotting.ash_model_results import MODEL_TYPES, AshModelResultError
+from ash_model_plotting.ash_model_results.ash_model_result import QUANTITIES
+from ash_model_plotting.name_to_netcdf import save_compressed
+from ash_model_plotting.plotting import (
+    VAAC_THRESHOLDS,
+    plot_3d_cube,
+    plot_4d_cube,
+    worker_pool,
+    write_html,
+)
+
+# Labels for statistics, used in the quantity attribute of their cubes
+STATISTICS = {
+    'mean': 'Ensemble Mean',
+    'minimum': 'Ensemble Minimum',
+    'maximum': 'Ensemble Maximum',
+    'standard_deviation': 'Ensemble Standard Deviation',
+}
+PERCENTILES = (5, 50, 95)
+
+# Edges of the histogram bins used to estimate percentiles, with 3 bins per
+# decade from the default mask_less value of the plots.  Values below the
+# first edge and above the last edge are counted in two extra bins.
+BIN_EDGES = np.geomspace(1e-8, 1e2, 31)
+
+
+def ensemble_statistics(results, quantities=tuple(QUANTITIES), percentiles=PERCENTILES,
+                        bin_edges=BIN_EDGES, title=None):
+    """
+    Calculate ensemble statistics for each grid cell of quantities from a
+    sequence of ash model results.  Results are read in turn, so pass a
+    generator e.g. (NameAshModelResult(files) for files in member_files) to
+    hold only one member in memory.
+
+    :param results: iterable of AshModelResult; ensemble members on the same
+        grid
+    :param quantities: tuple of str; keys of QUANTITIES.  Quantities that no
+        member has are left out.
+    :param percentiles: tuple of float; percentiles to estimate, between 0
+        and 100
+    :param bin_edges: np.ndarray; increasing edges of histogram bins used to
+        estimate percentiles
+    :param title: str; model_run_title attribute of statistics cubes
+        (default is title of first member)
+    :return: dict; {quantity: iris.cube.CubeList of statistics cubes}
+    :raises ValueError: if there are no members, or members do not all have
+        a quantity or have different grids
+    """
+    accumulators = {quantity: EnsembleStatistics(percentiles, bin_edges)
+                    for quantity in quantities}
+
+    n_members = 0
+    for result in results:
+        n_members += 1
+        for quantity, accumulator in accumulators.items():
+            cube = getattr(result, quantity)
+            if cube is not None:
+                accumulator.add(cube)
+
+    if not n_members:
+        raise ValueError("No ensemble members")
+
+    statistics = {}
+    for quantity, accumulator in accumulators.items():
+        if accumulator.count == 0:
+            continue
+        if accumulator.count != n_members:
+            raise ValueError(f"Only {accumulator.count} of {n_members} "
+                             f"ensemble members have {quantity}")
+        statistics[quantity] = accumulator.cubes(title=title)
+
+    return statistics
+
+
+def exceedance_probabilities(results, thresholds=VAAC_THRESHOLDS, title=None):
+    """
+    Calculate the probability of air concentration exceeding each threshold
+    in each grid cell, as the fraction of ensemble members above it.  Each
+    member's air concentration is compared with all thresholds in one pass
+    and only the counts are kept.  Results are read in turn, so pass a
+    generator to hold only one member in memory.
+
+    :param results: iterable of AshModelResult; ensemble members on the same
+        grid
+    :param thresholds: tuple of float; air concentration thresholds in g/m3
+        (default is the VAAC colour scheme thresholds)
+    :param title: str; model_run_title attribute of probability cubes
+        (default is title of first member)
+    :return: iris.cube.CubeList; probability cube for each threshold
+    :raises ValueError: if there are no members, or members do not have air
+        concentration or have different grids
+    """
+    counts = ExceedanceCounts(thresholds)
+    for result in results:
+        cube = result.air_concentration
+        if cube is None:
+            raise ValueError("Ensemble member does not have air_concentration")
+        counts.add(cube)
+
+    if not counts.count:
+        raise ValueError("No ensemble members")
+
+    return counts.cubes(title=title)
+
+
+class EnsembleStatistics:
+    """
+    Running per-cell statistics of the cubes of one quantity from each
+    ensemble member.  Masked values are treated as no ash.
+    """
+
+    def __init__(self, percentiles=PERCENTILES, bin_edges=BIN_EDGES):
+        """
+        :param percentiles: tuple of float; percentiles to estimate
+        :param bin_edges: np.ndarray; increasing edges of histogram bins used
+            to estimate percentiles
+        """
+        self.percentiles = tuple(percentiles)
+        self.bin_edges = np.asarray(bin_edges, dtype=np.float64)
+        self.count = 0
+        self.template = None
+        self._mean = None
+        self._m2 = None
+        self._minimum = None
+        self._maximum = None
+        self._sketch = None
+
+    def add(self, cube):
+        """
+        Add member cube to the statistics.
+
+        :param cube: iris.cube.Cube
+        :raises ValueError: if cube has a different grid from earlier members
+        """
+        data = _member_data(cube)
+
+        if self.template is None:
+            self.template = _empty_template(cube, data.dtype)
+            self.count = 1
+            self._mean = data.astype(np.float64)
+            self._m2 = np.zeros(cube.shape)
+            self._minimum = data.copy()
+            self._maximum = data.copy()
+            if self.percentiles:
+                self._sketch = HistogramSketch(cube.shape, self.bin_edges)
+                self._sketch.add(data)
+            return
+
+        _check_grid(self.template, cube)
+        self.count += 1
+
+        # Welford's update of mean and sum of squared differences
+        delta = data - self._mean
+        self._mean += delta / self.count
+        self._m2 += delta * (data - self._mean)
+        np.minimum(self._minimum, data, out=self._minimum)
+        np.maximum(self._maximum, data, out=self._maximum)
+        if self._sketch is not None:
+            self._sketch.add(data)
+
+    def cubes(self, title=None):
+        """
+        Return cubes of the statistics, with the metadata and coordinates of
+        the first member.  Each has its statistic in the quantity attribute
+        and a cell method over the ensemble members, so that the cubes can
+        be plotted with plot_3d_cube and plot_4d_cube.
+
+        :param title: str; model_run_title attribute (default is title of
+            first member)
+        :return: iris.cube.CubeList; mean, minimum, maximum, population
+            standard deviation (ddof=0) and percentiles in that order
+        """
+        if self.template is None:
+            return CubeList()
+
+        cubes = CubeList([
+            self._statistic_cube(self._mean, 'mean', title),
+            self._statistic_cube(self._minimum, 'minimum', title),
+            self._statistic_cube(self._maximum, 'maximum', title),
+            self._statistic_cube(np.sqrt(self._m2 / self.count),
+                                 'standard_deviation', title)])
+        for percentile in self.percentiles:
+            data = self._sketch.percentile(percentile, self._minimum, self._maximum)
+            cubes.append(self._statistic_cube(data, 'percentile', title, percentile))
+
+        return cubes
+
+    def _statistic_cube(self, data, statistic, title, percentile=None):
+        """Return copy of template cube with statistic data and metadata."""
+        cube = self.template.copy(data=data.astype(self.template.dtype))
+
+        if percentile is None:
+            label = STATISTICS[statistic]
+            cell_method = iris.coords.CellMethod(statistic, coords='realization')
+        else:
+            label = f'Ensemble {percentile:g} Percentile'
+            cell_method = iris.coords.CellMethod(
+                statistic, coords='realization', comments=f'{percentile:g}')
+        cube.add_cell_method(cell_method)
+
+        quantity = cube.attributes.get('quantity')
+        cube.attributes['quantity'] = f'{quantity} {label}' if quantity else label
+        if title is not None:
+            cube.attributes['model_run_title'] = title
+        cube.attributes['ensemble_size'] = self.count
+
+        return cube
+
+
+class HistogramSketch:
+    """
+    Histogram of the values in each cell, from which percentiles are
+    estimated.  Counts take one byte per bin per cell, e.g. 32 bytes per
+    cell with the default BIN_EDGES, the size of 8 float32 members, and
+    two bytes per bin once there are 255 values.  This does not grow with
+    the number of values added.
+
+    Until the counts would be smaller, the values themselves are kept
+    instead, and give exact percentiles.  The sketch is therefore never
+    larger than the values added.
+    """
+
+    def __init__(self, shape, bin_edges=BIN_EDGES):
+        """
+        :param shape: tuple; grid shape
+        :param bin_edges: np.ndarray; increasing edges of histogram bins
+        """
+        self.bin_edges = np.asarray(bin_edges, dtype=np.float64)
+        self.shape = tuple(shape)
+        self.count = 0
+        self.counts = None
+        self._values = []
+
+    @property
+    def nbytes(self):
+        """Bytes used by the values or counts."""
+        if self.counts is not None:
+            return self.counts.nbytes
+        return sum(values.nbytes for values in self._values)
+
+    def add(self, data):
+        """
+        Count values of data in their bins, or keep them while that takes
+        less memory than the counts.
+
+        :param data: np.ndarray; values on the grid
+        """
+        if self.counts is None:
+            counts_bytes = (len(self.bin_edges) + 1) * int(np.prod(self.shape))
+            if self.nbytes + data.nbytes <= counts_bytes:
+                self._values.append(np.array(data))
+                self.count += 1
+                return
+            # Values so far are counted and only counts are kept from now on
+            self.counts = np.zeros((len(self.bin_edges) + 1, *self.shape), dtype=np.uint8)
+            values, self._values, self.count = self._values, [], 0
+            for kept in values:
+                self._count_values(kept)
+
+        self._count_values(data)
+
+    def _count_values(self, data):
+        """Add one to the count of the bin of each value of data."""
+        self.counts = _widen_counts(self.counts, self.count)
+        self.count += 1
+
+        # Each cell has one value, so the flat indices are all different
+        bins = np.searchsorted(self.bin_edges, data.ravel(), side='right')
+        cells = np.arange(data.size)
+        self.counts.reshape(len(self.counts), -1)[bins, cells] += 1
+
+    def percentile(self, percentile, minimum, maximum):
+        """
+        Estimate percentile of the values in each cell, by linear
+        interpolation within the bin that holds it.  The outer bins are
+        bounded by the minimum and maximum values.  The percentile is exact,
+        as np.percentile, if the values are still kept.
+
+        Once values are counted, the estimate is in the same bin as the
+        nearest-rank percentile, the value of rank ceil(percentile / 100 *
+        count) in the cell (np.percentile with method='inverted_cdf').  For
+        values between the first and last bin edges, it is therefore within
+        a factor of the ratio of consecutive edges of that value, e.g.
+        10**(1/3), about 2.2, with BIN_EDGES.  Below the first edge and
+        above the last, it is only bounded by the minimum and maximum.
+
+        :param percentile: float; between 0 and 100
+        :param minimum: np.ndarray; minimum value of each cell
+        :param maximum: np.ndarray; maximum value of each cell
+        :return: np.ndarray of float64
+        """
+        if self.counts is None:
+            return np.percentile(np.stack(self._values), percentile, axis=0)
+
+        target = percentile / 100 * self.count
+        lower_edges = np.concatenate([[-np.inf], self.bin_edges])
+        upper_edges = np.concatenate([self.bin_edges, [np.inf]])
+
+        value = maximum.astype(np.float64)
+        found = np.zeros(value.shape, dtype=bool)
+        below = np.zeros(value.shape, dtype=np.int64)
+        for counts, lower_edge, upper_edge in zip(self.counts, lower_edges, upper_edges):
+            here = ~found & (counts > 0) & (below + counts >= target)
+            if here.any():
+                lower = np.maximum(lower_edge, minimum[here])
+                upper = np.minimum(upper_edge, maximum[here])
+                fraction = (target - below[here]) / counts[here]
+                value[here] = lower + fraction * (upper - lower)
+                found |= here
+            below += counts
+
+        return np.clip(value, minimum, maximum)
+
+
+class ExceedanceCounts:
+    """
+    Number of ensemble members whose air concentration exceeds each of
+    several thresholds, for each grid cell.  Counts are stored in the
+    smallest unsigned integer type that holds them.  Masked values are
+    treated as no ash.
+    """
+
+    def __init__(self, thresholds=VAAC_THRESHOLDS):
+        """
+        :param thresholds: tuple of float; air concentration thresholds in
+            g/m3
+        """
+        self.thresholds = np.asarray(thresholds, dtype=np.float64)
+        self.count = 0
+        self.template = None
+        self.counts = None
+
+    def add(self, cube):
+        """
+        Count cells of member cube that exceed each threshold.
+
+        :param cube: iris.cube.Cube; air concentration
+        :raises ValueError: if cube has a different grid from earlier members
+        """
+        data = _member_data(cube)
+
+        if self.template is None:
+            self.template = _empty_template(cube, data.dtype)
+            self.counts = np.zeros((len(self.thresholds), *cube.shape), dtype=np.uint8)
+        else:
+            _check_grid(self.template, cube)
+
+        self.counts = _widen_counts(self.counts, self.count)
+        self.count += 1
+
+        # Compare with all thresholds at once, in the units of the cube
+        thresholds = _convert_thresholds(self.thresholds, cube.units)
+        self.counts += data > thresholds.reshape(-1, *(1,) * data.ndim)
+
+    def cubes(self, title=None):
+        """
+        Return cubes of the fraction of members exceeding each threshold,
+        with the coordinates and metadata of the first member.  Each has its
+        threshold in a scalar coordinate and the quantity attribute, so that
+        the cubes can be plotted with plot_4d_cube.
+
+        :param title: str; model_run_title attribute (default is title of
+            first member)
+        :return: iris.cube.CubeList; probability cube for each threshold
+        """
+        if self.template is None:
+            return CubeList()
+
+        cubes = CubeList()
+        for threshold, counts in zip(self.thresholds, self.counts):
+            cube = self.template.copy(data=(counts / self.count).astype(np.float32))
+            cube.rename(f'probability_of_{self.template.name()}_above_threshold')
+            cube.units = '1'
+            cube.add_aux_coord(iris.coords.AuxCoord(
+                threshold, long_name='threshold', units='g/m3'))
+
+            threshold_mg = cf_units.Unit('g/m3').convert(threshold, 'mg/m3')
+            quantity = cube.attributes.get('quantity', 'Air Concentration')
+            cube.attributes['quantity'] = \
+                f'{quantity} Probability Above {threshold_mg:g} mg m-3'
+            cube.attributes.pop('CF Standard Name', None)
+            if title is not None:
+                cube.attributes['model_run_title'] = title
+            cube.attributes['ensemble_size'] = self.count
+            cubes.append(cube)
+
+        return cubes
+
+
+def _member_data(cube):
+    """
+    Return realised data of member cube as a plain array, with masked
+    values as zero.  Lazy data are computed without being stored on the
+    cube.
+    """
+    data = cube.core_data()
+    if not isinstance(data, np.ndarray):
+        data = data.compute()
+
+    return np.ma.filled(data, 0)
+
+
+def _empty_template(cube, dtype):
+    """
+    Return copy of cube that keeps its metadata and coordinates, with a
+    zero-size view for data.
+    """
+    return cube.copy(data=np.broadcast_to(np.zeros((), dtype=dtype), cube.shape))
+
+
+def _check_grid(template, cube):
+    """Raise ValueError if cube is not on the grid of the template."""
+    template_coords = template.coords(dim_coords=True)
+    coords = cube.coords(dim_coords=True)
+    # zip stops at the shorter list, so the number of coordinates is checked
+    # first
+    same_coords = len(coords) == len(template_coords) and all(
+        coord.name() == template_coord.name()
+        and np.array_equal(coord.points, template_coord.points)
+        for coord, template_coord in zip(coords, template_coords))
+    if cube.shape != template.shape or not same_coords:
+        raise ValueError(
+            f"Ensemble member {cube.name()} has a different grid "
+            f"from the first member")
+
+
+def _widen_counts(counts, count):
+    """
+    Return counts in a wider integer type e.g. uint8 to uint16, if adding
+    one to count could overflow them, otherwise counts.
+    """
+    if count == np.iinfo(counts.dtype).max:
+        return counts.astype(np.dtype(f'uint{counts.dtype.itemsize * 16}'))
+
+    return counts
+
+
+def _convert_thresholds(thresholds, units):
+    """Convert thresholds in g/m3 into units of an air concentration cube."""
+    # Older Fall3D versions use "gr/m3" for grams, as in plotting
+    if units == cf_units.Unit('gr/m3'):
+        return thresholds
+
+    return cf_units.Unit('g/m3').convert(thresholds, units)
+
+
+def name_member_files(member):
+    """
+    Return the NAME .txt files of an ensemble member.
+
+    :param member: str or Path; directory of NAME .txt files
+    :return: list of str; sorted paths of the files
+    :raises AshModelResultError: if member has no .txt files, e.g. because it
+        is not a directory
+    """
+    source = sorted(str(f) for f in Path(member).glob('*.txt'))
+    if not source:
+        raise AshModelResultError(f"No NAME .txt files found in ensemble member "
+                                  f"directory {member}")
+    return source
+
+
+def main():
+    """Parse arguments then calculate, save and plot exceedance probabilities."""
+    parser = argparse.ArgumentParser(
+        description='Calculate the probability of air concentration exceeding '
+                    'thresholds across an ensemble of ash model results')
+    parser.add_argument(
+        'members',
+        help="Ensemble members; directories of NAME .txt files, or netCDF "
+             "files for other model types",
+        nargs='+')
+    parser.add_argument(
+        '--model_type',
+        help="Type of ash model results",
+        choices=MODEL_TYPES.keys(), default='name')
+    parser.add_argument(
+        '--thresholds',
+        help="Air concentration thresholds in g/m3 (default is VAAC levels)",
+        nargs='+', type=float, default=list(VAAC_THRESHOLDS))
+    parser.add_argument(
+        '--output_dir',
+        help="Path to directory for output file and plots",
+        default='.')
+    parser.add_argument(
+        '--output_name',
+        help="Name for output netCDF file",
+        default='exceedance_probability.nc')
+    parser.add_argument(
+        '--title',
+        help="Title for plots (default is title of first member)",
+        default=None)
+    parser.add_argument(
+        '--plot',
+        help="Plot probability maps and write their HTML summaries in output_dir",
+        action='store_true')
+    parser.add_argument(
+        '--workers',
+        help="Number of worker processes for loading and plotting",
+        default=None, type=int)
+    args = parser.parse_args()
+
+    def members():
+        for member in args.members:
+            if args.model_type == 'name':
+                yield MODEL_TYPES['name'](name_member_files(member), workers=args.workers)
+            else:
+                yield MODEL_TYPES[args.model_type](member)
+
+    output_dir = Path(args.output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    output_file = output_dir / args.output_name
+    with worker_pool(args.workers):
+        cubes = exceedance_probabilities(members(), args.thresholds, title=args.title)
+        save_compressed(cubes, output_file)
+
+        if args.plot:
+            # Probabilities share one colour scale, so that the colours of
+            # different maps are comparable
+            for cube in cubes:
+                plot_func = plot_3d_cube if cube.ndim == 3 else plot_4d_cube
+                metadata = plot_func(cube, output_dir, workers=args.workers, vmin=0, vmax=1)
+                write_html(str(output_file), output_dir, metadata)
+
+
+if __name__ == '__main__':
+    main()
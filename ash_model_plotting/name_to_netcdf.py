@@ -2,26 +2,43 @@
 Script to convert NAME files in directory to single NetCDF
 """
 import argparse
+from collections import defaultdict
+from contextlib import contextmanager
 import glob
 from pathlib import Path
 
-import iris
+import dask
+from iris.fileformats.netcdf import CF_CONVENTIONS_VERSION, Saver
 
+from ash_model_plotting.ash_model_results.name import load_name_files
 
-def name_to_netcdf(source_dir, prefix=None, output_dir=None, output_name=None):
+
+def name_to_netcdf(source_dir, prefix=None, output_dir=None, output_name=None,
+                   complevel=4, fast_reader=True):
     """
     Convert all NAME files in a given directory to single NetCDF file.
 
+    With the fast reader, the data are read lazily, so that each NAME file is
+    parsed as its data are written and the whole result is never held in
+    memory.  Variables are compressed and chunked by (latitude, longitude)
+    slice, which is how they are read for plotting.
+
     :param source_dir:
     :param prefix:
     :param output_dir:
     :param output_name:
+    :param complevel: int; zlib compression level (1-9) or 0 for none
+    :param fast_reader: bool; read NAME files with name_fields.load_name_file,
+        or with iris.load if False, e.g. to check the converted results.  The
+        iris NAME loader holds all of the data in memory.
     """
     source_dir = Path(source_dir)
     source_files = glob.glob(
-        str(source_dir.absolute().joinpath(prefix + '*.txt')))
+        str(source_dir.absolute().joinpath((prefix or '') + '*.txt')))
 
-    cubes = iris.load(source_files)
+    # Merged as by iris.load, which keeps duplicate fields as separate cubes
+    cubes = load_name_files(source_files, workers=1, fast_reader=fast_reader,
+                            lazy=fast_reader)
 
     if output_dir:
         output_dir = Path(output_dir)
@@ -34,7 +51,65 @@ def name_to_netcdf(source_dir, prefix=None, output_dir=None, output_name=None):
 
     output_path = output_dir.joinpath(output_name)
 
-    iris.save(cubes, output_path)
+    save_compressed(cubes, output_path, complevel=complevel)
+
+
+def save_compressed(cubes, output_path, complevel=4):
+    """
+    Save cubes to NetCDF4 file as iris.save, but with zlib compression and
+    chunks of one (latitude, longitude) slice.  Lazy data are computed and
+    written slice by slice.
+
+    :param cubes: iris.cube.CubeList
+    :param output_path: str or Path; NetCDF file
+    :param complevel: int; zlib compression level (1-9) or 0 for none
+    """
+    compression = {'zlib': complevel > 0, 'complevel': complevel or None,
+                   'shuffle': complevel > 0}
+    local_keys = _local_keys(cubes)
+
+    # Single-threaded compute reads each NAME file once without holding
+    # the data of several files at the same time
+    with dask.config.set(scheduler='synchronous'), \
+            _saver(output_path) as saver:
+        for cube in cubes:
+            saver.write(cube, local_keys=local_keys,
+                        chunksizes=_slice_chunksizes(cube), **compression)
+
+
+@contextmanager
+def _saver(output_path):
+    """Yield iris NetCDF Saver and write global attributes on exit."""
+    with Saver(str(output_path), 'NETCDF4', compute=True) as saver:
+        yield saver
+        saver.update_global_attributes(Conventions=CF_CONVENTIONS_VERSION)
+
+
+def _local_keys(cubes):
+    """
+    Return attribute names whose values differ between cubes, which iris.save
+    writes as variable attributes instead of global attributes.
+    """
+    values = defaultdict(list)
+    for cube in cubes:
+        for key, value in cube.attributes.items():
+            values[key].append(value)
+
+    return {key for key, key_values in values.items()
+            if len(key_values) != len(cubes)
+            or any(value != key_values[0] for value in key_values)}
+
+
+def _slice_chunksizes(cube):
+    """
+    Return chunk shape that holds a whole (latitude, longitude) slice and a
+    single point of the other dimensions.
+    """
+    horizontal_dims = (set(cube.coord_dims(cube.coord(axis='Y', dim_coords=True)))
+                       | set(cube.coord_dims(cube.coord(axis='X', dim_coords=True))))
+
+    return tuple(size if dim in horizontal_dims else 1
+                 for dim, size in enumerate(cube.shape))
 
 
 def main():
@@ -56,10 +131,21 @@ def main():
         '--output_name',
         help="Name for output file (default is autogenerated from metadata)",
         default=None)
+    parser.add_argument(
+        '--complevel',
+        help="zlib compression level (1-9), or 0 for uncompressed output",
+        default=4, type=int)
+    parser.add_argument(
+        '--no-fast-reader', '--no_fast_reader',
+        help=("Read NAME files with the iris NAME loader instead of the fast "
+              "reader, e.g. to check conversion results.  All data are held "
+              "in memory"),
+        dest='fast_reader', action='store_false')
     args = parser.parse_args()
     name_to_netcdf(
         args.source_dir, prefix=args.prefix,
-        output_dir=args.output_dir, output_name=args.output_name)
+        output_dir=args.output_dir, output_name=args.output_name,
+        complevel=args.complevel, fast_reader=args.fast_reader)
 
 
 if __name__ == '__main__':
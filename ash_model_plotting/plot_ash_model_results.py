@@ -3,27 +3,18 @@ Script to plot NAME output files
 """
 # coding: utf-8
 import argparse
+from contextlib import nullcontext
 import logging
 import os
 from pathlib import Path
 
-from ash_model_plotting import (
-    NameAshModelResult,
-    Fall3DAshModelResult,
-    HysplitAshModelResult,
-    AshModelResultError,
-)
+from ash_model_plotting import AshModelResultError
+from ash_model_plotting.ash_model_results import MODEL_TYPES
+from ash_model_plotting.plotting import EMPTY_SLICES, SCHEDULES, worker_pool
 
 logger = logging.getLogger('plot_ash_model_results')
 
 
-MODEL_TYPES = {
-    'name': NameAshModelResult,
-    'fall3d': Fall3DAshModelResult,
-    'hysplit': HysplitAshModelResult
-}
-
-
 def main():
     """Prepare arguments and logging then run script."""
     # Suppress warning messages from Matplotlib etc
@@ -48,7 +39,10 @@ def main():
     plot_results(**vars(args))
 
 
-def plot_results(results, model_type, limits, vaac_colours, output_dir, central_longitude, serial, **kwargs):
+def plot_results(results, model_type, limits, vaac_colours, output_dir, central_longitude, serial,
+                 workers=None, chunksize=None, schedule='cube', incremental=False,
+                 empty_slices='plot', cache_dir=None, memory_limit=None,
+                 shared_scale=False, shared_memory=True, **kwargs):
     """
     Plot ash model results the layers in the input_files.  Plots are made
     for air_concentration, total_column and total_deposition for each
@@ -61,6 +55,26 @@ def plot_results(results, model_type, limits, vaac_colours, output_dir, central_
         concentration.
     :param output_dir: str, directory for plot output (will be created if does
         not exist.
+    :param central_longitude: float, projection central longitude
+    :param serial: bool, plot in a single process
+    :param workers: int, number of worker processes for parallel loading and
+        plotting (default is all available cores)
+    :param chunksize: int, number of slices sent to a worker at a time
+    :param schedule: str, order in which slices are plotted e.g.
+        latest_time_first, lowest_level_first
+    :param incremental: bool, only replot slices whose data or plot options
+        have changed since the last incremental run in output_dir
+    :param empty_slices: str, how to handle slices with no ash; plot, skip or
+        placeholder
+    :param cache_dir: str, directory for cache of parsed NAME .txt files
+    :param shared_scale: bool, use one colour scale, from the maximum of the
+        whole quantity, for every figure instead of autoscaling each figure
+    :param memory_limit: str, memory size for out-of-core processing of
+        results larger than RAM e.g. 16GB.  It sets chunk sizes and is not an
+        enforced ceiling
+    :param shared_memory: bool, move realised data into shared memory, so
+        that plotting workers read views of it instead of being sent a copy
+        of each slice
     """
     # Prepare output directory
     if not output_dir:
@@ -72,25 +86,36 @@ def plot_results(results, model_type, limits, vaac_colours, output_dir, central_
     if not output_dir.exists():
         os.mkdir(output_dir)
 
-    # Load data
     # Extract filename as string if only one provided
     if len(results) == 1:
         results = results[0]
-    result = MODEL_TYPES[model_type](results)
-
-    # Make plots
-    logger.info(f'Writing plots from {results} to {output_dir}')
-    for attribute in ('air_concentration', 'total_column', 'total_deposition'):
-        try:
-            logger.info(f'Plotting {attribute}')
-            getattr(result, f'plot_{attribute}')(output_dir,
-                                                 limits=limits,
-                                                 vaac_colours=vaac_colours,
-                                                 central_longitude=central_longitude,
-                                                 serial=serial,
-                                                 bbox_inches='tight')
-        except AshModelResultError:
-            logger.info(f'No {attribute} data found')
+
+    # Load data and make plots, sharing the same worker pool for all steps
+    with nullcontext() if serial else worker_pool(workers):
+        options = {'workers': 1 if serial else workers, 'memory_limit': memory_limit}
+        if model_type == 'name':
+            options['cache_dir'] = cache_dir
+        result = MODEL_TYPES[model_type](results, **options)
+
+        logger.info(f'Writing plots from {results} to {output_dir}')
+        for attribute in ('air_concentration', 'total_column', 'total_deposition'):
+            try:
+                logger.info(f'Plotting {attribute}')
+                getattr(result, f'plot_{attribute}')(output_dir,
+                                                     limits=limits,
+                                                     vaac_colours=vaac_colours,
+                                                     central_longitude=central_longitude,
+                                                     serial=serial,
+                                                     workers=workers,
+                                                     chunksize=chunksize,
+                                                     schedule=schedule,
+                                                     incremental=incremental,
+                                                     empty_slices=empty_slices,
+                                                     shared_scale=shared_scale,
+                                                     shared_memory=shared_memory,
+                                                     bbox_inches='tight')
+            except AshModelResultError:
+                logger.info(f'No {attribute} data found')
 
 
 def parse_args():
@@ -132,6 +157,53 @@ def parse_args():
         '--serial',
         help=("Run in serial mode (no parallel processing)"),
         action='store_true')
+    parser.add_argument(
+        '--workers',
+        help=("Number of worker processes for parallel loading and plotting "
+              "(defaults to all available cores)"),
+        default=None, type=int)
+    parser.add_argument(
+        '--chunksize',
+        help=("Number of slices sent to each worker at a time "
+              "(defaults to 4 chunks per worker)"),
+        default=None, type=int)
+    parser.add_argument(
+        '--schedule',
+        help="Order in which slices are plotted",
+        choices=SCHEDULES,
+        default='cube', type=str)
+    parser.add_argument(
+        '--incremental',
+        help=("Only replot slices whose data or plot options have changed "
+              "since the last incremental run in the output directory"),
+        action='store_true')
+    parser.add_argument(
+        '--empty_slices',
+        help=("How to handle slices with no ash: plot them as usual, skip them "
+              "or use a single placeholder figure"),
+        choices=EMPTY_SLICES,
+        default='plot', type=str)
+    parser.add_argument(
+        '--shared_scale',
+        help=("Use one colour scale for all figures of a quantity, from the "
+              "maximum of its data, instead of autoscaling each figure"),
+        action='store_true')
+    parser.add_argument(
+        '--no_shared_memory',
+        help=("Send a copy of each slice to plotting workers instead of "
+              "sharing the data with them through shared memory"),
+        dest='shared_memory', action='store_false')
+    parser.add_argument(
+        '--cache_dir',
+        help=("Directory for cache of parsed NAME .txt files, so that "
+              "unchanged files are not parsed again on later runs"),
+        default=None)
+    parser.add_argument(
+        '--memory_limit',
+        help=("Memory size e.g. 16GB.  Data are read lazily in chunks that "
+              "fit within it, for results larger than RAM.  It sizes chunks "
+              "and is not an enforced ceiling"),
+        default=None)
 
     args = parser.parse_args()
     return args
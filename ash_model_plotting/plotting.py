@@ -1,19 +1,25 @@
 """
 Plotting functions that draw and save figures from multi-dimensional cubes.
 """
+import hashlib
+import json
 import os
 from pathlib import Path
 import logging
 import warnings
 
-from itertools import repeat
-from multiprocessing import Manager, get_context
+from collections import OrderedDict
+from contextlib import contextmanager
+from multiprocessing import get_context
+from multiprocessing.shared_memory import SharedMemory
+from uuid import uuid4
 
 # Import matplotlib before Iris to allow backend setting
 import matplotlib
 
 import cartopy.crs as ccrs
 from cartopy.mpl.ticker import LongitudeFormatter, LatitudeFormatter
+import dask.array as da
 from iris.exceptions import CoordinateNotFoundError
 from jinja2 import Template
 import matplotlib.colors
@@ -29,6 +35,42 @@ mpl_logger.setLevel(logging.INFO)
 logger = logging.getLogger(__name__)
 POOL_LOGGER_LEVEL = logging.INFO
 
+# Map frames are kept by each process so that slices from the same cube can
+# be drawn without rebuilding the figure.  They are keyed on the plot call
+# that created them and the oldest are closed when the limit is reached.
+MAX_MAP_FRAMES = 4
+_map_frames = OrderedDict()
+
+# Directory in which shared memory blocks appear as files, so that they can
+# be mapped by np.memmap, which unmaps a block when no array uses it
+_SHARED_MEMORY_DIR = Path('/dev/shm')
+
+# Worker pool shared by all plotting calls, created by get_pool()
+_pool = None
+_pool_processes = None
+
+# Names of coordinates that represent zlevels
+_KNOWN_ZLEVELS = {'alt', 'altitude', 'flight_level', 'z coordinate of x-y plane cuts',
+                  'Top height of each layer'}
+
+# Air concentration thresholds (g/m3) of the VAAC colour scheme
+VAAC_THRESHOLDS = (0.0002, 0.002, 0.004)
+
+# Orders in which slices can be submitted for plotting
+SCHEDULES = ('cube', 'latest_time_first', 'earliest_time_first',
+             'lowest_level_first', 'highest_level_first')
+
+# Ways of handling slices with no data above mask_less
+EMPTY_SLICES = ('plot', 'skip', 'placeholder')
+
+# Arguments accepted by Matplotlib's savefig
+_SAVEFIG_ARGS = {'dpi', 'facecolor', 'edgecolor', 'orientation', 'format',
+                 'transparent', 'bbox_inches', 'pad_inches', 'metadata',
+                 'pil_kwargs', 'backend'}
+
+# Record of slice hashes and render parameters used by incremental plotting
+MANIFEST_NAME = 'plot_manifest.json'
+
 
 def plot_4d_cube(cube, output_dir, file_ext='png', **kwargs):
     """
@@ -38,7 +80,10 @@ def plot_4d_cube(cube, output_dir, file_ext='png', **kwargs):
     :param output_dir: str; directory to save figure
     :param file_ext, file extension suffix for data format e.g. png, pdf
     :param kwargs: dict; extra arguments to pass to plot_2d_cube and
-        plt.savefig e.g. limits, vaac_colours, dpi, bbox_inches
+        plt.savefig e.g. limits, vaac_colours, dpi, bbox_inches.  Set
+        reuse_figures=False to draw a new figure for every slice.  See
+        _plot_slices for serial, workers, chunksize, schedule, incremental
+        and empty_slices options.
     """
     metadata = {'created_by': 'plot_4d_cube',
                 'attributes': dict(cube.attributes),
@@ -46,45 +91,26 @@ def plot_4d_cube(cube, output_dir, file_ext='png', **kwargs):
                 }
 
     base_output_dir = Path(output_dir)
-    vaac_colours = kwargs.get('vaac_colours', False)
-    limits = kwargs.get('limits', None)
-    central_longitude = kwargs.get('central_longitude', 0)
-    serial = kwargs.get('serial', False)
-
-    for tyx_slice in cube.slices_over(_get_zlevel_name(cube)):
-        # Create new directory for each altitude level
-        zlevel_str = _format_zlevel_string(tyx_slice)
-        output_dir = base_output_dir / zlevel_str
+    zlevel_name = _get_zlevel_name(cube)
+    zlevel_dim, = cube.coord_dims(zlevel_name)
+
+    # Create new directory for each altitude level
+    zlevel_strs = [_format_zlevel_string(tyx_slice) for tyx_slice
+                   in _placeholder_cube(cube).slices_over(zlevel_name)]
+    output_dirs = [base_output_dir / zlevel_str for zlevel_str in zlevel_strs]
+    for output_dir in output_dirs:
         if not output_dir.is_dir():
             os.mkdir(output_dir)
 
-        # Create a dictionary that can be shared between processes
-        manager = Manager()
-        fig_paths = manager.dict()
-
-        # Create a list of arguments for plotting
-        args = zip(tyx_slice.slices(['latitude', 'longitude']),
-                   repeat(fig_paths), repeat(output_dir), repeat(file_ext),
-                   repeat(limits), repeat(vaac_colours), repeat(central_longitude), repeat(kwargs))
+    # Slices from all levels are plotted together
+    logger.debug('plot_4d for %s levels', len(zlevel_strs))
+    fig_paths, empty = _plot_slices(cube, output_dirs, file_ext, kwargs,
+                                    group_dim=zlevel_dim)
 
-        if serial:
-            for arg in args:
-                _save_yx_slice_figure(*arg)
-        else:
-            #  Plot slices in parallel
-            processes = len(os.sched_getaffinity(0))
-            logger.debug('plot_4d for %s with %s processes', zlevel_str, processes)
-            with get_context('spawn').Pool(
-                    initializer=setup_pool_logger, initargs=(POOL_LOGGER_LEVEL,)
-                    ) as pool:
-                # 'spawn' is required to ensure each task gets fresh interpreter and
-                # avoid issues with hanging caused by items shared across threads
-                # starmap takes an iterable of iterables with the arguments
-                pool.starmap(_save_yx_slice_figure, args)
-
-        # Update metadata
-        fig_paths = {key: fig_paths[key] for key in sorted(fig_paths.keys())}
-        metadata['plots'][zlevel_str] = fig_paths
+    # Update metadata in order of zlevels
+    metadata['plots'] = dict(zip(zlevel_strs, fig_paths))
+    if kwargs.get('empty_slices', 'plot') != 'plot':
+        metadata['empty'] = dict(zip(zlevel_strs, empty))
 
     return metadata
 
@@ -100,6 +126,91 @@ def setup_pool_logger(level):
     logger.setLevel(level)
 
 
+def get_pool(processes=None):
+    """
+    Return the worker pool shared by all plotting calls.  The pool is started
+    on first use and kept running, so that later calls for other levels,
+    quantities and results do not pay the start-up cost of new workers.  The
+    pool is restarted if a different number of processes is requested.  It
+    runs until close_pool is called, so callers should use worker_pool, as
+    the command line scripts do, to stop it on exit.
+
+    :param processes: int; number of worker processes (default is number of
+        available cores, or size of running pool)
+    :return: multiprocessing.pool.Pool
+    """
+    global _pool, _pool_processes
+    if _pool is not None and processes and processes != _pool_processes:
+        close_pool()
+
+    if _pool is None:
+        processes = processes or len(os.sched_getaffinity(0))
+        # 'spawn' is required to ensure each task gets fresh interpreter and
+        # avoid issues with hanging caused by items shared across threads
+        _pool = get_context('spawn').Pool(
+            processes, initializer=_init_pool_worker,
+            initargs=(POOL_LOGGER_LEVEL,))
+        _pool_processes = processes
+        logger.debug('Started plotting pool with %s processes', processes)
+
+    return _pool
+
+
+def running_pool():
+    """
+    Return the shared worker pool if it has been started, otherwise None.
+
+    :return: multiprocessing.pool.Pool or None
+    """
+    return _pool
+
+
+def close_pool(terminate=False):
+    """
+    Stop the shared worker pool, if it is running, and wait for its processes
+    to finish.
+
+    :param terminate: bool; stop the processes at once, abandoning tasks
+        that are still outstanding, instead of letting them finish
+    """
+    global _pool, _pool_processes
+    if _pool is not None:
+        if terminate:
+            _pool.terminate()
+        else:
+            _pool.close()
+        _pool.join()
+        _pool = None
+        _pool_processes = None
+
+
+@contextmanager
+def worker_pool(processes=None):
+    """
+    Context manager that provides the shared worker pool and stops it on exit.
+    Plotting calls made inside the block all use the same workers.
+
+    :param processes: int; number of worker processes
+    :yield: multiprocessing.pool.Pool
+    """
+    try:
+        yield get_pool(processes)
+    finally:
+        close_pool()
+
+
+def _init_pool_worker(level):
+    """
+    Prepare pool process for plotting tasks.  Libraries used by workers are
+    imported up front so that the first task does not wait for them.
+    """
+    setup_pool_logger(level)
+
+    import iris.cube  # noqa: F401
+    import iris.fileformats.netcdf  # noqa: F401
+    import cartopy.mpl.geoaxes  # noqa: F401
+
+
 def plot_3d_cube(cube, output_dir, file_ext='png', **kwargs):
     """
     Plot multiple figures of 2D slices from a cube in output directory.
@@ -108,91 +219,621 @@ def plot_3d_cube(cube, output_dir, file_ext='png', **kwargs):
     :param output_dir: str; directory to save figure
     :param file_ext, file extension suffix for data format e.g. png, pdf
     :param kwargs: dict; extra args for plot_2d_cube and plt.savefig
-        e.g. limits, vaac_colours, dpi, bbox_inches
+        e.g. limits, vaac_colours, dpi, bbox_inches.  Set
+        reuse_figures=False to draw a new figure for every slice.  See
+        _plot_slices for serial, workers, chunksize, schedule, incremental
+        and empty_slices options.
     """
-    vaac_colours = kwargs.get('vaac_colours', False)
-    limits = kwargs.get('limits', None)
-    central_longitude = kwargs.get('central_longitude', 0)
-    serial = kwargs.get('serial', False)
-
     output_dir = Path(output_dir)
 
-    # Create a dictionary that can be shared between processes
-    manager = Manager()
-    fig_paths = manager.dict()
-
-    # Create a list of arguments for plotting
     # Slices of longitude, latitude represent different times
-    args = zip(cube.slices(['latitude', 'longitude']),
-               repeat(fig_paths), repeat(output_dir), repeat(file_ext),
-               repeat(limits), repeat(vaac_colours), repeat(central_longitude), repeat(kwargs))
-
-    if serial:
-        for arg in args:
-            _save_yx_slice_figure(*arg)
-    else:
-        #  Plot slices in parallel
-        processes = len(os.sched_getaffinity(0))
-        logger.debug('plot_3d with %s processes', processes)
-        with get_context('spawn').Pool(
-                initializer=setup_pool_logger, initargs=(POOL_LOGGER_LEVEL,)
-                ) as pool:
-            # 'spawn' is required to ensure each task gets fresh interpreter and
-            # avoid issues with hanging caused by items shared across threads
-            # starmap takes an iterable of iterables with the arguments
-            pool.starmap(_save_yx_slice_figure, args)
+    (fig_paths,), (empty,) = _plot_slices(cube, [output_dir], file_ext, kwargs)
 
     # Create metadata, including sorted list of fig_paths
-    fig_paths = {key: fig_paths[key] for key in sorted(fig_paths.keys())}
     metadata = {'created_by': 'plot_3d_cube',
                 'attributes': dict(cube.attributes),
                 'plots': fig_paths
                 }
+    if kwargs.get('empty_slices', 'plot') != 'plot':
+        metadata['empty'] = empty
 
     return metadata
 
 
-def _save_yx_slice_figure(yx_slice, fig_paths, output_dir, file_ext, limits,
-                          vaac_colours, central_longitude, kwargs):
+def _plot_slices(cube, output_dirs, file_ext, kwargs, group_dim=None):
+    """
+    Plot and save every 2D (latitude, longitude) slice of cube, either in
+    serial or in the shared worker pool, and collect the figure paths in the
+    parent process.
+
+    The following kwargs control how slices are plotted:
+
+    + serial: bool; plot in current process (default False)
+    + workers: int; number of processes in worker pool (default is all
+      available cores)
+    + chunksize: int; number of slices sent to a worker at a time (default
+      splits slices into 4 chunks per worker)
+    + schedule: str; order in which slices are submitted, one of SCHEDULES
+      (default 'cube', the order of the cube dimensions)
+    + incremental: bool; only plot slices whose data or render parameters
+      have changed since the last incremental run, as recorded in the
+      MANIFEST_NAME file of each output directory (default False).  Other
+      figures are kept and still returned.  Entries for slices of the same
+      plot that are now empty or no longer in the cube are removed from the
+      manifest.  Slice data are read in the parent process to be hashed.  A
+      shared vmax calculated from the whole cube can change as data are
+      added, which causes all slices to be plotted.
+    + empty_slices: str; one of EMPTY_SLICES.  Slices with no data above
+      mask_less are found in a single pass over the cube.  They are drawn
+      as usual with 'plot' (default), left out with 'skip' or share one
+      'no ash' figure per output directory with 'placeholder'.
+    + shared_memory: bool; move realised cube data into shared memory and
+      send workers only the position of each slice and its coordinates and
+      metadata, instead of pickling every slice (default True, where
+      shared memory is available).  The data of the cube are replaced by an
+      identical array in the shared block, so the parent holds one copy,
+      and workers draw views of the block without copying it.  Lazy data
+      are not moved, as workers read their own slices of them.
+    + realise_slices: bool; read the data of each slice in the parent
+      process, in the order that slices are plotted, before it is sent to a
+      worker (default False, so that workers read lazy data themselves).
+      Use this for lazy data that are cheaper to read in order, such as a
+      running total.
+
+    :param cube: Iris cube with latitude and longitude dimensions
+    :param output_dirs: list of Path; directory for figures from each
+        position along group_dim, or a single directory if group_dim is None
+    :param file_ext, file extension suffix for data format e.g. png, pdf
+    :param kwargs: dict; extra args for plot_2d_cube and plt.savefig
+    :param group_dim: int; dimension of cube used to group figures e.g. zlevel
+    :return fig_paths: list of dict; {timestamp: filename} for each of
+        output_dirs, sorted by timestamp
+    :return empty: list of list; sorted timestamps of slices without data
+        for each of output_dirs, if empty_slices is not 'plot'
+    """
+    vaac_colours = kwargs.get('vaac_colours', False)
+    limits = kwargs.get('limits', None)
+    central_longitude = kwargs.get('central_longitude', 0)
+    serial = kwargs.get('serial', False)
+    incremental = kwargs.get('incremental', False)
+    realise_slices = kwargs.get('realise_slices', False)
+    empty_slices = kwargs.get('empty_slices', 'plot')
+    if empty_slices not in EMPTY_SLICES:
+        raise ValueError(f"Unknown empty_slices option '{empty_slices}', "
+                         f"expected one of {EMPTY_SLICES}")
+    frame_key = _new_frame_key(kwargs)
+
+    # Mask the whole cube once, as a view, instead of each slice separately
+    source = cube
+    mask_less = kwargs.get('mask_less', 1e-8)
+    cube = cube.copy(data=mask_less_than(cube.core_data(), mask_less))
+
+    lead_dims, indices = _schedule_slices(cube, kwargs.get('schedule', 'cube'))
+
+    fig_paths = [{} for _ in output_dirs]
+    empty = [[] for _ in output_dirs]
+    if empty_slices != 'plot':
+        is_empty = _find_empty_slices(cube)
+        placeholders = {}
+    if incremental:
+        params = _render_params(file_ext, kwargs)
+        # Plots of other quantities can share the output directories
+        plot_name = '_'.join(filter(None, (cube.attributes.get('model_run_title'),
+                                           cube.attributes.get('quantity'))))
+        manifests = [_read_manifest(output_dir) for output_dir in output_dirs]
+        entries = [{} for _ in output_dirs]
+
+    shared = None
+    results = None
+
+    def tasks(to_plot):
+        # Slices are made as they are sent, so that only the slices in
+        # flight to workers are copied out of the cube
+        for group, index in to_plot:
+            if shared is None:
+                yx_slice = _get_yx_slice(cube, lead_dims, index)
+                if realise_slices:
+                    yx_slice.data
+            else:
+                yx_slice = shared.slice(lead_dims, index)
+            args = (yx_slice, output_dirs[group], file_ext, limits, vaac_colours,
+                    central_longitude, kwargs, frame_key, None)
+            yield group, args
+
+    try:
+        # Figures that are not sent to workers are found in the main thread, as
+        # pool.imap consumes tasks() in a task handler thread and pyplot is not
+        # thread-safe
+        to_plot = []
+        for index in indices:
+            group = index[lead_dims.index(group_dim)] if group_dim is not None else 0
+            if empty_slices != 'plot' and is_empty[index]:
+                yx_slice = _get_yx_slice(cube, lead_dims, index)
+                timestamp = _format_timestamp_string(yx_slice)
+                empty[group].append(timestamp)
+                if empty_slices == 'placeholder':
+                    if group not in placeholders:
+                        placeholders[group] = _save_placeholder_figure(
+                            yx_slice, output_dirs[group], file_ext, limits,
+                            vaac_colours, central_longitude, kwargs)
+                    fig_paths[group][timestamp] = placeholders[group]
+                continue
+            if incremental:
+                yx_slice = _get_yx_slice(cube, lead_dims, index)
+                filename = f"{_format_title(yx_slice)}.{file_ext}"
+                entry = {'hash': _slice_hash(yx_slice), 'params': params, 'plot': plot_name}
+                entries[group][filename] = entry
+                if (manifests[group].get(filename) == entry
+                        and (output_dirs[group] / filename).exists()):
+                    # Figure is up to date, so keep it
+                    fig_paths[group][_format_timestamp_string(yx_slice)] = filename
+                    continue
+            to_plot.append((group, index))
+
+        # The pool is not started when every figure is up to date or empty
+        if serial or not to_plot:
+            results = map(_run_slice_task, tasks(to_plot))
+        else:
+            if (kwargs.get('shared_memory', True)
+                    and not cube.has_lazy_data() and _SHARED_MEMORY_DIR.is_dir()):
+                shared = SharedCube(source, mask_less)
+                cube = cube.copy(data=shared.data)
+            #  Plot slices in parallel, as they are completed by workers
+            pool = get_pool(kwargs.get('workers'))
+            chunksize = kwargs.get('chunksize')
+            if not chunksize:
+                chunksize, extra = divmod(len(to_plot), _pool_processes * 4)
+                if extra or not chunksize:
+                    chunksize += 1
+            results = pool.imap_unordered(_run_slice_task, tasks(to_plot), chunksize)
+
+        for group, timestamp, filename in results:
+            fig_paths[group][timestamp] = filename
+        results = None
+
+        if incremental:
+            for output_dir, manifest, new_entries in zip(output_dirs, manifests, entries):
+                # Entries of this plot, or without a plot name, are replaced
+                manifest = {filename: entry for filename, entry in manifest.items()
+                            if entry.get('plot', plot_name) != plot_name}
+                manifest.update(new_entries)
+                _write_manifest(output_dir, manifest)
+    finally:
+        if results is not None and not serial:
+            # Tasks still queued or running in the pool would read blocks that
+            # are about to be removed, so they are abandoned with the pool
+            close_pool(terminate=True)
+        if shared is not None:
+            shared.close()
+        _release_map_frame(frame_key)
+
+    fig_paths = [{timestamp: paths[timestamp] for timestamp in sorted(paths)}
+                 for paths in fig_paths]
+    return fig_paths, [sorted(timestamps) for timestamps in empty]
+
+
+def _find_empty_slices(cube):
+    """
+    Return which 2D (latitude, longitude) slices of masked cube have every
+    value masked, calculated in one pass over the whole cube.  Lazy data are
+    reduced chunk by chunk.
+
+    :param cube: Iris cube with latitude and longitude dimensions
+    :return: np.ndarray of bool; indexed by position along the other (lead)
+        dimensions, in cube order
+    """
+    yx_dims = cube.coord_dims('latitude') + cube.coord_dims('longitude')
+
+    if cube.has_lazy_data():
+        mask = da.ma.getmaskarray(cube.lazy_data())
+        return mask.all(axis=yx_dims).compute()
+
+    return np.ma.getmaskarray(cube.data).all(axis=yx_dims)
+
+
+def _save_placeholder_figure(yx_slice, output_dir, file_ext, limits,
+                             vaac_colours, central_longitude, kwargs):
+    """
+    Draw map frame for an empty slice with a 'no ash' title and save it in
+    output_dir, for use in place of all empty slices in that directory.
+
+    :param yx_slice: 2d Iris cube (slice of larger cube) with no data
+    :return: str; filename of figure relative to output_dir
+    """
+    title = _format_title(yx_slice, label='no_ash')
+    fig, _ = plot_2d_cube(yx_slice, mask_less=None, vaac_colours=vaac_colours,
+                          limits=limits, central_longitude=central_longitude)
+    fig.axes[0].set_title(title)
+
+    filename = f"{title}.{file_ext}"
+    _savefig_safe(fig, Path(output_dir) / filename, **kwargs)
+    plt.close(fig)
+
+    return filename
+
+
+def _render_params(file_ext, kwargs):
+    """
+    Return the arguments that affect how slices are drawn and saved, in the
+    form that they are stored in the manifest.
+
+    :param file_ext, file extension suffix for data format e.g. png, pdf
+    :param kwargs: dict; extra args for plot_2d_cube and plt.savefig
+    :return: dict
+    """
+    params = {'file_ext': file_ext}
+    for key in ('limits', 'vaac_colours', 'central_longitude', 'vmin', 'vmax', 'mask_less'):
+        params[key] = kwargs.get(key)
+    params.update((key, value) for key, value in kwargs.items() if key in _SAVEFIG_ARGS)
+
+    # Round trip through JSON so that params compare equal to stored values
+    return json.loads(json.dumps(params, sort_keys=True, default=str))
+
+
+def _slice_hash(yx_slice):
+    """
+    Return hash of the data, mask and horizontal grid of a 2D slice.  The
+    slice data are realised.
+
+    :param yx_slice: 2d Iris cube (slice of larger cube)
+    :return: str; hex digest
+    """
+    data = yx_slice.data
+    digest = hashlib.sha256()
+    digest.update(f'{data.dtype.str}{data.shape}'.encode())
+    digest.update(np.ascontiguousarray(np.ma.getdata(data)).tobytes())
+    digest.update(np.ma.getmaskarray(data).tobytes())
+    for name in ('latitude', 'longitude'):
+        digest.update(np.ascontiguousarray(yx_slice.coord(name).points).tobytes())
+
+    return digest.hexdigest()
+
+
+def _read_manifest(output_dir):
+    """
+    Return {filename: entry} manifest for output_dir, or an empty dict if it
+    does not have a valid one.
+
+    :param output_dir: Path; directory of figures
+    :return: dict
+    """
+    try:
+        return json.loads((Path(output_dir) / MANIFEST_NAME).read_text())
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_manifest(output_dir, manifest):
+    """
+    Write manifest to output_dir, replacing the previous one in one step.
+
+    :param output_dir: Path; directory of figures
+    :param manifest: dict; {filename: entry}
+    """
+    manifest_file = Path(output_dir) / MANIFEST_NAME
+    temp_file = manifest_file.with_suffix('.tmp')
+    temp_file.write_text(json.dumps(manifest, indent=2, sort_keys=True))
+    os.replace(temp_file, manifest_file)
+
+
+def _schedule_slices(cube, schedule='cube'):
+    """
+    Return the order in which the 2D (latitude, longitude) slices of cube are
+    plotted.  Slices are identified by their index along the other (lead)
+    dimensions of the cube.
+
+    :param cube: Iris cube with latitude and longitude dimensions
+    :param schedule: str; one of SCHEDULES
+    :return lead_dims: list of int; cube dimensions that are not lat/lon
+    :return indices: list of tuple; index along lead_dims for each slice
+    """
+    if schedule not in SCHEDULES:
+        raise ValueError(f"Unknown schedule '{schedule}', "
+                         f"expected one of {SCHEDULES}")
+
+    yx_dims = cube.coord_dims('latitude') + cube.coord_dims('longitude')
+    lead_dims = [dim for dim in range(cube.ndim) if dim not in yx_dims]
+    indices = list(np.ndindex(*[cube.shape[dim] for dim in lead_dims]))
+
+    if schedule == 'cube':
+        return lead_dims, indices
+
+    def dim_points(names):
+        """Return points of coordinate on lead dimension, and its position"""
+        for position, dim in enumerate(lead_dims):
+            for coord in cube.coords(dimensions=dim, dim_coords=True):
+                if coord.name() in names:
+                    return position, coord.points
+        return None, None
+
+    time_position, times = dim_points({'time'})
+    zlevel_position, zlevels = dim_points(_KNOWN_ZLEVELS)
+
+    def sort_key(index):
+        time = times[index[time_position]] if times is not None else 0
+        zlevel = zlevels[index[zlevel_position]] if zlevels is not None else 0
+        return {'latest_time_first': (-time, zlevel),
+                'earliest_time_first': (time, zlevel),
+                'lowest_level_first': (zlevel, time),
+                'highest_level_first': (-zlevel, time)}[schedule]
+
+    return lead_dims, sorted(indices, key=sort_key)
+
+
+def _get_yx_slice(cube, lead_dims, index):
+    """
+    Return 2D slice of cube at index along lead dimensions, with dimensions
+    ordered (latitude, longitude) as by cube.slices().
+
+    :param cube: Iris cube with latitude and longitude dimensions
+    :param lead_dims: list of int; cube dimensions that are not lat/lon
+    :param index: tuple; position along each of lead_dims
+    :return: iris Cube
+    """
+    key = [slice(None)] * cube.ndim
+    for dim, position in zip(lead_dims, index):
+        key[dim] = position
+
+    yx_slice = cube[tuple(key)]
+    if yx_slice.coord_dims('latitude')[0] > yx_slice.coord_dims('longitude')[0]:
+        yx_slice.transpose()
+
+    return yx_slice
+
+
+def _placeholder_cube(cube):
+    """
+    Return copy of cube with placeholder lazy data of the same shape and
+    dtype.  Its coordinates and metadata can be sliced and pickled without
+    touching the original data.
+    """
+    placeholder = da.zeros(cube.shape, dtype=cube.dtype, chunks=cube.shape)
+    return cube.copy(data=placeholder)
+
+
+def _run_slice_task(task):
+    """
+    Unpack (key, args) task and call _save_yx_slice_figure.  Slices passed
+    as SharedSlice references are read from shared memory first.
+
+    :return: tuple; key, timestamp, filename
+    """
+    key, (yx_slice, *args) = task
+    if isinstance(yx_slice, SharedSlice):
+        yx_slice = yx_slice.load()
+
+    return (key, *_save_yx_slice_figure(yx_slice, *args))
+
+
+class SharedCube:
+    """
+    Realised data of a cube moved into a shared memory block, with a second
+    block for its mask.  Pool workers are sent SharedSlice references to
+    positions in the blocks instead of slice data.  close() removes the
+    names of the blocks; arrays that are already mapped stay valid.
+    """
+    def __init__(self, cube, mask_less=None):
+        """
+        The data of cube are replaced by an identical array backed by the
+        data block, so that the parent process does not hold a second copy.
+        The block stays mapped for as long as the cube uses it.  The mask
+        block holds the mask of the data and values beneath mask_less.
+
+        :param cube: iris Cube with latitude and longitude dimensions and
+            realised data
+        :param mask_less: float, values beneath this are masked out, or None
+        """
+        self._placeholder = _placeholder_cube(cube)
+        self._transpose = cube.coord_dims('latitude')[0] > cube.coord_dims('longitude')[0]
+        self._blocks = []
+
+        data = cube.data
+        self.data_block, values = self._create(data.shape, data.dtype)
+        values[...] = np.ma.getdata(data)
+        self.mask_block, mask = self._create(data.shape, bool)
+        mask[...] = np.ma.getmaskarray(data)
+        if mask_less is not None:
+            # One slice at a time, so that the comparison is never whole-cube
+            for position in np.ndindex(mask.shape[:-2]):
+                mask[position] |= values[position] < mask_less
+
+        if np.ma.isMaskedArray(data):
+            cube.data = np.ma.MaskedArray(values, mask=data.mask,
+                                          fill_value=data.fill_value, copy=False)
+        else:
+            cube.data = values
+
+        # Data to plot, with values beneath mask_less masked
+        self.data = np.ma.MaskedArray(values, mask=mask, copy=False)
+
+    def _create(self, shape, dtype):
+        """
+        Create shared memory block for an array.
+
+        :return block: tuple; (name, shape, dtype) of block
+        :return array: np.ndarray; writable view of the block
+        """
+        dtype = np.dtype(dtype)
+        shm = SharedMemory(create=True, size=max(int(np.prod(shape)) * dtype.itemsize, 1))
+        # The block is mapped again by np.memmap, whose mapping can outlive
+        # the SharedMemory object
+        shm.close()
+        self._blocks.append(shm)
+
+        block = (shm.name, shape, dtype.str)
+        return block, _map_shared_block(block, mode='r+')
+
+    def slice(self, lead_dims, index):
+        """
+        Return reference to the 2D slice at index along lead dimensions.
+
+        :param lead_dims: list of int; cube dimensions that are not lat/lon
+        :param index: tuple; position along each of lead_dims
+        :return: SharedSlice
+        """
+        key = [slice(None)] * self._placeholder.ndim
+        for dim, position in zip(lead_dims, index):
+            key[dim] = position
+
+        return SharedSlice(_get_yx_slice(self._placeholder, lead_dims, index),
+                           self.data_block, self.mask_block, tuple(key),
+                           self._transpose)
+
+    def close(self):
+        """Remove the names of the shared memory blocks."""
+        while self._blocks:
+            self._blocks.pop().unlink()
+
+
+class SharedSlice:
+    """
+    Reference to a 2D slice of a SharedCube.  It carries a copy of the slice
+    with placeholder lazy data for the coordinates and metadata, so it is
+    small to pickle.
+    """
+    def __init__(self, cube, data_block, mask_block, key, transpose):
+        """
+        :param cube: iris Cube, slice with placeholder lazy data
+        :param data_block: tuple; (name, shape, dtype) of data block
+        :param mask_block: tuple; (name, shape, dtype) of mask block
+        :param key: tuple; index of slice within blocks
+        :param transpose: bool; the slice is stored as (longitude, latitude)
+        """
+        self.cube = cube
+        self.data_block = data_block
+        self.mask_block = mask_block
+        self.key = key
+        self.transpose = transpose
+
+    def load(self):
+        """
+        Return the slice with its data as a read-only view of the shared
+        memory blocks.  The blocks are unmapped when the data are no longer
+        used.
+
+        :return: iris Cube
+        """
+        data = np.ma.MaskedArray(_map_shared_block(self.data_block)[self.key],
+                                 mask=_map_shared_block(self.mask_block)[self.key],
+                                 copy=False)
+
+        self.cube.data = data.T if self.transpose else data
+        return self.cube
+
+
+def _map_shared_block(block, mode='r'):
+    """
+    Return array view of a shared memory block, mapped from its file in
+    _SHARED_MEMORY_DIR.
+
+    :param block: tuple; (name, shape, dtype) of block
+    :param mode: str; np.memmap mode, 'r' for read-only or 'r+' to write
+    :return: np.ndarray
+    """
+    name, shape, dtype = block
+    return np.asarray(np.memmap(_SHARED_MEMORY_DIR / name.lstrip('/'), dtype=dtype,
+                                mode=mode, shape=shape))
+
+
+def _save_yx_slice_figure(yx_slice, output_dir, file_ext, limits, vaac_colours,
+                          central_longitude, kwargs, frame_key=None, mask_less=1e-8):
     """
     Call plot_2d_cube and save result in output_dir with name based on slice
     metadata.  This function is used by plot_3d_cube and plot_4d_cube functions
     and intended for use within multiprocessing.
 
-    The fig_paths Manager dictionary is updated independently be each running
-    process.
+    The timestamp and filename are returned so that the parent process can
+    collect them.
 
     :param yx_slice: 2d Iris cube (slice of larger cube)
-    :param fig_paths: dict; filenames for figures for each timestamp
     :param output_dir: str; directory to save figure
     :param file_ext, file extension suffix for data format e.g. png, pdf
     :param kwargs: dict; extra args for plot_2d_cube and plt.savefig
         e.g. limits, vaac_colours, dpi, bbox_inches
+    :param frame_key: str; key of MapFrame to reuse for slices from the same
+        cube, or None to draw a new figure
+    :param mask_less: float, values beneath this are masked out, or None if
+        the slice is already masked
+    :return timestamp: str; timestamp of slice
+    :return filename: str; filename of figure relative to output_dir
     """
     timestamp = _format_timestamp_string(yx_slice)
 
-    fig, title = plot_2d_cube(yx_slice, vaac_colours=vaac_colours,
-                              limits=limits, central_longitude=central_longitude)
+    vmin = kwargs.get('vmin')
+    vmax = kwargs.get('vmax')
+
+    if frame_key is None:
+        fig, title = plot_2d_cube(yx_slice, vmin=vmin, vmax=vmax, mask_less=mask_less,
+                                  vaac_colours=vaac_colours, limits=limits,
+                                  central_longitude=central_longitude)
+    else:
+        frame = _get_map_frame(frame_key, yx_slice, vmin=vmin, vmax=vmax, mask_less=mask_less,
+                               vaac_colours=vaac_colours, limits=limits,
+                               central_longitude=central_longitude)
+        fig, title = frame.fig, frame.title
     filename = output_dir / f"{title}.{file_ext}"
 
     _savefig_safe(fig, filename, **kwargs)
-    plt.close(fig)
+    if frame_key is None:
+        plt.close(fig)
     logger.debug("Plotted %s on process %s", title, os.getpid())
 
-    # Update shared dictionary of timestamps
-    fig_paths[timestamp] = str(filename.relative_to(output_dir))
+    return timestamp, str(filename.relative_to(output_dir))
+
+
+def _new_frame_key(kwargs):
+    """
+    Return a key identifying the map frames for a single plot call, or None
+    if figures are not to be reused.
+    """
+    if not kwargs.get('reuse_figures', True):
+        return None
+
+    return uuid4().hex
+
+
+def _get_map_frame(frame_key, yx_slice, **kwargs):
+    """
+    Return the MapFrame for frame_key with yx_slice drawn on it.  A new frame
+    is created the first time that a key is seen by the current process.
+
+    :param frame_key: str; key of MapFrame
+    :param yx_slice: 2d Iris cube (slice of larger cube)
+    :param kwargs: dict; arguments for MapFrame e.g. limits, vaac_colours
+    :return: MapFrame
+    """
+    try:
+        frame = _map_frames[frame_key]
+    except KeyError:
+        frame = MapFrame(yx_slice, **kwargs)
+        _map_frames[frame_key] = frame
+
+        # Close the least recently used frames
+        while len(_map_frames) > MAX_MAP_FRAMES:
+            _, old_frame = _map_frames.popitem(last=False)
+            old_frame.close()
+    else:
+        _map_frames.move_to_end(frame_key)
+        frame.update(yx_slice)
+
+    return frame
+
+
+def _release_map_frame(frame_key):
+    """
+    Close the MapFrame for frame_key if it is held by the current process.
+    """
+    frame = _map_frames.pop(frame_key, None)
+    if frame is not None:
+        frame.close()
 
 
 def _savefig_safe(fig, filename, **kwargs):
     """
     Call Matplotlib's savefig with a sanitised list of arguments.
     """
-    valid_args = {'dpi', 'facecolor', 'edgecolor', 'orientation', 'format',
-                  'transparent', 'bbox_inches', 'pad_inches', 'metadata',
-                  'pil_kwargs', 'backend'}
-
     # Filter kwargs to keep only valid arguments for savefig
-    filtered_kwargs = {k: v for k, v in kwargs.items() if k in valid_args}
+    filtered_kwargs = {k: v for k, v in kwargs.items() if k in _SAVEFIG_ARGS}
 
     fig.savefig(filename, **filtered_kwargs)
 
@@ -209,71 +850,155 @@ def plot_2d_cube(cube, vmin=None, vmax=None, mask_less=1e-8,
     :param cube: iris Cube
     :param vmin: Optional minimum value for scale
     :param vmax: Optional maximum value for scale
-    :param mask_less: float, values beneath this are masked out
+    :param mask_less: float, values beneath this are masked out, or None to
+        plot data as they are.  The cube itself is not modified.
     :param vaac_colours: bool, use cyan, grey, red aviation zones
     :param limits: tuple (xmin, ymin, xmax, ymax), bounding box for plot
     :return fig: handle to Matplotlib figure
     :return title: str; title of plot generated from cube attributes
     """
-    # Mask out data below threshold
-    cube.data = np.ma.masked_less(cube.data, mask_less)
-    # Prepare colormap
-    if vaac_colours and _vaac_compatible(cube):
-        colors = ['#80ffff', '#939598']
-        levels = [0.0002, 0.002, 0.004]
-        cmap = matplotlib.colors.ListedColormap(colors)
-        cmap.set_over('#e00404')
-        norm = matplotlib.colors.BoundaryNorm(levels, cmap.N, clip=False)
-
-    elif vaac_colours and not _vaac_compatible(cube):
-        # Raise a warning but continue with default colour scheme
-        warnings.warn("The VAAC colour scheme option (vaac_colours=True)"
-                      " is only compatible with air concentration data."
-                      " Falling back to use the default colour scheme...")
-        cmap = "viridis"
-        norm = None
+    frame = MapFrame(cube, vmin=vmin, vmax=vmax, mask_less=mask_less,
+                     vaac_colours=vaac_colours, limits=limits,
+                     central_longitude=central_longitude)
 
-    else:
-        cmap = "viridis"
-        norm = None
-
-    # Plot data
-    fig = plt.figure()
-    ax = plt.axes(projection=ccrs.PlateCarree(central_longitude))
-    mesh_plot = ax.pcolormesh(cube.coord('longitude').points, cube.coord('latitude').points,
-                              cube.data, transform=ccrs.PlateCarree(),
-                              vmin=vmin, vmax=vmax, cmap=cmap, norm=norm)
-
-    ax.coastlines(resolution='50m', color='grey')
-    colorbar = fig.colorbar(mesh_plot, orientation='horizontal',
-                            extend='max', extendfrac='auto')
-    colorbar.set_label(f'{cube.units}')
-
-    # Set axis limits
-    if limits:
-        xmin, ymin, xmax, ymax = limits
-        ax.set_xlim(xmin, xmax)
-        ax.set_ylim(ymin, ymax)
-
-    # # cant make gridlines work with crossing the dateline!
-    xticks = ax.get_xticks()
-    _ = ax.set_xticks(xticks, crs=ccrs.PlateCarree(central_longitude))
-
-    yticks = ax.get_yticks()
-    yticks[0] = max(yticks[0], -90)
-    yticks[-1] = min(yticks[-1], 90)
-    _ = ax.set_yticks(yticks, crs=ccrs.PlateCarree(central_longitude))
-
-    lon_formatter = LongitudeFormatter()
-    lat_formatter = LatitudeFormatter()
-    ax.xaxis.set_major_formatter(lon_formatter)
-    ax.yaxis.set_major_formatter(lat_formatter)
-
-    ax.grid()
+    return frame.fig, frame.title
 
+
+class MapFrame:
+    """
+    Reusable map figure for 2D slices that share the same horizontal grid.
+
+    The figure, projection, axis limits, coastlines, ticks, gridlines and
+    colorbar are drawn once, from the first slice.  Subsequent slices are
+    drawn with update(), which only swaps the mesh data and the title, so the
+    saved images are the same as those from plot_2d_cube.
+    """
+    def __init__(self, cube, vmin=None, vmax=None, mask_less=1e-8,
+                 vaac_colours=False, limits=None, central_longitude=0):
+        """
+        Draw the map frame and the data from the first slice.
+
+        :param cube: iris Cube, first 2D slice to draw
+        :param vmin: Optional minimum value for scale
+        :param vmax: Optional maximum value for scale
+        :param mask_less: float, values beneath this are masked out, or None
+            to plot data as they are.  The cube itself is not modified.
+        :param vaac_colours: bool, use cyan, grey, red aviation zones
+        :param limits: tuple (xmin, ymin, xmax, ymax), bounding box for plot
+        :param central_longitude: float, projection central longitude
+        """
+        self.vmin = vmin
+        self.vmax = vmax
+        self.mask_less = mask_less
+
+        # Mask out data below threshold
+        data = mask_less_than(cube.data, mask_less)
+
+        # Prepare colormap
+        if vaac_colours and _vaac_compatible(cube):
+            colors = ['#80ffff', '#939598']
+            levels = list(VAAC_THRESHOLDS)
+            cmap = matplotlib.colors.ListedColormap(colors)
+            cmap.set_over('#e00404')
+            norm = matplotlib.colors.BoundaryNorm(levels, cmap.N, clip=False)
+
+        elif vaac_colours and not _vaac_compatible(cube):
+            # Raise a warning but continue with default colour scheme
+            warnings.warn("The VAAC colour scheme option (vaac_colours=True)"
+                          " is only compatible with air concentration data."
+                          " Falling back to use the default colour scheme...")
+            cmap = "viridis"
+            norm = None
+
+        else:
+            cmap = "viridis"
+            norm = None
+
+        # Colour scale is autoscaled for each slice unless a norm is fixed.
+        # Limits cannot be passed with a norm, as they are set by its levels.
+        self._autoscale = norm is None
+        if not self._autoscale:
+            vmin, vmax = None, None
+
+        # Plot data
+        fig = plt.figure()
+        ax = plt.axes(projection=ccrs.PlateCarree(central_longitude))
+        mesh_plot = ax.pcolormesh(cube.coord('longitude').points, cube.coord('latitude').points,
+                                  data, transform=ccrs.PlateCarree(),
+                                  vmin=vmin, vmax=vmax, cmap=cmap, norm=norm)
+
+        ax.coastlines(resolution='50m', color='grey')
+        colorbar = fig.colorbar(mesh_plot, orientation='horizontal',
+                                extend='max', extendfrac='auto')
+        colorbar.set_label(f'{cube.units}')
+
+        # Set axis limits
+        if limits:
+            xmin, ymin, xmax, ymax = limits
+            ax.set_xlim(xmin, xmax)
+            ax.set_ylim(ymin, ymax)
+
+        # # cant make gridlines work with crossing the dateline!
+        xticks = ax.get_xticks()
+        _ = ax.set_xticks(xticks, crs=ccrs.PlateCarree(central_longitude))
+
+        yticks = ax.get_yticks()
+        yticks[0] = max(yticks[0], -90)
+        yticks[-1] = min(yticks[-1], 90)
+        _ = ax.set_yticks(yticks, crs=ccrs.PlateCarree(central_longitude))
+
+        lon_formatter = LongitudeFormatter()
+        lat_formatter = LatitudeFormatter()
+        ax.xaxis.set_major_formatter(lon_formatter)
+        ax.yaxis.set_major_formatter(lat_formatter)
+
+        ax.grid()
+
+        self.fig = fig
+        self.ax = ax
+        self.mesh = mesh_plot
+        self.title = _format_title(cube)
+        ax.set_title(self.title)
+
+    def update(self, cube):
+        """
+        Replace the mesh data and title with those from another slice on the
+        same grid.
+
+        :param cube: iris Cube, 2D slice to draw
+        :return title: str; title of plot generated from cube attributes
+        """
+        data = mask_less_than(cube.data, self.mask_less)
+        self.mesh.set_array(data)
+
+        if self._autoscale:
+            # Repeat the scaling that pcolormesh applies to new data
+            norm = matplotlib.colors.Normalize(self.vmin, self.vmax)
+            norm.autoscale_None(data)
+            self.mesh.set_clim(norm.vmin, norm.vmax)
+
+        self.title = _format_title(cube)
+        self.ax.set_title(self.title)
+
+        return self.title
+
+    def close(self):
+        """Close the figure."""
+        plt.close(self.fig)
+
+
+def _format_title(cube, label=None):
+    """
+    Return plot title for 2D cube based on its attributes, zlevel and
+    timestamp.
+
+    :param cube: Iris cube
+    :param label: str; used in place of the timestamp if given
+    :return: str, title
+    """
     # Get title attributes
     zlevel = _format_zlevel_string(cube)
-    timestamp = _format_timestamp_string(cube)
+    timestamp = label or _format_timestamp_string(cube)
 
     # Get and apply title, filter removes NoneType
     # elements before joining.
@@ -282,9 +1007,62 @@ def plot_2d_cube(cube, vmin=None, vmax=None, mask_less=1e-8,
         cube.attributes.get('quantity').replace(' ', '_'),
         str(zlevel),
         str(timestamp))))
-    ax.set_title(title)
 
-    return fig, title
+    return title
+
+
+def mask_less_than(data, mask_less):
+    """
+    Return data with values beneath mask_less masked out, in addition to any
+    existing mask.  Unlike np.ma.masked_less, the data values are not copied:
+    the result is a view of data with a new mask.  Dask arrays are masked
+    lazily.
+
+    :param data: np.ndarray or dask array
+    :param mask_less: float, values beneath this are masked out, or None to
+        return data unchanged
+    :return: masked array view of data
+    """
+    if mask_less is None:
+        return data
+
+    if isinstance(data, da.Array):
+        return da.ma.masked_where(data < mask_less, data)
+
+    mask = np.ma.getmaskarray(data) | (np.ma.getdata(data) < mask_less)
+    return np.ma.MaskedArray(data, mask=mask, copy=False)
+
+
+def colour_scale_limits(cube, vmin=0, vmax=None, vmax_percentile=None,
+                        mask_less=1e-8):
+    """
+    Return colour scale limits for plotting all slices of a cube.  A vmax
+    that is not given is calculated by a chunked reduction over the lazy
+    data, so the whole cube is never loaded into memory at once.
+
+    :param cube: Iris cube
+    :param vmin: minimum value for scale
+    :param vmax: maximum value for scale, default is maximum of data
+    :param vmax_percentile: float, percentile (0-100) of plotted values to use
+        for vmax instead of the maximum.  Values that are masked or below
+        mask_less are not plotted so are ignored.  The percentile is
+        approximate when data are split into many chunks.
+    :param mask_less: float, values beneath this are masked out
+    :return vmin: minimum value for scale
+    :return vmax: maximum value for scale
+    """
+    if vmax is None:
+        # lazy_data() wraps real data without copying it
+        data = cube.lazy_data()
+
+        if vmax_percentile is None:
+            vmax = da.max(data).compute()
+        else:
+            values = da.ma.getdata(data)
+            plotted = values[~da.ma.getmaskarray(data) & (values >= mask_less)]
+            vmax = da.percentile(plotted, [vmax_percentile]).compute()[0]
+
+    return vmin, vmax
 
 
 def render_html(source, metadata):
@@ -312,6 +1090,28 @@ def render_html(source, metadata):
     return template.render(**params)
 
 
+def write_html(source, output_dir, metadata):
+    """
+    Write HTML page for plots using metadata outputs from plotting
+    functions.  The page is named after the model run title and quantity.
+
+    :param source: str, source data for cube
+    :param output_dir: str, target directory for html file
+    :param metadata: dict, metadata produced by plot function
+    :return: Path, HTML file
+    """
+    html = render_html(source, metadata)
+
+    name = '_'.join(filter(None, (
+        metadata['attributes'].get('model_run_title'),
+        metadata['attributes'].get('quantity'),
+        "summary.html"))).replace(' ', '_')
+    output_file = Path(output_dir) / name
+    output_file.write_text(html)
+
+    return output_file
+
+
 def _format_timestamp_string(cube):
     """
     Return string representation of the timestamp for the cube. Method takes
@@ -336,10 +1136,8 @@ def _get_zlevel_name(cube):
     """
     Return name of coordinate representing zlevel for cube.
     """
-    known_z = set(['alt', 'altitude', 'flight_level', 'z coordinate of x-y plane cuts',
-                   'Top height of each layer'])
     cube_coords = [c.name() for c in cube.coords()]
-    return known_z.intersection(cube_coords).pop()
+    return _KNOWN_ZLEVELS.intersection(cube_coords).pop()
 
 
 def _format_zlevel_string(cube):
@@ -27,7 +27,8 @@ setuptools.setup(
     entry_points={
         "console_scripts": [
             "plot_ash_model_results=ash_model_plotting.plot_ash_model_results:main",
-            "name_to_netcdf=ash_model_plotting.name_to_netcdf:main"]
+            "name_to_netcdf=ash_model_plotting.name_to_netcdf:main",
+            "ensemble_exceedance=ash_model_plotting.ensemble:main"]
     },
     classifiers=[
         "Programming Language :: Python :: 3",
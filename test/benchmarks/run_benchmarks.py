@@ -0,0 +1,241 @@
+"""
+Benchmark loading, extraction, rendering and HTML stages for each model type
+on synthetic data of increasing size, with serial and parallel plotting.
+NAME Fields .txt files (name_text) are also loaded in parallel, with the
+fast reader and through a cold and a warm cache.
+
+Run from the repository root e.g.
+
+    python test/benchmarks/run_benchmarks.py --sizes 4x3x100x100 8x5x200x200 \
+        --workers 2 4 --output benchmarks.json
+
+Timings can be compared against an earlier run with --baseline, which reports
+stages that are slower by more than --tolerance and exits with status 1.
+"""
+import argparse
+from contextlib import contextmanager, nullcontext
+import json
+import os
+from pathlib import Path
+import sys
+import tempfile
+import time
+
+import matplotlib.pyplot as plt
+import numpy as np
+
+from ash_model_plotting import (
+    NameAshModelResult,
+    Fall3DAshModelResult,
+    HysplitAshModelResult,
+)
+from ash_model_plotting.plotting import (
+    plot_2d_cube,
+    plot_3d_cube,
+    plot_4d_cube,
+    render_html,
+    worker_pool,
+)
+
+sys.path.insert(0, str(Path(__file__).parent))
+from synthetic import WRITERS  # noqa: E402
+
+MODEL_TYPES = {
+    'name': NameAshModelResult,
+    'name_text': NameAshModelResult,
+    'fall3d': Fall3DAshModelResult,
+    'hysplit': HysplitAshModelResult
+}
+
+
+def run_benchmarks(sizes, model_types, workers, repeat=1, work_dir=None):
+    """
+    Time each stage for every combination of model type and size.
+
+    :param sizes: list of tuple; (time, levels, lat, lon) sizes
+    :param model_types: list of str; keys of MODEL_TYPES
+    :param workers: list of int; worker counts for parallel plotting
+    :param repeat: int; number of repeats, the fastest is reported
+    :param work_dir: Path; directory for data and figures
+    :return: dict; {benchmark name: seconds}
+    """
+    timings = {}
+
+    with tempfile.TemporaryDirectory(dir=work_dir) as tmp:
+        tmp = Path(tmp)
+        for model_type in model_types:
+            for size in sizes:
+                label = f"{model_type}/{'x'.join(map(str, size))}"
+                path = tmp / label.replace('/', '_')
+                if model_type != 'name_text':
+                    path = path.with_suffix('.nc')
+                source = WRITERS[model_type](path, *size)
+                for _ in range(repeat):
+                    for name, seconds in _time_stages(model_type, source, workers, tmp):
+                        key = f"{label}/{name}"
+                        timings[key] = min(seconds, timings.get(key, float('inf')))
+                        print(f"{key:<50} {timings[key]:8.3f} s", flush=True)
+
+    return timings
+
+
+def _time_stages(model_type, source, workers, tmp):
+    """Yield (stage name, seconds) for each stage of plotting source."""
+    with _timer() as elapsed:
+        result = MODEL_TYPES[model_type](source)
+    yield 'load', elapsed()
+
+    if model_type == 'name_text':
+        yield from _time_name_text_loading(source, workers, tmp)
+
+    for quantity in ('air_concentration', 'total_column', 'total_deposition'):
+        with _timer() as elapsed:
+            cube = getattr(result, quantity)
+            # Extraction is lazy, so include reading the data, without
+            # caching it on the cube
+            np.asarray(cube.core_data())
+        yield f'extract_{quantity}', elapsed()
+
+    air_concentration = result.air_concentration
+    yx_slice = next(air_concentration.slices(['latitude', 'longitude']))
+    with _timer() as elapsed:
+        fig, _ = plot_2d_cube(yx_slice)
+        fig.savefig(tmp / 'plot_2d.png')
+    plt.close(fig)
+    yield 'plot_2d_cube', elapsed()
+
+    runs = [('serial', {'serial': True})]
+    runs += [(f'workers_{n}', {'workers': n}) for n in workers]
+    for run_name, kwargs in runs:
+        with worker_pool(kwargs['workers']) if 'workers' in kwargs else nullcontext() as pool:
+            if pool is not None:
+                # Start-up is paid once per pool, so is timed separately
+                with _timer() as elapsed:
+                    pool.map(time.sleep, [0.05] * kwargs['workers'], chunksize=1)
+                yield f'pool_startup_{run_name}', elapsed()
+
+            output_dir = Path(tempfile.mkdtemp(dir=tmp))
+            with _timer() as elapsed:
+                plot_3d_cube(result.total_column, output_dir, **kwargs)
+            yield f'plot_3d_cube_{run_name}', elapsed()
+
+            with _timer() as elapsed:
+                metadata = plot_4d_cube(air_concentration, output_dir, **kwargs)
+            yield f'plot_4d_cube_{run_name}', elapsed()
+
+    with _timer() as elapsed:
+        render_html(source, metadata)
+    yield 'render_html', elapsed()
+
+
+def _time_name_text_loading(source, workers, tmp):
+    """Yield (stage name, seconds) for each option for parsing NAME files."""
+    for n in workers:
+        with worker_pool(n) as pool:
+            # Start-up is timed with plotting, so is excluded here
+            pool.map(time.sleep, [0.05] * n, chunksize=1)
+            with _timer() as elapsed:
+                NameAshModelResult(source, workers=n)
+            yield f'load_workers_{n}', elapsed()
+
+    with _timer() as elapsed:
+        NameAshModelResult(source, fast_reader=True)
+    yield 'load_fast_reader', elapsed()
+
+    cache_dir = Path(tempfile.mkdtemp(dir=tmp))
+    for stage in ('cold', 'warm'):
+        with _timer() as elapsed:
+            NameAshModelResult(source, cache_dir=cache_dir)
+        yield f'load_cache_{stage}', elapsed()
+
+
+@contextmanager
+def _timer():
+    """Yield function that returns seconds elapsed within the block."""
+    start = time.perf_counter()
+    end = None
+
+    def elapsed():
+        return (end or time.perf_counter()) - start
+
+    try:
+        yield elapsed
+    finally:
+        end = time.perf_counter()
+
+
+def compare(timings, baseline, tolerance):
+    """
+    Return benchmarks that are slower than baseline by more than tolerance.
+
+    :param timings: dict; {benchmark name: seconds}
+    :param baseline: dict; {benchmark name: seconds} from earlier run
+    :param tolerance: float; allowed fractional increase e.g. 0.2
+    :return: dict; {benchmark name: (baseline seconds, seconds)}
+    """
+    return {name: (baseline[name], seconds) for name, seconds in timings.items()
+            if name in baseline and seconds > baseline[name] * (1 + tolerance)}
+
+
+def parse_size(text):
+    """Parse size string e.g. 4x3x100x100 into (time, levels, lat, lon)."""
+    try:
+        size = tuple(int(part) for part in text.split('x'))
+    except ValueError:
+        size = ()
+    if len(size) != 4:
+        raise argparse.ArgumentTypeError(
+            f"Size must be TIMExLEVELSxLATxLON, got '{text}'")
+    return size
+
+
+def main():
+    """Parse arguments, run benchmarks and compare with baseline."""
+    parser = argparse.ArgumentParser(
+        description='Benchmark ash model result loading and plotting')
+    parser.add_argument(
+        '--sizes',
+        help="Synthetic data sizes as TIMExLEVELSxLATxLON",
+        nargs='+', type=parse_size, default=[(4, 3, 100, 100)])
+    parser.add_argument(
+        '--model_types',
+        help="Model types to benchmark",
+        nargs='+', choices=MODEL_TYPES.keys(), default=list(MODEL_TYPES))
+    parser.add_argument(
+        '--workers',
+        help="Worker counts for parallel plotting",
+        nargs='+', type=int, default=[len(os.sched_getaffinity(0))])
+    parser.add_argument(
+        '--repeat',
+        help="Number of repeats, the fastest time is reported",
+        default=1, type=int)
+    parser.add_argument(
+        '--output',
+        help="Path to JSON file for timings",
+        default=None)
+    parser.add_argument(
+        '--baseline',
+        help="Path to JSON file of timings from an earlier run",
+        default=None)
+    parser.add_argument(
+        '--tolerance',
+        help="Allowed fractional slowdown compared with baseline",
+        default=0.2, type=float)
+    args = parser.parse_args()
+
+    timings = run_benchmarks(args.sizes, args.model_types, args.workers, args.repeat)
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(timings, indent=2))
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text())
+        regressions = compare(timings, baseline, args.tolerance)
+        for name, (before, after) in regressions.items():
+            print(f"REGRESSION {name}: {before:.3f} s -> {after:.3f} s")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,264 @@
+"""
+Generators for synthetic ash model results of configurable size, written as
+NetCDF files in the layout produced by each model, or as NAME Fields .txt
+files.  The data are a plume of ash that drifts east and spreads out with time
+and that is thinner at higher levels, so that slices contain a realistic mix
+of ash and empty cells.
+"""
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from netCDF4 import Dataset
+import numpy as np
+
+
+def plume(n_times, n_levels, n_lat, n_lon, peak=1e-3, seed=0):
+    """
+    Return array of ash concentrations with shape (time, level, lat, lon).
+
+    :param n_times: int; number of timesteps
+    :param n_levels: int; number of vertical levels
+    :param n_lat: int; number of latitude points
+    :param n_lon: int; number of longitude points
+    :param peak: float; maximum concentration
+    :param seed: int; seed for random noise
+    :return: np.ndarray of float32
+    """
+    rng = np.random.default_rng(seed)
+    y = np.linspace(-1, 1, n_lat)[:, np.newaxis]
+    x = np.linspace(-1, 1, n_lon)[np.newaxis, :]
+
+    data = np.zeros((n_times, n_levels, n_lat, n_lon), dtype=np.float32)
+    for t in range(n_times):
+        centre = -0.8 + 1.6 * t / max(n_times - 1, 1)
+        width = 0.1 + 0.3 * t / max(n_times - 1, 1)
+        for z in range(n_levels):
+            level_peak = peak * 10 ** (-3 * z / max(n_levels - 1, 1))
+            data[t, z] = level_peak * np.exp(-((x - centre) ** 2 + y ** 2) / (2 * width ** 2))
+
+    noise = rng.uniform(0.5, 1.5, size=data.shape).astype(np.float32)
+    data *= noise
+    # Values beneath plotting threshold are written as zero, as by the models
+    data[data < 1e-8] = 0
+
+    return data
+
+
+def write_name_netcdf(path, n_times, n_levels, n_lat, n_lon, seed=0):
+    """
+    Write synthetic NAME result in the layout of name_to_netcdf output.
+
+    :param path: Path; file to write
+    :return: Path
+    """
+    data = plume(n_times, n_levels, n_lat, n_lon, seed=seed)
+
+    with Dataset(path, 'w') as nc:
+        nc.setncatts({'Title': 'Synthetic_NAME', 'Species': 'VOLCANIC_ASH',
+                      'NAME Version': 'NAME III (version 7.2)',
+                      'Conventions': 'CF-1.5'})
+        _add_dimension(nc, 'time', np.arange(n_times) * 3.0 + 350000,
+                       units='hours since 1970-01-01 00:00:00',
+                       standard_name='time', calendar='gregorian')
+        _add_dimension(nc, 'altitude', 500.0 + 500.0 * np.arange(n_levels),
+                       units='m', standard_name='altitude',
+                       long_name='altitude above sea level')
+        _add_horizontal_dimensions(nc, 'latitude', 'longitude', n_lat, n_lon, np.float64)
+
+        quantities = {
+            'volcanic_ash_air_concentration': (
+                'VOLCANIC_ASH_AIR_CONCENTRATION', 'g/m3', 'Air Concentration',
+                ('altitude', 'time', 'latitude', 'longitude'), data.swapaxes(0, 1)),
+            'volcanic_ash_dosage': (
+                'VOLCANIC_ASH_DOSAGE', 'g s/m2', 'Dosage',
+                ('time', 'latitude', 'longitude'), data.sum(axis=1) * 10800),
+            'volcanic_ash_total_deposition': (
+                'VOLCANIC_ASH_TOTAL_DEPOSITION', 'g/m2', 'Total deposition',
+                ('time', 'latitude', 'longitude'), np.cumsum(data[:, 0], axis=0) * 100),
+        }
+        for var_name, (long_name, units, quantity, dims, values) in quantities.items():
+            var = nc.createVariable(var_name, 'f4', dims)
+            var.setncatts({'long_name': long_name, 'units': units, 'Quantity': quantity})
+            var[:] = values
+
+    return path
+
+
+def write_name_text(path, n_times, n_levels, n_lat, n_lon, seed=0):
+    """
+    Write synthetic NAME result as NAME III Fields .txt files, with air
+    concentration, dosage and deposition files for each timestep.  As in NAME
+    output, rows are only written for cells with ash.
+
+    :param path: Path; directory to write files into
+    :return: list of Path; files written
+    """
+    data = plume(n_times, n_levels, n_lat, n_lon, seed=seed)
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    start = datetime(2010, 4, 18, 3)
+    altitudes = 500 + 500 * np.arange(n_levels)
+
+    files = []
+    for t in range(n_times):
+        validity = start + timedelta(hours=3 * t)
+        fields = {
+            'Air_Conc_grid': (
+                '003 hr time averaged', 'Air Concentration', 'g/m3',
+                [f'From {z - 250:5d} - {z + 250:5d}m asl' for z in altitudes], data[t]),
+            'TotCol': (
+                '003 hr time integrated', 'Dosage', 'gs/m2',
+                ['Vertical integral'], data[t].sum(axis=0, keepdims=True) * 10800),
+            'Deposition_load': (
+                '003 hr time integrated', 'Total deposition', 'g/m2',
+                ['Boundary layer'], data[t, :1] * 100),
+        }
+        for prefix, (averaging, quantity, units, z_levels, values) in fields.items():
+            filename = path / f"{prefix}_{validity:%Y%m%d%H%M}.txt"
+            _write_name_fields(filename, validity, averaging, quantity, units,
+                               z_levels, values)
+            files.append(filename)
+
+    return files
+
+
+def _write_name_fields(filename, validity, averaging, quantity, units, z_levels,
+                       values):
+    """Write NAME Fields file with a field for each level of values."""
+    n_lat, n_lon = values.shape[1:]
+    lat_resolution = 35 / max(n_lat - 1, 1)
+    lon_resolution = 60 / max(n_lon - 1, 1)
+    header = {
+        'Title': 'Synthetic_NAME',
+        'Run time': '0000UTC 18/04/2010',
+        'Met data': 'NWP Flow.Synthetic',
+        'Start of release': '0000UTC 17/04/2010',
+        'End of release': '0800UTC 17/04/2010',
+        'Release rate': '9.4444448E+07g/s',
+        'Release location': '19.3600W   63.3700N',
+        'Release height': '1651.000 to 6151.000m asl',
+        'Forecast duration': '75 hours',
+        'X grid origin': f'{-40 - lon_resolution / 2:.7f}',
+        'Y grid origin': f'{40 - lat_resolution / 2:.7f}',
+        'X grid size': n_lon,
+        'Y grid size': n_lat,
+        'X grid resolution': f'{lon_resolution:.7f}',
+        'Y grid resolution': f'{lat_resolution:.7f}',
+        'Number of fields': len(z_levels),
+    }
+    column_headings = [
+        ['VOLCANIC'] * len(z_levels),
+        ['VOLCANIC_ASH'] * len(z_levels),
+        [averaging] * len(z_levels),
+        [quantity] * len(z_levels),
+        [units] * len(z_levels),
+        z_levels,
+    ]
+    time_heading = [f'{validity:%H%MUTC %d/%m/%Y}'] * len(z_levels)
+
+    lines = ['NAME III (version 7.2)']
+    lines += [f' {key + ":":<20} {value}' for key, value in header.items()]
+    lines.append(' ')
+    lines += [_name_row([''] * 4 + headings) for headings in column_headings]
+    lines.append(_name_row(['X grid', 'Y grid', 'Longitude', 'Latitude'] + time_heading))
+    lines.append(' ')
+    for y_index, x_index in zip(*np.nonzero(values.any(axis=0))):
+        lines.append(_name_row(
+            [f'{x_index + 1.5:.6f}', f'{y_index + 1.5:.6f}',
+             f'{-40 + x_index * lon_resolution:.6f}',
+             f'{40 + y_index * lat_resolution:.6f}']
+            + [f'{value:.8E}' for value in values[:, y_index, x_index]]))
+
+    Path(filename).write_text('\n'.join(lines) + '\n')
+
+
+def _name_row(columns):
+    """Return line of right-aligned, comma-terminated NAME columns."""
+    return ''.join(f'{column:>19},' for column in columns[:4]) + \
+        ''.join(f'{column:>24},' for column in columns[4:])
+
+
+def write_fall3d_netcdf(path, n_times, n_levels, n_lat, n_lon, seed=0):
+    """
+    Write synthetic FALL3D result in the layout of FALL3D 8 output.
+
+    :param path: Path; file to write
+    :return: Path
+    """
+    data = plume(n_times, n_levels, n_lat, n_lon, seed=seed)
+
+    with Dataset(path, 'w') as nc:
+        nc.setncatts({'source': 'FALL3D model version 8.0.1',
+                      'title': 'Model results', 'Conventions': 'CF-1.6'})
+        _add_dimension(nc, 'time', np.arange(n_times) * 10800.0,
+                       units='seconds since 2020-03-30 0:0:0',
+                       standard_name='time', calendar='proleptic_gregorian')
+        _add_dimension(nc, 'zcut', 1000.0 * np.arange(n_levels), dtype=np.float32,
+                       units='m', long_name='z coordinate of x-y plane cuts')
+        _add_horizontal_dimensions(nc, 'lat', 'lon', n_lat, n_lon, np.float32)
+
+        quantities = {
+            'tephra_con_xy': ('tephra_concentration on z-cut planes', 'g/m3',
+                              ('time', 'zcut', 'lat', 'lon'), data),
+            'tephra_col_mass': ('tephra_column mass load', 'g/m2',
+                                ('time', 'lat', 'lon'), data.sum(axis=1) * 1000),
+            'tephra_grn_load': ('tephra_ground mass load', 'kg/m2',
+                                ('time', 'lat', 'lon'), np.cumsum(data[:, 0], axis=0) / 10),
+        }
+        for var_name, (long_name, units, dims, values) in quantities.items():
+            var = nc.createVariable(var_name, 'f4', dims)
+            var.setncatts({'long_name': long_name, 'units': units})
+            var[:] = values
+
+    return path
+
+
+def write_hysplit_netcdf(path, n_times, n_levels, n_lat, n_lon, seed=0):
+    """
+    Write synthetic HYSPLIT result in the layout of HYSPLIT concentration
+    output.  The lowest level, at height 0, holds deposition for each step.
+
+    :param path: Path; file to write
+    :return: Path
+    """
+    data = plume(n_times, n_levels + 1, n_lat, n_lon, seed=seed)
+
+    with Dataset(path, 'w') as nc:
+        nc.setncatts({'title': 'HYSPLIT Model Concentration Output',
+                      'Conventions': 'CF-1.5'})
+        _add_dimension(nc, 'time', np.arange(n_times) / 8 + 18350.0,
+                       units='days since 1970-01-01 00:00:00',
+                       standard_name='time', calendar='gregorian')
+        _add_dimension(nc, 'levels', 1000 * np.arange(n_levels + 1), dtype=np.int32,
+                       units='m', long_name='Top height of each layer')
+        _add_horizontal_dimensions(nc, 'latitude', 'longitude', n_lat, n_lon, np.float32)
+
+        var = nc.createVariable('SUM', 'f4', ('time', 'levels', 'latitude', 'longitude'))
+        var.long_name = 'Concentration Array - SUM '
+        var[:] = data
+
+    return path
+
+
+def _add_dimension(nc, name, points, dtype=np.float64, **attributes):
+    """Add dimension with coordinate variable of the same name."""
+    nc.createDimension(name, len(points))
+    var = nc.createVariable(name, dtype, (name,))
+    var.setncatts(attributes)
+    var[:] = points
+
+
+def _add_horizontal_dimensions(nc, lat_name, lon_name, n_lat, n_lon, dtype):
+    """Add latitude and longitude dimensions covering the North Atlantic."""
+    _add_dimension(nc, lat_name, np.linspace(40, 75, n_lat), dtype=dtype,
+                   units='degrees_north', standard_name='latitude')
+    _add_dimension(nc, lon_name, np.linspace(-40, 20, n_lon), dtype=dtype,
+                   units='degrees_east', standard_name='longitude')
+
+
+WRITERS = {
+    'name': write_name_netcdf,
+    'name_text': write_name_text,
+    'fall3d': write_fall3d_netcdf,
+    'hysplit': write_hysplit_netcdf,
+}
@@ -0,0 +1,49 @@
+"""Tests for synthetic benchmark data."""
+import numpy as np
+import pytest
+
+from ash_model_plotting import (
+    NameAshModelResult,
+    Fall3DAshModelResult,
+    HysplitAshModelResult,
+)
+
+from synthetic import WRITERS, plume
+
+# pylint: disable=missing-docstring
+
+
+@pytest.mark.parametrize('model_type, result_class, air_concentration_shape', [
+    ('name', NameAshModelResult, (2, 3, 10, 12)),
+    ('fall3d', Fall3DAshModelResult, (3, 2, 10, 12)),
+    ('hysplit', HysplitAshModelResult, (3, 2, 10, 12)),
+    ])
+def test_synthetic_results_load(tmpdir, model_type, result_class,
+                                air_concentration_shape):
+    # Arrange
+    path = WRITERS[model_type](tmpdir / f'{model_type}.nc', 3, 2, 10, 12)
+
+    # Act
+    result = result_class(path)
+
+    # Assert
+    assert result.air_concentration.shape == air_concentration_shape
+    assert result.total_column.shape == (3, 10, 12)
+    assert result.total_deposition.shape == (3, 10, 12)
+    assert result.air_concentration.data.max() > 0
+
+
+@pytest.mark.parametrize('fast_reader', [False, True])
+def test_synthetic_name_text_results_load(tmpdir, fast_reader):
+    # Arrange
+    files = WRITERS['name_text'](tmpdir / 'name_text', 3, 2, 10, 12)
+
+    # Act
+    result = NameAshModelResult(files, fast_reader=fast_reader)
+
+    # Assert
+    assert len(files) == 9
+    assert result.air_concentration.shape == (3, 2, 10, 12)
+    assert result.total_column.shape == (3, 10, 12)
+    assert result.total_deposition.shape == (3, 10, 12)
+    np.testing.assert_array_equal(result.air_concentration.data, plume(3, 2, 10, 12))
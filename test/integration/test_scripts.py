@@ -4,6 +4,7 @@ from pathlib import Path
 import subprocess
 
 from netCDF4 import Dataset
+import numpy as np
 import pytest
 
 logger = logging.getLogger(__name__)
@@ -89,6 +90,67 @@ def test_plot_ash_model_results_happy_path(tmpdir, data_dir, script_dir,
     assert output_files == expected_output_files
 
 
+def test_plot_ash_model_results_incremental(tmpdir, data_dir, script_dir, scantree):
+    """Test that incremental rerun keeps unchanged plots."""
+    # Arrange
+    script_path = script_dir / 'plot_ash_model_results.py'
+    input_file = data_dir / 'VA_Tutorial_NAME_output.nc'
+    command = ['python', script_path, input_file, '--output_dir', tmpdir,
+               '--incremental', '--workers', '2']
+    subprocess.check_call(command)
+    first_run = {entry.path: entry.stat().st_mtime_ns
+                 for entry in scantree(tmpdir) if entry.name.endswith('.png')}
+
+    # Act
+    exit_code = subprocess.check_call(command)
+    second_run = {entry.path: entry.stat().st_mtime_ns
+                  for entry in scantree(tmpdir) if entry.name.endswith('.png')}
+    manifests = {Path(entry.path).relative_to(tmpdir).as_posix()
+                 for entry in scantree(tmpdir) if entry.name == 'plot_manifest.json'}
+
+    # Assert
+    assert exit_code == 0
+    assert len(first_run) == 8
+    assert second_run == first_run
+    assert manifests == {'plot_manifest.json', '00500/plot_manifest.json',
+                         '01000/plot_manifest.json'}
+
+
+@pytest.mark.parametrize('options', [
+    ['--serial'],
+    ['--workers', '2', '--chunksize', '1', '--schedule', 'latest_time_first'],
+    ])
+def test_plot_ash_model_results_parallel_options(tmpdir, data_dir, script_dir,
+                                                 scantree, options):
+    """Test plotting with parallel processing options."""
+    # Arrange
+    script_path = script_dir / 'plot_ash_model_results.py'
+    input_file = data_dir / 'VA_Tutorial_NAME_output.nc'
+    expected_output_files = {
+        '00500/VA_Tutorial_Air_Concentration_00500_20100418030000.png',
+        '00500/VA_Tutorial_Air_Concentration_00500_20100418060000.png',
+        '01000/VA_Tutorial_Air_Concentration_01000_20100418030000.png',
+        '01000/VA_Tutorial_Air_Concentration_01000_20100418060000.png',
+        'VA_Tutorial_Total_Column_Mass_20100418030000.png',
+        'VA_Tutorial_Total_Column_Mass_20100418060000.png',
+        'VA_Tutorial_Total_Deposition_20100418030000.png',
+        'VA_Tutorial_Total_Deposition_20100418060000.png',
+        'VA_Tutorial_Air_Concentration_summary.html',
+        'VA_Tutorial_Total_Column_Mass_summary.html',
+        'VA_Tutorial_Total_Deposition_summary.html',
+    }
+
+    # Act
+    exit_code = subprocess.check_call(
+        ['python', script_path, input_file, '--output_dir', tmpdir, *options])
+    output_files = {Path(entry).relative_to(tmpdir).as_posix()
+                    for entry in scantree(tmpdir) if entry.is_file()}
+
+    # Assert
+    assert exit_code == 0
+    assert output_files == expected_output_files
+
+
 def test_plot_ash_model_results_create_dir(tmpdir, data_dir, script_dir,
                                            scantree):
     # Arrange
@@ -153,3 +215,99 @@ def test_name_to_netcdf_defaults(tmpdir, script_dir, data_dir):
 
     nc = Dataset(output_file.absolute())
     assert expected_variables == list(nc.variables.keys())
+
+
+def test_name_to_netcdf_compression(tmpdir, script_dir, data_dir):
+    tmpdir = Path(tmpdir)
+    script_path = script_dir / 'name_to_netcdf.py'
+
+    # Act
+    exit_code = subprocess.check_call(
+        ['python', script_path, data_dir, '--prefix', 'Air_Conc',
+         '--output_dir', tmpdir, '--output_name', 'air_conc.nc',
+         '--complevel', '6'])
+
+    # Assert
+    assert exit_code == 0
+
+    with Dataset(tmpdir / 'air_conc.nc') as nc:
+        variable = nc['volcanic_ash_air_concentration_0']
+        assert variable.filters()['zlib']
+        assert variable.filters()['shuffle']
+        assert variable.filters()['complevel'] == 6
+        assert variable.dimensions == ('time', 'altitude', 'latitude', 'longitude')
+        assert variable.chunking() == [1, 1, *variable.shape[2:]]
+
+
+def test_name_to_netcdf_no_fast_reader(tmpdir, script_dir, data_dir):
+    tmpdir = Path(tmpdir)
+    script_path = script_dir / 'name_to_netcdf.py'
+
+    # Act
+    for name, options in (('fast.nc', []), ('iris.nc', ['--no-fast-reader'])):
+        subprocess.check_call(
+            ['python', script_path, data_dir, '--output_dir', tmpdir,
+             '--output_name', name, *options])
+
+    # Assert
+    with Dataset(tmpdir / 'fast.nc') as fast, Dataset(tmpdir / 'iris.nc') as iris_nc:
+        assert list(fast.variables) == list(iris_nc.variables)
+        for name, variable in fast.variables.items():
+            expected = iris_nc[name][:]
+            np.testing.assert_array_equal(np.ma.getmaskarray(variable[:]),
+                                          np.ma.getmaskarray(expected))
+            np.testing.assert_array_equal(np.ma.filled(variable[:], 0),
+                                          np.ma.filled(expected, 0))
+
+
+def test_name_to_netcdf_duplicate_fields(tmpdir, script_dir, data_dir):
+    tmpdir = Path(tmpdir)
+    script_path = script_dir / 'name_to_netcdf.py'
+    # Two copies of the same fields file, as when runs overlap
+    source_file = data_dir / 'Air_Conc_grid_201004180300_trimmed.txt'
+    for name in (source_file.name, 'Air_Conc_grid_201004180300_copy.txt'):
+        tmpdir.joinpath(name).symlink_to(source_file.absolute())
+
+    # Act
+    exit_code = subprocess.check_call(
+        ['python', script_path, tmpdir, '--output_name', 'duplicates.nc'])
+
+    # Assert
+    assert exit_code == 0
+
+    # Duplicate fields are kept as separate variables, as by iris.load
+    with Dataset(tmpdir / 'duplicates.nc') as nc:
+        variables = [name for name in nc.variables
+                     if name.startswith('volcanic_ash_air_concentration')]
+        assert len(variables) == 4
+
+
+def test_ensemble_exceedance(tmpdir, script_dir, data_dir):
+    tmpdir = Path(tmpdir)
+    script_path = script_dir / 'ensemble.py'
+    # Two members from the same REFIR files
+    members = []
+    for member in ('member_1', 'member_2'):
+        member_dir = tmpdir / member
+        member_dir.mkdir()
+        for source_file in data_dir.joinpath('refir').glob('REFIR*.txt'):
+            member_dir.joinpath(source_file.name).symlink_to(source_file.absolute())
+        members.append(member_dir)
+
+    # Act
+    exit_code = subprocess.check_call(
+        ['python', script_path, *members, '--output_dir', tmpdir,
+         '--thresholds', '0.0002', '0.002', '--workers', '1'])
+
+    # Assert
+    assert exit_code == 0
+
+    with Dataset(tmpdir / 'exceedance_probability.nc') as nc:
+        probabilities = [variable for variable in nc.variables.values()
+                         if variable.name.startswith('probability_of')]
+        assert len(probabilities) == 2
+        assert [nc[variable.coordinates.split()[-1]][:] for variable in probabilities] \
+            == [0.0002, 0.002]
+        for variable in probabilities:
+            assert variable.units == '1'
+            assert set(np.unique(variable[:])) == {0, 1}
@@ -1,9 +1,19 @@
 """Tests for REFIR analysis scripts."""
 import datetime as dt
+from pathlib import Path
+
+import iris.cube
+import numpy as np
+import pandas as pd
 import pytest
 
+from ash_model_plotting import plotting
+from ash_model_plotting.ash_model_results import name
 from ash_model_plotting.analyse_refir_outputs import (
     advisory_area,
+    advisory_areas,
+    exceedance_areas,
+    main,
     max_concentration_data
 )
 
@@ -19,12 +29,125 @@ def test_advisory_area(refir_result):
     assert data == pytest.approx(expected)
 
 
+def test_advisory_areas_several_thresholds(refir_result):
+    thresholds = [0.0002, 0.002, 1e9]
+
+    data = advisory_areas(refir_result, thresholds)
+
+    assert data[:2] == [advisory_area(refir_result, threshold)
+                        for threshold in thresholds[:2]]
+    assert data[2] == {'flight_level': None, 'time': None, 'advisory_area': 0}
+
+
+def test_exceedance_areas_lazy(refir_result):
+    cube = refir_result.air_concentration
+    lazy_cube = cube.copy(data=cube.lazy_data())
+
+    areas = exceedance_areas(lazy_cube, [0.002])
+
+    assert areas.shape == (1, *cube.shape[:2])
+    np.testing.assert_allclose(areas, exceedance_areas(cube, [0.002]))
+
+
 def test_max_concentration_data(refir_result):
     data = max_concentration_data(refir_result)
     expected = {'flight_level': 100.0,
                 'time': dt.datetime(2010, 5, 6, 0, 0),
+                'latitude': 63.642052,
+                'longitude': 340.61369975,
                 'max_concentration': 0.12511915}
     # Test non-numeric keys
     assert data.pop('time') == expected.pop('time')
     # Test remaining keys
     assert data == pytest.approx(expected)
+
+
+def test_max_concentration_data_lazy(refir_result):
+    cube = refir_result.air_concentration
+    refir_result.cubes = iris.cube.CubeList([cube.copy(data=cube.lazy_data())])
+
+    data = max_concentration_data(refir_result)
+
+    assert refir_result.air_concentration.has_lazy_data()
+    assert data == max_concentration_data(refir_result)
+    assert data['max_concentration'] == cube.data.max()
+
+
+@pytest.fixture(scope='module')
+def refir_data_dir(tmp_path_factory):
+    """Experiment/model/run tree of REFIR test files, with more files in Max
+    runs and fewer in Min runs."""
+    source_files = sorted(Path.cwd().joinpath('test', 'data', 'refir').glob('REFIR*.txt'))
+    data_dir = tmp_path_factory.mktemp('refir_runs')
+    for model, run, n_files in [('AllModels', 'Av', 6), ('AllModels', 'Max', 8),
+                                ('AllModels', 'Min', 4), ('WindOnly', 'Av', 5),
+                                ('WindOnly', 'Max', 7), ('WindOnly', 'Min', 3)]:
+        run_dir = data_dir / '30MinAv' / model / run
+        run_dir.mkdir(parents=True)
+        for source_file in source_files[:n_files]:
+            run_dir.joinpath(source_file.name.replace('REFIR_', '')).symlink_to(source_file)
+
+    return data_dir
+
+
+def test_main_parallel_matches_serial(refir_data_dir, tmp_path):
+    models = ['WindOnly', 'AllModels']
+    main(refir_data_dir, tmp_path / 'serial', models=models, workers=1)
+    main(refir_data_dir, tmp_path / 'parallel', models=models, workers=2)
+
+    serial_csv = (tmp_path / 'serial' / 'REFIR_summary.csv').read_text()
+    assert (tmp_path / 'parallel' / 'REFIR_summary.csv').read_text() == serial_csv
+
+    df = pd.read_csv(tmp_path / 'serial' / 'REFIR_summary.csv')
+    assert list(zip(df['model'], df['run'])) == [
+        (model, run) for model in models for run in ['Av', 'Max', 'Min']]
+    assert df['advisory_area'].nunique() > 1
+    assert (tmp_path / 'serial' / 'REFIR_max_concentration.png').exists()
+
+
+def test_main_keeps_running_pool(refir_data_dir, tmp_path):
+    models = ['WindOnly', 'AllModels']
+    main(refir_data_dir, tmp_path / 'serial', models=models, workers=1)
+
+    with plotting.worker_pool(1) as pool:
+        main(refir_data_dir, tmp_path / 'pooled', models=models, workers=2)
+
+        # Caller's pool is neither closed nor resized
+        assert plotting.running_pool() is pool
+        assert plotting._pool_processes == 1
+        assert pool.apply(abs, (-1,)) == 1
+
+    serial_csv = (tmp_path / 'serial' / 'REFIR_summary.csv').read_text()
+    assert (tmp_path / 'pooled' / 'REFIR_summary.csv').read_text() == serial_csv
+
+
+def test_main_without_bar_chart_runs(refir_data_dir, tmp_path):
+    main(refir_data_dir, tmp_path, models=['AllModels'], runs=['Min'], workers=1)
+
+    df = pd.read_csv(tmp_path / 'REFIR_summary.csv')
+    assert df[['experiment', 'model', 'run']].values.tolist() == [
+        ['30MinAv', 'AllModels', 'Min']]
+    assert not list(tmp_path.glob('*.png'))
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_main_cache_dir(refir_data_dir, tmp_path, monkeypatch, workers):
+    kwargs = {'models': ['AllModels', 'WindOnly'], 'runs': ['Min']}
+    main(refir_data_dir, tmp_path / 'no_cache', workers=1, **kwargs)
+    main(refir_data_dir, tmp_path / 'cold', workers=workers,
+         cache_dir=tmp_path / 'cache', **kwargs)
+
+    # One entry per file of each run
+    assert len(list((tmp_path / 'cache').iterdir())) == 4 + 3
+
+    # Cached files are not parsed again
+    def fail(*args, **kwargs):
+        raise AssertionError('NAME file parsed')
+
+    monkeypatch.setattr(name.iris, 'load_raw', fail)
+    main(refir_data_dir, tmp_path / 'warm', workers=1,
+         cache_dir=tmp_path / 'cache', **kwargs)
+
+    summary = (tmp_path / 'no_cache' / 'REFIR_summary.csv').read_text()
+    assert (tmp_path / 'cold' / 'REFIR_summary.csv').read_text() == summary
+    assert (tmp_path / 'warm' / 'REFIR_summary.csv').read_text() == summary
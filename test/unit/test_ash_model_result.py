@@ -1,6 +1,12 @@
 """Tests for AshModelResult abstract base class"""
+import gc
+import weakref
+
+import iris.cube
+import numpy as np
 import pytest
-from ash_model_plotting import AshModelResult
+
+from ash_model_plotting import AshModelResult, NameAshModelResult
 
 # pylint: disable=unused-argument, missing-docstring
 
@@ -28,3 +34,107 @@ def test_base_class_requires_abstractmethod_definitions():
             pass
 
     assert isinstance(TestAshModelResult([]), AshModelResult)
+
+
+def test_quantities_grouped_in_single_pass(name_model_result, monkeypatch):
+    # Arrange
+    calls = []
+    group_cubes = name_model_result._group_cubes
+
+    def counting_group_cubes(cubes):
+        calls.append(cubes)
+        return group_cubes(cubes)
+
+    monkeypatch.setattr(name_model_result, '_group_cubes', counting_group_cubes)
+
+    # Act
+    quantities = [name_model_result.air_concentration,
+                  name_model_result.total_column,
+                  name_model_result.total_deposition]
+
+    # Assert
+    assert len(calls) == 1
+    assert all(isinstance(cube, iris.cube.Cube) for cube in quantities)
+    assert name_model_result.air_concentration is quantities[0]
+
+
+def test_evict_quantities(name_model_result):
+    air_concentration = name_model_result.air_concentration
+    total_column = name_model_result.total_column
+
+    name_model_result.evict('air_concentration')
+
+    assert name_model_result.air_concentration is not air_concentration
+    assert name_model_result.air_concentration == air_concentration
+    assert name_model_result.total_column is total_column
+
+
+def test_setting_cubes_evicts_quantities(name_model_result):
+    assert name_model_result.air_concentration is not None
+
+    name_model_result.cubes = iris.cube.CubeList()
+
+    assert name_model_result.air_concentration is None
+
+
+def test_quantity_cache_budget(data_dir):
+    result = NameAshModelResult(data_dir / 'VA_Tutorial_NAME_output.nc',
+                                cache_bytes=1)
+    air_concentration = result.air_concentration
+    air_concentration.data
+
+    total_column = result.total_column
+
+    assert result.total_column is total_column
+    assert result.air_concentration is not air_concentration
+
+
+def test_quantity_cache_budget_frees_memory(data_dir):
+    # Arrange
+    result = NameAshModelResult(data_dir / 'VA_Tutorial_NAME_output.nc',
+                                cache_bytes=1)
+    air_concentration_data = weakref.ref(result.air_concentration.data)
+
+    # Act
+    result.total_column.data
+
+    # Assert
+    gc.collect()
+    assert air_concentration_data() is None
+
+
+def test_quantity_cache_budget_ignores_shared_data(data_dir):
+    # Quantities from realised NAME files are views of the loaded cubes, so
+    # evicting them would free nothing
+    name_files = sorted(data_dir.glob('*_trimmed.txt'))
+    result = NameAshModelResult(name_files, cache_bytes=1)
+    air_concentration = result.air_concentration
+
+    total_column = result.total_column
+
+    assert result.air_concentration is air_concentration
+    assert result.total_column is total_column
+    assert result._quantity_cache.nbytes == 0
+
+
+def test_realised_source_data_before_cubes_are_loaded(data_dir, monkeypatch):
+    # A subclass may use the quantity cache while its cubes are loaded
+    def load_then_get_quantity(self):
+        # Checking the budget looks for source data that the cube shares
+        self._quantity_cache.put('air_concentration', iris.cube.Cube(np.zeros(3)))
+        self._quantity_cache.put('total_column', iris.cube.Cube(np.zeros(3)))
+        self.cubes = iris.cube.CubeList()
+
+    monkeypatch.setattr(NameAshModelResult, '_load_cubes', load_then_get_quantity)
+
+    result = NameAshModelResult(data_dir / 'VA_Tutorial_NAME_output.nc', cache_bytes=1)
+
+    assert result.cubes == iris.cube.CubeList()
+
+
+def test_release_in_with_block(data_dir):
+    with NameAshModelResult(data_dir / 'VA_Tutorial_NAME_output.nc') as result:
+        assert result.air_concentration is not None
+
+    assert result.cubes == iris.cube.CubeList()
+    assert result.air_concentration is None
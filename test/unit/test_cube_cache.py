@@ -0,0 +1,114 @@
+"""Tests for CubeCache class."""
+import dask.array as da
+import iris.cube
+import numpy as np
+import pytest
+
+from ash_model_plotting.ash_model_results.cube_cache import CubeCache, cube_nbytes
+
+# pylint: disable=unused-argument, missing-docstring
+
+
+def make_cube(n_values, lazy=False):
+    data = np.zeros(n_values, dtype=np.float64)
+    return iris.cube.Cube(da.from_array(data) if lazy else data)
+
+
+def test_cube_cache_evicts_least_recently_used():
+    # Arrange
+    cache = CubeCache(max_bytes=2 * 8 * 100)
+    cache.put('a', make_cube(100))
+    cache.put('b', make_cube(100))
+
+    # Act
+    cache.get('a')
+    cache.put('c', make_cube(100))
+
+    # Assert
+    assert 'a' in cache
+    assert 'b' not in cache
+    assert 'c' in cache
+    assert cache.nbytes == 2 * 8 * 100
+
+
+def test_cube_cache_lazy_cubes_not_counted():
+    cache = CubeCache(max_bytes=0)
+    cache.put('a', make_cube(100, lazy=True))
+    cache.put('b', make_cube(100, lazy=True))
+    cache.put('c', None)
+
+    assert len(cache) == 3
+    assert cache.nbytes == 0
+
+
+def test_cube_cache_checks_budget_after_realising():
+    # Arrange
+    cache = CubeCache(max_bytes=8 * 100)
+    cache.put('a', make_cube(100, lazy=True))
+    cache.put('b', make_cube(100, lazy=True))
+
+    # Act
+    cache.get('a').data
+    cache.get('b').data
+    cache.get('b')
+
+    # Assert
+    assert 'a' not in cache
+    assert 'b' in cache
+
+
+def test_cube_cache_shared_data_not_counted():
+    # Arrange
+    source = np.zeros(100)
+    cache = CubeCache(max_bytes=8 * 100, shared_arrays=lambda: [source])
+
+    # Act
+    cache.put('a', iris.cube.Cube(source[:50]))
+    cache.put('b', make_cube(100))
+
+    # Assert
+    assert 'a' in cache
+    assert 'b' in cache
+    assert cache.nbytes == 8 * 100
+
+
+def test_cube_cache_checks_shared_arrays_once_per_realised_cube():
+    # Arrange
+    calls = []
+
+    def shared_arrays():
+        calls.append(1)
+        return [np.zeros(100)]
+
+    cache = CubeCache(max_bytes=8 * 1000, shared_arrays=shared_arrays)
+    cache.put('a', make_cube(100, lazy=True))
+    cache.put('b', make_cube(100))
+
+    # Act
+    for _ in range(5):
+        cache.get('a')
+        cache.get('b')
+    n_before_realising = len(calls)
+    cache.get('a').data
+    cache.get('a')
+
+    # Assert
+    assert n_before_realising == 1
+    assert len(calls) == 2
+    assert cache.nbytes == 2 * 8 * 100
+
+
+def test_cube_cache_keeps_most_recent_over_budget():
+    cache = CubeCache(max_bytes=10)
+    cache.put('a', make_cube(100))
+
+    assert 'a' in cache
+
+
+@pytest.mark.parametrize('masked, expected', [(False, 800), (True, 900)])
+def test_cube_nbytes(masked, expected):
+    data = np.zeros(100)
+    if masked:
+        data = np.ma.masked_less(data, 1)
+
+    assert cube_nbytes(iris.cube.Cube(data)) == expected
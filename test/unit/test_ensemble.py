@@ -0,0 +1,316 @@
+"""Tests for ensemble statistics."""
+import sys
+
+import numpy as np
+import pytest
+from iris.cube import CubeList
+
+from ash_model_plotting import AshModelResultError, NameAshModelResult, ensemble
+from ash_model_plotting.ensemble import (
+    BIN_EDGES,
+    ExceedanceCounts,
+    HistogramSketch,
+    ensemble_statistics,
+    exceedance_probabilities,
+    main,
+)
+from ash_model_plotting.plotting import VAAC_THRESHOLDS, plot_4d_cube
+
+N_MEMBERS = 12
+
+
+@pytest.fixture(scope='module')
+def refir_cube(data_dir):
+    """Air concentration cube from a part of the REFIR grid with ash."""
+    refir_files = sorted(str(f) for f in data_dir.joinpath('refir').glob('REFIR*.txt'))
+    result = NameAshModelResult(refir_files)
+    return result.air_concentration[:, :, 620:650, 1530:1560]
+
+
+@pytest.fixture(scope='module')
+def member_data(refir_cube):
+    """Data for ensemble members, with random factors applied to each cell."""
+    rng = np.random.default_rng(0)
+    factors = rng.lognormal(sigma=1.5, size=(N_MEMBERS, *refir_cube.shape))
+    return (refir_cube.data * factors).astype(np.float32)
+
+
+def make_members(cube, member_data, lazy=False):
+    """Yield a NameAshModelResult with cube data from each member."""
+    for data in member_data:
+        member = cube.copy(data=data)
+        if lazy:
+            member = member.copy(data=member.lazy_data())
+        result = NameAshModelResult([])
+        result.cubes = CubeList([member])
+        yield result
+
+
+def test_ensemble_statistics(refir_cube, member_data):
+    statistics = ensemble_statistics(make_members(refir_cube, member_data))
+
+    # Only air concentration is in the REFIR files
+    assert list(statistics) == ['air_concentration']
+    mean, minimum, maximum, std, *percentiles = statistics['air_concentration']
+
+    np.testing.assert_allclose(mean.data, member_data.mean(axis=0), rtol=1e-5)
+    np.testing.assert_allclose(std.data, member_data.std(axis=0),
+                               rtol=1e-4, atol=1e-12)
+    np.testing.assert_array_equal(minimum.data, member_data.min(axis=0))
+    np.testing.assert_array_equal(maximum.data, member_data.max(axis=0))
+
+    # Estimates are within a bin of an exact percentile of each cell, where
+    # values are within the bins
+    bin_ratio = BIN_EDGES[1] / BIN_EDGES[0]
+    for percentile, cube in zip([5, 50, 95], percentiles):
+        lower = np.percentile(member_data, max(percentile - 100 / N_MEMBERS, 0), axis=0)
+        upper = np.percentile(member_data, min(percentile + 100 / N_MEMBERS, 100), axis=0)
+        binned = lower >= BIN_EDGES[0]
+        assert binned.any()
+        assert np.all(cube.data[binned] >= lower[binned] / bin_ratio)
+        assert np.all(cube.data[binned] <= upper[binned] * bin_ratio)
+        assert np.all(cube.data[refir_cube.data == 0] == 0)
+
+
+def test_ensemble_statistics_metadata(refir_cube, member_data):
+    cubes = ensemble_statistics(make_members(refir_cube, member_data),
+                                percentiles=[90], title='REFIR ensemble')['air_concentration']
+
+    assert [cube.attributes['quantity'] for cube in cubes] == [
+        'Air Concentration Ensemble Mean',
+        'Air Concentration Ensemble Minimum',
+        'Air Concentration Ensemble Maximum',
+        'Air Concentration Ensemble Standard Deviation',
+        'Air Concentration Ensemble 90 Percentile']
+    for cube in cubes:
+        assert cube.attributes['model_run_title'] == 'REFIR ensemble'
+        assert cube.attributes['ensemble_size'] == N_MEMBERS
+        assert cube.cell_methods[-1].coord_names == ('realization',)
+        assert cube.coords() == refir_cube.coords()
+        assert cube.dtype == refir_cube.dtype
+
+
+def test_ensemble_statistics_lazy_members(refir_cube, member_data):
+    members = list(make_members(refir_cube, member_data[:3], lazy=True))
+
+    statistics = ensemble_statistics(members, percentiles=[])
+
+    # Member data are read without being stored on the members
+    assert all(member.air_concentration.has_lazy_data() for member in members)
+    np.testing.assert_allclose(statistics['air_concentration'][0].data,
+                               member_data[:3].mean(axis=0), rtol=1e-5)
+
+
+def test_ensemble_statistics_different_grids(refir_cube, member_data):
+    members = [next(make_members(refir_cube, member_data)),
+               next(make_members(refir_cube[:, :, 1:], member_data[:, :, :, 1:]))]
+
+    with pytest.raises(ValueError, match='different grid'):
+        ensemble_statistics(members)
+
+
+def test_ensemble_statistics_missing_grid_coordinate(refir_cube, member_data):
+    # Same shape and leading coordinates, but without a longitude coordinate
+    without_longitude = refir_cube.copy()
+    without_longitude.remove_coord('longitude')
+    members = [next(make_members(refir_cube, member_data)),
+               next(make_members(without_longitude, member_data))]
+
+    with pytest.raises(ValueError, match='different grid'):
+        ensemble_statistics(members, percentiles=[])
+
+
+def test_ensemble_statistics_no_members():
+    with pytest.raises(ValueError, match='No ensemble members'):
+        ensemble_statistics([])
+
+
+def test_histogram_sketch_widens_counts():
+    sketch = HistogramSketch((2, 3), bin_edges=[1, 10])
+
+    for value in range(300):
+        sketch.add(np.full((2, 3), value, dtype=np.float32))
+
+    assert sketch.counts.dtype == np.uint16
+    np.testing.assert_array_equal(sketch.counts[:, 0, 0], [1, 9, 290])
+    assert sketch.percentile(50, np.zeros((2, 3)), np.full((2, 3), 299.)) == \
+        pytest.approx(np.full((2, 3), 10 + 140 / 290 * 289))
+
+
+def test_histogram_sketch_keeps_values_of_small_ensembles():
+    values = np.random.default_rng(0).lognormal(-10, 3, size=(10, 2, 3)).astype(np.float32)
+    sketch = HistogramSketch((2, 3))
+
+    for n_values, data in enumerate(values, start=1):
+        sketch.add(data)
+
+        # Never larger than the values added
+        assert sketch.nbytes <= n_values * data.nbytes
+        if n_values <= 8:
+            assert sketch.counts is None
+            np.testing.assert_array_equal(
+                sketch.percentile(50, values.min(axis=0), values.max(axis=0)),
+                np.percentile(values[:n_values], 50, axis=0))
+
+    # Values are counted once the counts are smaller
+    assert sketch.nbytes == (len(BIN_EDGES) + 1) * 6
+    np.testing.assert_array_equal(sketch.counts.sum(axis=0), np.full((2, 3), 10))
+
+
+@pytest.mark.parametrize('percentile', [0, 5, 50, 95, 100])
+def test_histogram_sketch_percentile_within_a_bin_of_nearest_rank(percentile):
+    values = np.random.default_rng(1).lognormal(-10, 3, size=(50, 20, 20))
+    values = np.clip(values, BIN_EDGES[0], BIN_EDGES[-1])
+    sketch = HistogramSketch(values.shape[1:])
+    for data in values:
+        sketch.add(data)
+
+    estimate = sketch.percentile(percentile, values.min(axis=0), values.max(axis=0))
+
+    nearest_rank = np.percentile(values, percentile, axis=0, method='inverted_cdf')
+    bin_ratio = BIN_EDGES[1] / BIN_EDGES[0]
+    assert sketch.counts is not None
+    assert np.all(estimate >= nearest_rank / bin_ratio)
+    assert np.all(estimate <= nearest_rank * bin_ratio)
+
+
+def test_ensemble_statistics_plot(refir_cube, member_data, tmp_path):
+    mean = ensemble_statistics(make_members(refir_cube, member_data[:2]),
+                               percentiles=[])['air_concentration'][0]
+
+    metadata = plot_4d_cube(mean[:1], tmp_path, serial=True)
+
+    filename = next(iter(metadata['plots']['FL000-200'].values()))
+    assert 'Air_Concentration_Ensemble_Mean' in filename
+    assert (tmp_path / 'FL000-200' / filename).exists()
+
+
+def test_exceedance_probabilities(refir_cube, member_data):
+    cubes = exceedance_probabilities(make_members(refir_cube, member_data))
+
+    assert len(cubes) == len(VAAC_THRESHOLDS)
+    for threshold, cube in zip(VAAC_THRESHOLDS, cubes):
+        expected = (member_data > threshold).mean(axis=0)
+        np.testing.assert_allclose(cube.data, expected, rtol=1e-6)
+        assert cube.coord('threshold').points == [threshold]
+        assert cube.units == '1'
+        assert cube.coords(dim_coords=True) == refir_cube.coords(dim_coords=True)
+    # Some cells exceed each threshold, more for lower thresholds
+    assert [cube.data.max() > 0 for cube in cubes] == [True] * len(cubes)
+    assert np.all(cubes[0].data >= cubes[1].data)
+
+    assert [cube.attributes['quantity'] for cube in cubes] == [
+        'Air Concentration Probability Above 0.2 mg m-3',
+        'Air Concentration Probability Above 2 mg m-3',
+        'Air Concentration Probability Above 4 mg m-3']
+    assert 'CF Standard Name' not in cubes[0].attributes
+
+
+def test_exceedance_probabilities_converts_units(refir_cube, member_data):
+    mg_cube = refir_cube.copy()
+    mg_cube.units = 'mg/m3'
+    mg_data = member_data * 1000
+
+    cubes = exceedance_probabilities(make_members(mg_cube, mg_data), thresholds=[0.002])
+
+    np.testing.assert_allclose(cubes[0].data, (member_data > 0.002).mean(axis=0))
+
+
+def test_exceedance_probabilities_missing_air_concentration():
+    with pytest.raises(ValueError, match='air_concentration'):
+        exceedance_probabilities([NameAshModelResult([])])
+
+
+def test_exceedance_counts_widens_counts(refir_cube):
+    counts = ExceedanceCounts(thresholds=[0.0])
+    cube = refir_cube[:1, :1]
+
+    for _ in range(260):
+        counts.add(cube)
+
+    assert counts.counts.dtype == np.uint16
+    np.testing.assert_array_equal(counts.counts[0], np.where(cube.data > 0, 260, 0))
+
+
+def test_exceedance_probabilities_plot(refir_cube, member_data, tmp_path):
+    cube = exceedance_probabilities(make_members(refir_cube, member_data[:2]),
+                                    thresholds=[0.002])[0]
+
+    metadata = plot_4d_cube(cube[:1], tmp_path, serial=True)
+
+    filename = next(iter(metadata['plots']['FL000-200'].values()))
+    assert 'Air_Concentration_Probability_Above_2_mg_m-3' in filename
+    assert (tmp_path / 'FL000-200' / filename).exists()
+
+
+def test_main_plots_probabilities_on_fixed_scale(data_dir, tmp_path, monkeypatch):
+    # Arrange
+    members = []
+    for member in ['member_1', 'member_2']:
+        member_dir = tmp_path / member
+        member_dir.mkdir()
+        for source_file in data_dir.glob('Air_Conc_grid_*_trimmed.txt'):
+            member_dir.joinpath(source_file.name).symlink_to(source_file)
+        members.append(str(member_dir))
+    plotted = []
+
+    def recording_plot_4d_cube(cube, output_dir, **kwargs):
+        plotted.append((cube.data.max(), kwargs))
+        return plot_4d_cube(cube, output_dir, **kwargs)
+
+    monkeypatch.setattr(ensemble, 'plot_4d_cube', recording_plot_4d_cube)
+    monkeypatch.setattr(sys, 'argv', [
+        'ensemble.py', *members, '--output_dir', str(tmp_path / 'output'),
+        '--thresholds', '1e-9', '1', '--plot', '--workers', '1'])
+
+    # Act
+    main()
+
+    # Assert
+    assert (tmp_path / 'output' / 'exceedance_probability.nc').exists()
+    # Maps are not scaled to their own maximum probability
+    assert [maximum for maximum, _ in plotted] == [1, 0]
+    for _, kwargs in plotted:
+        assert kwargs['vmin'] == 0
+        assert kwargs['vmax'] == 1
+    assert sorted(f.name for f in (tmp_path / 'output').glob('*summary.html')) == [
+        'VA_Tutorial_Air_Concentration_Probability_Above_1000_mg_m-3_summary.html',
+        'VA_Tutorial_Air_Concentration_Probability_Above_1e-06_mg_m-3_summary.html']
+
+
+def test_main_plots_3d_probabilities(refir_cube, member_data, tmp_path, monkeypatch):
+    # Arrange
+    members = make_members(refir_cube[:, 0], member_data[:2, :, 0])
+    monkeypatch.setattr(ensemble, 'MODEL_TYPES', {'name': lambda *args, **kwargs: next(members)})
+    member_dirs = []
+    for member in ['member_1', 'member_2']:
+        member_dir = tmp_path / member
+        member_dir.mkdir()
+        member_dir.joinpath('Fields_grid.txt').touch()
+        member_dirs.append(str(member_dir))
+    monkeypatch.setattr(sys, 'argv', [
+        'ensemble.py', *member_dirs, '--output_dir', str(tmp_path),
+        '--thresholds', '0.002', '--plot', '--workers', '1'])
+
+    # Act
+    main()
+
+    # Assert
+    summary = tmp_path / 'EmpOnly_Av_Air_Concentration_Probability_Above_2_mg_m-3_summary.html'
+    assert 'exceedance_probability.nc' in summary.read_text()
+    # 3D cubes are plotted in output_dir rather than a directory per level
+    assert len(list(tmp_path.glob('*.png'))) == refir_cube.shape[0]
+
+
+@pytest.mark.parametrize('member', ['empty', 'missing'])
+def test_main_member_without_name_files(data_dir, tmp_path, monkeypatch, member):
+    # Arrange
+    tmp_path.joinpath('empty').mkdir()
+    member_dir = tmp_path / member
+    monkeypatch.setattr(sys, 'argv', [
+        'ensemble.py', str(data_dir), str(member_dir), '--output_dir', str(tmp_path / 'output'),
+        '--workers', '1'])
+
+    # Act / Assert
+    with pytest.raises(AshModelResultError, match=f'directory {member_dir}$'):
+        main()
@@ -2,6 +2,7 @@
 from pathlib import Path
 
 import pytest
+import iris
 import iris.cube
 
 from ash_model_plotting.ash_model_results import (
@@ -20,11 +21,40 @@ def test_fall3d_ash_model_result_init_happy_path_netcdf(data_dir):
     assert isinstance(result.cubes, iris.cube.CubeList)
 
 
+def test_fall3d_ash_model_result_loads_only_quantities(data_dir):
+    source_file = data_dir / 'fall3d_operational.nc'
+    result = Fall3DAshModelResult(source_file)
+
+    assert {cube.name() for cube in result.cubes} == {
+        'tephra_concentration on z-cut planes',
+        'tephra_column mass load',
+        'tephra_ground mass load'}
+    assert all(cube.has_lazy_data() for cube in result.cubes)
+
+
+def test_fall3d_ash_model_result_no_quantities(data_dir, tmpdir):
+    source_file = Path(tmpdir) / 'no_quantities.nc'
+    iris.save(iris.cube.Cube([1.0, 2.0], long_name='not_ash'), str(source_file))
+
+    result = Fall3DAshModelResult(source_file)
+
+    assert result.cubes == iris.cube.CubeList()
+    assert result.air_concentration is None
+
+
 def test_fall3d_ash_model_result_init_not_a_file():
     with pytest.raises(AshModelResultError):
         Fall3DAshModelResult('not a file')
 
 
+def test_fall3d_ash_model_result_init_not_netcdf(tmpdir):
+    source_file = Path(tmpdir) / 'not_netcdf.nc'
+    source_file.write_text('not NetCDF')
+
+    with pytest.raises(AshModelResultError, match='not a valid'):
+        Fall3DAshModelResult(source_file)
+
+
 def test_fall3d_ash_model_air_concentration(data_dir):
     source_file = data_dir / 'fall3d_operational.nc'
     result = Fall3DAshModelResult(source_file)
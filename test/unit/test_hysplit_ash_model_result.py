@@ -2,6 +2,8 @@
 from pathlib import Path
 
 from cf_units import Unit
+import dask
+import dask.array as da
 import numpy as np
 import pytest
 import iris.cube
@@ -10,6 +12,7 @@ from ash_model_plotting.ash_model_results import (
     HysplitAshModelResult,
     AshModelResultError,
 )
+from ash_model_plotting.ash_model_results.hysplit import cumulative_sum
 
 # pylint: disable=unused-argument, missing-docstring
 
@@ -150,3 +153,142 @@ def test_calculate_total_column(hysplit_model_result):
 
     # Assert
     np.testing.assert_array_equal(total_column.data, expected)
+
+
+def test_calculate_total_column_lazy(hysplit_model_result_180):
+    # Arrange
+    air_concentration = hysplit_model_result_180.air_concentration
+    thicknesses = np.diff(air_concentration.coord('Top height of each layer').points,
+                          prepend=0)
+    expected = (air_concentration.data * thicknesses[np.newaxis, :, np.newaxis, np.newaxis]
+                ).sum(axis=1, dtype=np.float64)
+    air_concentration = air_concentration.copy(data=air_concentration.lazy_data())
+
+    # Act
+    total_column = HysplitAshModelResult._calculate_total_column(air_concentration)
+
+    # Assert
+    assert total_column.has_lazy_data()
+    assert air_concentration.has_lazy_data()
+    np.testing.assert_allclose(total_column.data, expected)
+
+
+def test_hysplit_ash_model_result_memory_limit(data_dir):
+    source_file = data_dir / 'cdump_sum.nc'
+
+    result = HysplitAshModelResult(source_file, workers=1, memory_limit='4MB')
+
+    # 1 MB chunk limit is less than 2 of the 0.6 MB (latitude, longitude) slices
+    assert result.air_concentration.lazy_data().chunksize == (1, 1, 361, 441)
+    assert result.total_column.has_lazy_data()
+    assert result.total_column == HysplitAshModelResult(source_file).total_column
+
+
+def test_total_deposition_lazy(hysplit_model_result_180):
+    total_deposition = hysplit_model_result_180.total_deposition
+
+    assert total_deposition.has_lazy_data()
+    assert total_deposition.lazy_data().chunks[0] == (1,) * total_deposition.shape[0]
+
+
+def test_total_deposition_sums_ground_level(data_dir, hysplit_model_result_180):
+    cube, = iris.load(str(data_dir / 'cdump_sum.nc'), 'Concentration Array - SUM ')
+    ground_level = cube.extract(iris.Constraint(
+        coord_values={'Top height of each layer': lambda cell: cell == 0}))
+
+    total_deposition = hysplit_model_result_180.total_deposition.data
+
+    expected = np.cumsum(ground_level.data, axis=0)
+    np.testing.assert_allclose(total_deposition, expected, rtol=1e-6)
+    np.testing.assert_array_equal(np.ma.getmaskarray(total_deposition),
+                                  np.ma.getmaskarray(expected))
+
+
+def test_cumulative_sum_reads_only_earlier_timesteps():
+    # Arrange
+    @dask.delayed
+    def unreadable():
+        raise AssertionError("Later timestep was read")
+
+    steps = [da.ones((1, 2, 2), chunks=-1) for _ in range(3)]
+    steps.append(da.from_delayed(unreadable(), shape=(1, 2, 2), dtype=float))
+    data = da.concatenate(steps)
+
+    # Act
+    total = cumulative_sum(data)[2].compute()
+
+    # Assert
+    np.testing.assert_array_equal(total, np.full((2, 2), 3.0))
+
+
+def recording_steps(steps, reads):
+    """Lazy steps that record the index of each timestep when it is read."""
+    def record_read(block, block_info=None):
+        reads.append(block_info[0]['chunk-location'][0])
+        return block
+
+    return da.from_array(steps, chunks=(1, -1, -1)).map_blocks(record_read, dtype=steps.dtype)
+
+
+def test_cumulative_sum_reads_each_timestep_once():
+    # Arrange
+    steps = np.random.default_rng(0).uniform(size=(6, 3, 4)).astype(np.float32)
+    reads = []
+
+    # Act
+    total = cumulative_sum(recording_steps(steps, reads))
+    slices = [total[t].compute() for t in range(len(steps))]
+
+    # Assert
+    assert reads == list(range(6))
+    np.testing.assert_allclose(slices, np.cumsum(steps, axis=0), rtol=1e-6)
+
+
+def test_cumulative_sum_whole_array_masked():
+    steps = np.ma.masked_less(
+        np.random.default_rng(0).uniform(size=(20, 3, 4)), 0.2).astype(np.float32)
+
+    total = cumulative_sum(da.from_array(steps, chunks=(1, -1, -1))).compute()
+
+    expected = np.cumsum(steps, axis=0)
+    np.testing.assert_allclose(total, expected, rtol=1e-6)
+    np.testing.assert_array_equal(np.ma.getmaskarray(total), np.ma.getmaskarray(expected))
+
+
+def test_cumulative_sum_initial_extends_earlier_sum():
+    # Arrange
+    steps = np.random.default_rng(0).uniform(size=(6, 3, 4))
+    earlier = cumulative_sum(steps[:4])
+    reads = []
+
+    # Act
+    appended = cumulative_sum(recording_steps(steps[4:], reads), initial=earlier[-1].compute())
+
+    # Assert
+    np.testing.assert_allclose(da.concatenate([earlier, appended]).compute(),
+                               np.cumsum(steps, axis=0))
+    assert sorted(reads) == [0, 1]
+
+
+def test_plot_total_deposition_realises_slices_in_order(data_dir, tmpdir, monkeypatch):
+    # Arrange
+    result = HysplitAshModelResult(data_dir / 'cdump_sum.nc')
+    deposition = result.total_deposition
+    steps = np.random.default_rng(0).uniform(size=(6,) + deposition.shape[1:]).astype(np.float32)
+    reads = []
+    time = deposition.coord('time').copy(points=np.arange(6.) + deposition.coord('time').points[0],
+                                         bounds=None)
+    cube = iris.cube.Cube(cumulative_sum(recording_steps(steps, reads)),
+                          attributes=deposition.attributes, units=deposition.units,
+                          dim_coords_and_dims=[(time, 0),
+                                               (deposition.coord('latitude'), 1),
+                                               (deposition.coord('longitude'), 2)])
+    monkeypatch.setattr(HysplitAshModelResult, 'total_deposition', cube)
+
+    # Act
+    result.plot_total_deposition(tmpdir, html=False, workers=1)
+
+    # Assert
+    # Each timestep is read once, in the parent process
+    assert reads == list(range(6))
+    assert len(list(Path(tmpdir).glob('*.png'))) == 6
@@ -1,13 +1,22 @@
 """Tests for NameAshModelResult class."""
 from pathlib import Path
+import subprocess
+import sys
 
+from netCDF4 import Dataset
+import numpy as np
 import pytest
+import iris
 import iris.cube
 
 from ash_model_plotting.ash_model_results import (
     NameAshModelResult,
     AshModelResultError,
 )
+from ash_model_plotting.ash_model_results import ash_model_result
+from ash_model_plotting.ash_model_results.name import load_name_files
+from ash_model_plotting.ash_model_results.name_cache import cache_key
+from ash_model_plotting.plotting import close_pool, running_pool, worker_pool
 
 # pylint: disable=unused-argument, missing-docstring
 
@@ -28,6 +37,236 @@ def test_name_ash_model_result_init_happy_path_name_format(data_dir):
     assert isinstance(result.cubes, iris.cube.CubeList)
 
 
+def test_name_ash_model_result_netcdf_var_name_is_long_name(data_dir, tmp_path):
+    # Arrange
+    source_file = tmp_path / 'same_names.nc'
+    source_file.write_bytes((data_dir / 'VA_Tutorial_NAME_output.nc').read_bytes())
+    with Dataset(source_file, 'a') as nc:
+        nc.renameVariable('volcanic_ash_dosage', 'VOLCANIC_ASH_DOSAGE')
+
+    # Act
+    result = NameAshModelResult(source_file)
+
+    # Assert
+    original = NameAshModelResult(data_dir / 'VA_Tutorial_NAME_output.nc')
+    assert len(result.cubes) == len(original.cubes)
+    np.testing.assert_array_equal(result.total_column.data, original.total_column.data)
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_load_name_files_matches_iris_load(data_dir, workers):
+    source_files = [str(f) for f in data_dir.glob('*.txt')]
+
+    cubes = load_name_files(source_files, workers=workers)
+
+    assert cubes == iris.load(source_files)
+
+
+def test_load_name_files_stops_pool_it_started(data_dir):
+    source_files = [str(f) for f in data_dir.glob('*.txt')]
+    close_pool()
+
+    cubes = load_name_files(source_files, workers=2)
+
+    assert running_pool() is None
+    assert cubes == iris.load(source_files)
+
+
+def test_load_name_files_keeps_running_pool(data_dir):
+    source_files = [str(f) for f in data_dir.glob('*.txt')]
+
+    with worker_pool(2) as pool:
+        load_name_files(source_files, workers=2)
+        assert running_pool() is pool
+
+
+def test_load_name_files_single_file_starts_no_pool(data_dir, monkeypatch):
+    source_file = str(data_dir / 'Air_Conc_grid_201004180300_trimmed.txt')
+    close_pool()
+    monkeypatch.setattr('ash_model_plotting.ash_model_results.name.get_pool', None)
+
+    cubes = load_name_files([source_file], workers=2, fast_reader=True)
+
+    assert running_pool() is None
+    assert cubes == iris.load(source_file)
+
+
+@pytest.mark.parametrize('options', [
+    {'workers': 2},
+    {'workers': 1, 'fast_reader': True},
+    {'workers': 1, 'cache_dir': 'cache'},
+    {'lazy': True}])
+def test_load_name_files_unsorted_matches_iris_load(data_dir, tmp_path, options):
+    # iris.load sorts the files, so the merged cubes do not depend on order
+    source_files = sorted((str(f) for f in data_dir.glob('*.txt')), reverse=True)
+    if 'cache_dir' in options:
+        options['cache_dir'] = tmp_path / options['cache_dir']
+
+    cubes = load_name_files(source_files, **options)
+
+    assert cubes == iris.load(source_files)
+
+
+@pytest.mark.parametrize('options', [
+    {'workers': 2},
+    {'workers': 1, 'fast_reader': True},
+    {'workers': 1, 'cache_dir': 'cache'},
+    {'lazy': True}])
+def test_load_name_files_duplicate_fields(data_dir, tmp_path, options):
+    # The same fields in two files are kept as separate cubes, as by iris
+    source_file = data_dir / 'Air_Conc_grid_201004180300_trimmed.txt'
+    source_files = []
+    for name in ('a.txt', 'b.txt'):
+        source_files.append(str(tmp_path / name))
+        Path(source_files[-1]).write_bytes(source_file.read_bytes())
+    if 'cache_dir' in options:
+        options['cache_dir'] = tmp_path / options['cache_dir']
+
+    cubes = load_name_files(source_files, **options)
+
+    expected = iris.load(source_files)
+    assert len(expected) == 4
+    assert cubes == expected
+
+
+def test_load_name_files_cache(data_dir, tmpdir):
+    source_files = [str(f) for f in data_dir.glob('*.txt')]
+    cache_dir = Path(tmpdir) / 'cache'
+
+    # Act
+    first = load_name_files(source_files, workers=1, cache_dir=cache_dir)
+    entries = sorted(cache_dir.iterdir())
+    second = load_name_files(source_files, workers=1, cache_dir=cache_dir)
+
+    # Assert
+    assert len(entries) == len(source_files)
+    assert sorted(cache_dir.iterdir()) == entries
+    assert first == iris.load(source_files)
+    assert second == first
+
+
+def test_load_name_files_cache_changed_file(data_dir, tmpdir):
+    # Arrange
+    source_file = Path(tmpdir) / 'Air_Conc_grid_201004180300_trimmed.txt'
+    original = (data_dir / source_file.name).read_text()
+    source_file.write_text(original)
+    cache_dir = Path(tmpdir) / 'cache'
+    load_name_files([source_file], cache_dir=cache_dir)
+
+    # Act
+    source_file.write_text(original.replace('Air Concentration', 'Air concentration'))
+    cubes = load_name_files([source_file], cache_dir=cache_dir)
+
+    # Assert
+    assert len(list(cache_dir.iterdir())) == 2
+    assert cubes == iris.load(str(source_file))
+
+
+@pytest.mark.parametrize('damage', ['truncate_data', 'delete_data', 'truncate_pickle'])
+def test_load_name_files_cache_damaged_entry(data_dir, tmpdir, damage):
+    # Arrange
+    source_file = str(data_dir / 'Air_Conc_grid_201004180300_trimmed.txt')
+    cache_dir = Path(tmpdir) / 'cache'
+    load_name_files([source_file], cache_dir=cache_dir)
+    entry, = cache_dir.iterdir()
+    damaged = entry / ('cubes.pkl' if damage == 'truncate_pickle' else '0.npy')
+    if damage.startswith('truncate'):
+        damaged.write_bytes(damaged.read_bytes()[:100])
+    else:
+        damaged.unlink()
+
+    # Act
+    cubes = load_name_files([source_file], cache_dir=cache_dir)
+
+    # Assert
+    assert cubes == iris.load(source_file)
+    assert list(cache_dir.iterdir()) == [entry]
+    assert load_name_files([source_file], cache_dir=cache_dir) == cubes
+    assert damaged.stat().st_size > 100
+
+
+@pytest.mark.parametrize('stale_pickle', [
+    b'cno_such_module\nCube\n.',  # ModuleNotFoundError
+    b'ciris.cube\nNoSuchCube\n.',  # AttributeError
+    ])
+def test_load_name_files_cache_stale_entry(data_dir, tmpdir, stale_pickle):
+    # Entries pickled by other library versions are parsed again
+    source_file = str(data_dir / 'Air_Conc_grid_201004180300_trimmed.txt')
+    cache_dir = Path(tmpdir) / 'cache'
+    load_name_files([source_file], cache_dir=cache_dir)
+    entry, = cache_dir.iterdir()
+    (entry / 'cubes.pkl').write_bytes(stale_pickle)
+
+    # Act
+    cubes = load_name_files([source_file], cache_dir=cache_dir)
+
+    # Assert
+    assert cubes == iris.load(source_file)
+    assert load_name_files([source_file], cache_dir=cache_dir) == cubes
+
+
+def test_cache_key_library_versions(data_dir, monkeypatch):
+    source_file = data_dir / 'Air_Conc_grid_201004180300_trimmed.txt'
+    key = cache_key(source_file)
+
+    monkeypatch.setattr(iris, '__version__', '0.0.0')
+
+    assert cache_key(source_file) != key
+
+
+def test_name_ash_model_result_memory_limit(data_dir):
+    source_files = [str(f) for f in data_dir.glob('*.txt')]
+
+    result = NameAshModelResult(source_files, memory_limit='1GB')
+
+    assert result.memory_limit == 10 ** 9
+    assert all(cube.has_lazy_data() for cube in result.cubes)
+    assert result.cubes == NameAshModelResult(source_files, workers=1).cubes
+
+
+def test_name_ash_model_result_init_workers(data_dir):
+    source_files = [str(f) for f in data_dir.glob('*.txt')]
+    result = NameAshModelResult(source_files, workers=2)
+
+    assert result.workers == 2
+    assert result.air_concentration.shape == (2, 2, 61, 121)
+
+
+def test_name_ash_model_result_loads_in_process_by_default(data_dir):
+    source_files = [str(f) for f in data_dir.glob('*.txt')]
+    close_pool()
+
+    result = NameAshModelResult(source_files)
+
+    assert result.air_concentration.shape == (2, 2, 61, 121)
+    assert running_pool() is None
+
+
+def test_name_ash_model_result_uses_running_pool(data_dir):
+    source_files = [str(f) for f in data_dir.glob('*.txt')]
+
+    with worker_pool(2) as pool:
+        result = NameAshModelResult(source_files, fast_reader=True)
+        assert running_pool() is pool
+
+    assert result.cubes == NameAshModelResult(source_files, workers=1).cubes
+
+
+def test_name_ash_model_result_script_without_main_guard(data_dir, tmp_path):
+    # Spawned worker processes would re-run a script without a guard
+    script = tmp_path / 'load_name.py'
+    script.write_text(
+        "from glob import glob\n"
+        "from ash_model_plotting import NameAshModelResult\n"
+        f"result = NameAshModelResult(sorted(glob('{data_dir}/*.txt')))\n"
+        "print('loaded', result.air_concentration.shape)\n")
+
+    output = subprocess.run([sys.executable, str(script)], capture_output=True,
+                            text=True, timeout=300, check=True).stdout
+
+    assert output == 'loaded (2, 2, 61, 121)\n'
+
+
 def test_name_ash_model_result_single_file_input(data_dir):
     source_file = data_dir / 'Air_Conc_grid_201004180300_trimmed.txt'
     result = NameAshModelResult(source_file)
@@ -92,6 +331,41 @@ def test_plot_functions(name_model_result, tmpdir, plot_func, expected,
     assert set(plot_files) == set(expected)
 
 
+@pytest.mark.parametrize('plot_func, quantity', [
+    ('plot_air_concentration', 'air_concentration'),
+    ('plot_total_column', 'total_column'),
+    ('plot_total_deposition', 'total_deposition'),
+    ])
+def test_plot_functions_keep_data_lazy(name_model_result, tmpdir, plot_func,
+                                       quantity):
+    getattr(name_model_result, plot_func)(tmpdir, vmax_percentile=95)
+
+    assert getattr(name_model_result, quantity).has_lazy_data()
+
+
+@pytest.mark.parametrize('kwargs, expected', [
+    ({}, {'vmin': None, 'vmax': None}),
+    ({'vmax': 1e-3}, {'vmin': None, 'vmax': 1e-3}),
+    ({'shared_scale': True}, {'vmin': 0, 'vmax': 'max'}),
+    ({'shared_scale': True, 'vmax': 1e-3}, {'vmin': 0, 'vmax': 1e-3}),
+    ])
+def test_plot_colour_scale_limits(name_model_result, tmpdir, monkeypatch,
+                                  kwargs, expected):
+    calls = []
+    monkeypatch.setattr(ash_model_result, 'plot_3d_cube',
+                        lambda cube, output_dir, **kwargs: calls.append(kwargs) or {})
+    monkeypatch.setattr(name_model_result, '_write_html', lambda *args: None)
+    if expected['vmax'] == 'max':
+        expected['vmax'] = name_model_result.total_column.copy().data.max()
+
+    name_model_result.plot_total_column(tmpdir, **kwargs)
+
+    # Each slice is autoscaled unless limits or a shared scale are asked for
+    assert {key: calls[0][key] for key in ('vmin', 'vmax')} == \
+        pytest.approx(expected)
+    assert 'shared_scale' not in calls[0]
+
+
 def test_plot_air_concentration_single_file(data_dir, tmpdir, scantree):
     name_model_result = NameAshModelResult(
         data_dir / "Air_Conc_grid_201004180300_trimmed.txt")
@@ -0,0 +1,210 @@
+"""Tests for NumPy-based NAME Fields reader."""
+import threading
+from unittest.mock import patch
+
+import dask
+import iris
+from iris.fileformats import name_loaders
+import numpy as np
+import pytest
+
+from ash_model_plotting.ash_model_results import NameAshModelResult
+from ash_model_plotting.ash_model_results import name_fields
+from ash_model_plotting.ash_model_results.name_fields import has_iris_reader, load_name_file
+
+# pylint: disable=unused-argument, missing-docstring
+
+
+@pytest.mark.parametrize('filename', [
+    'Air_Conc_grid_201004180300_trimmed.txt',
+    'Deposition_load_201004180300_trimmed.txt',
+    'TotCol_201004180600_trimmed.txt',
+    'refir/REFIR_Fields_grid88_201005050000.txt',
+    'refir/REFIR_Fields_grid88_201005061800.txt',
+    ])
+def test_load_name_file_matches_iris(data_dir, filename):
+    source_file = data_dir / filename
+
+    cubes = load_name_file(source_file)
+
+    assert cubes == iris.load_raw(str(source_file))
+
+
+# Column heading rows of NAME II Fields files and the values written to them
+HEADER_VARIANTS = [
+    (20, ['003 hr time averaged', '006 hr time integrated', 'No time averaging']),
+    (21, ['Air Concentration', 'Dosage', 'Total deposition']),
+    (23, ['From FL000 - FL200', 'Boundary layer', 'Vertical integral']),
+    (23, ['   100.0m agl', 'From     0 -   100m agl', 'From  -250 -   250m asl']),
+]
+
+
+@pytest.mark.parametrize('row, values', HEADER_VARIANTS)
+@pytest.mark.parametrize('lazy', [False, True])
+def test_load_name_file_header_variants_match_iris(data_dir, tmpdir, row, values, lazy):
+    # Arrange
+    lines = (data_dir / 'Air_Conc_grid_201004180300_trimmed.txt').read_text().splitlines()
+    columns = lines[row].split(',')
+    lines[row] = ','.join(columns[:4] + [f'{value:>24}' for value in values] + columns[-1:])
+    variant_file = tmpdir / 'variant.txt'
+    variant_file.write_text('\n'.join(lines) + '\n', encoding='utf-8')
+
+    # Act
+    cubes = load_name_file(variant_file, lazy=lazy)
+
+    # Assert
+    expected = iris.load_raw(str(variant_file))
+    assert cubes == expected
+    assert [cube.cell_methods for cube in cubes] == [cube.cell_methods for cube in expected]
+
+
+def test_load_name_file_restores_iris_reader(data_dir):
+    source_file = data_dir / 'Air_Conc_grid_201004180300_trimmed.txt'
+    original = name_loaders._read_data_arrays
+
+    load_name_file(source_file)
+
+    assert name_loaders._read_data_arrays is original
+    assert has_iris_reader()
+
+
+def test_load_name_file_without_iris_reader(data_dir, monkeypatch):
+    # Later versions of iris may rename or change the private reader
+    source_file = data_dir / 'Air_Conc_grid_201004180300_trimmed.txt'
+    expected = iris.load_raw(str(source_file))
+    original = name_loaders._read_data_arrays
+
+    def changed_reader(file_handle, n_arrays, shape, dtype=np.float32):
+        return original(file_handle, n_arrays, shape)
+
+    monkeypatch.setattr(name_loaders, '_read_data_arrays', changed_reader)
+
+    with pytest.warns(UserWarning, match='data lines are parsed by iris'):
+        cubes = load_name_file(source_file)
+
+    assert not has_iris_reader()
+    assert cubes == expected
+
+
+def test_load_name_file_refir_data_rows(data_dir):
+    # Only the first REFIR file is empty; later ones have sparse data rows
+    source_file = data_dir / 'refir' / 'REFIR_Fields_grid88_201005061800.txt'
+    n_rows = len(source_file.read_text().splitlines()) - 26
+
+    cubes = load_name_file(source_file)
+
+    counts = [np.count_nonzero(cube.data) for cube in cubes]
+    assert n_rows > 4000
+    assert counts[0] > 4000
+    assert max(counts) <= n_rows
+
+
+def test_load_name_file_lazy(data_dir):
+    source_file = data_dir / 'Air_Conc_grid_201004180300_trimmed.txt'
+
+    cubes = load_name_file(source_file, lazy=True)
+
+    assert all(cube.has_lazy_data() for cube in cubes)
+    assert cubes == iris.load_raw(str(source_file))
+
+
+def test_load_name_file_lazy_parses_once(data_dir):
+    source_file = data_dir / 'Air_Conc_grid_201004180300_trimmed.txt'
+    cubes = load_name_file(source_file, lazy=True)
+
+    with patch.object(name_fields, '_read_data_arrays',
+                      wraps=name_fields._read_data_arrays) as read:
+        name_fields._parsed_files.clear()
+        for cube in cubes:
+            cube.data
+
+    assert len(cubes) > 1
+    assert read.call_count == 1
+    assert cubes == iris.load_raw(str(source_file))
+
+
+def test_load_name_file_lazy_drops_read_files(data_dir):
+    source_file = data_dir / 'Air_Conc_grid_201004180300_trimmed.txt'
+    cubes = load_name_file(source_file, lazy=True)
+    name_fields._parsed_files.clear()
+
+    cubes[0].data
+    kept = len(name_fields._parsed_files)
+    for cube in cubes[1:]:
+        cube.data
+
+    assert kept == 1
+    assert not name_fields._parsed_files
+
+
+def test_load_name_file_lazy_parses_files_concurrently(data_dir):
+    # Both parses must be running at once to pass the barrier
+    source_files = [data_dir / 'Air_Conc_grid_201004180300_trimmed.txt',
+                    data_dir / 'TotCol_201004180600_trimmed.txt']
+    cubes = [load_name_file(source_file, lazy=True)[0] for source_file in source_files]
+    barrier = threading.Barrier(2, timeout=10)
+    read_stacked = name_fields._read_stacked_data_arrays
+
+    def wait_then_read(*args, **kwargs):
+        barrier.wait()
+        return read_stacked(*args, **kwargs)
+
+    with patch.object(name_fields, '_read_stacked_data_arrays', wait_then_read):
+        name_fields._parsed_files.clear()
+        data = dask.compute(*(cube.core_data() for cube in cubes), scheduler='threads',
+                            num_workers=2)
+
+    assert [cube.copy(data=d) for cube, d in zip(cubes, data)] == [
+        iris.load_raw(str(source_file))[0] for source_file in source_files]
+
+
+@pytest.mark.parametrize('block_bytes', [1, 1000, 10**9])
+def test_load_name_file_block_bytes(data_dir, block_bytes):
+    source_file = data_dir / 'Air_Conc_grid_201004180300_trimmed.txt'
+
+    cubes = load_name_file(source_file, block_bytes=block_bytes)
+
+    assert cubes == iris.load_raw(str(source_file))
+
+
+def test_load_name_file_sparse_data(data_dir, tmpdir):
+    # Arrange
+    lines = (data_dir / 'Air_Conc_grid_201004180300_trimmed.txt').read_text().splitlines()
+    header, data = lines[:26], lines[26:]
+    # Keep only non-zero rows, as in REFIR Fields files, in a different order
+    sparse = [line for line in data if any(float(value) for value in line.split(',')[4:7])]
+    sparse_file = tmpdir / 'sparse.txt'
+    sparse_file.write_text('\n'.join(header + sparse[::-1]) + '\n', encoding='utf-8')
+
+    # Act
+    cubes = load_name_file(sparse_file)
+
+    # Assert
+    assert 0 < len(sparse) < len(data)
+    assert cubes == iris.load_raw(str(sparse_file))
+
+
+def test_name_ash_model_result_fast_reader(data_dir):
+    source_files = [str(f) for f in data_dir.glob('*.txt')]
+
+    result = NameAshModelResult(source_files, workers=1, fast_reader=True)
+
+    assert result.cubes == NameAshModelResult(source_files, workers=1).cubes
+
+
+def test_name_ash_model_result_memory_limit_blocks(data_dir):
+    source_files = [str(f) for f in data_dir.glob('*.txt')]
+
+    with patch.object(name_fields, '_read_data_arrays',
+                      wraps=name_fields._read_data_arrays) as read:
+        name_fields._parsed_files.clear()
+        result = NameAshModelResult(source_files, workers=1, memory_limit='4MB')
+        cubes = result.cubes.copy()
+        # Fields of a file in different cubes share a parse in one graph
+        data = dask.compute(*(cube.core_data() for cube in cubes))
+
+    assert read.call_count == len(source_files)
+    assert all(kwargs['block_bytes'] == result._chunk_bytes() == 10**6
+               for _, kwargs in read.call_args_list)
+    expected = NameAshModelResult(source_files, workers=1).cubes
+    assert [cube.copy(data=d) for cube, d in zip(cubes, data)] == expected
@@ -1,15 +1,21 @@
 """Unit tests for plotting module."""
 import os
 from pathlib import Path
+import pickle
+import threading
+import tracemalloc
 
+import dask.array as da
 import iris
 import matplotlib
 from matplotlib.figure import Figure  # noqa
 import numpy as np
 import pytest
 
+from ash_model_plotting import plotting
 from ash_model_plotting.plotting import (
-    plot_2d_cube, plot_3d_cube, plot_4d_cube
+    MapFrame, plot_2d_cube, plot_3d_cube, plot_4d_cube, get_pool, worker_pool,
+    SharedCube, _schedule_slices, colour_scale_limits, mask_less_than
 )
 
 # pylint: disable=unused-argument, missing-docstring
@@ -133,6 +139,432 @@ def test_plot_3d_happy_path(name_model_result, tmpdir):
     assert set(plot_files) == set(expected)
 
 
+@pytest.mark.parametrize('reuse_figures', [True, False])
+def test_plot_3d_reuse_figures(name_model_result, tmpdir, reuse_figures):
+    cube = name_model_result.total_column
+    expected = ['VA_Tutorial_Total_Column_Mass_20100418030000.png',
+                'VA_Tutorial_Total_Column_Mass_20100418060000.png']
+
+    metadata = plot_3d_cube(cube, tmpdir, serial=True,
+                            reuse_figures=reuse_figures)
+    plot_files = os.listdir(tmpdir)
+
+    assert set(plot_files) == set(expected)
+    assert list(metadata['plots'].values()) == expected
+
+
+@pytest.mark.parametrize('kwargs', [
+    {},
+    {'vaac_colours': True, 'limits': (-20, 40, 10, 70)},
+    {'vmax': 1e-3},
+    ])
+def test_map_frame_update_matches_plot_2d(name_model_result, kwargs):
+    # Arrange
+    first, *others = name_model_result.air_concentration.slices(
+        ['latitude', 'longitude'])
+    frame = MapFrame(first, **kwargs)
+
+    for yx_slice in others:
+        # Act
+        title = frame.update(yx_slice.copy())
+        fig, expected_title = plot_2d_cube(yx_slice.copy(), **kwargs)
+
+        # Assert
+        assert title == expected_title
+        np.testing.assert_array_equal(_render(frame.fig), _render(fig))
+
+
+def _render(fig):
+    fig.canvas.draw()
+    return np.asarray(fig.canvas.buffer_rgba())
+
+
+def test_plot_4d_serial_and_parallel_metadata_match(name_model_result, tmpdir):
+    cube = name_model_result.air_concentration
+
+    serial = plot_4d_cube(cube, tmpdir.mkdir('serial'), serial=True)
+    parallel = plot_4d_cube(cube, tmpdir.mkdir('parallel'))
+
+    assert parallel == serial
+    assert list(parallel['plots']) == ['00500', '01000']
+
+
+def test_plot_4d_realised_data_parallel(name_model_result, tmpdir):
+    cube = name_model_result.air_concentration
+    cube.data = np.ma.masked_less(cube.data, 1e-5)
+
+    serial = plot_4d_cube(cube, tmpdir.mkdir('serial'), serial=True)
+    parallel = plot_4d_cube(cube, tmpdir.mkdir('parallel'))
+
+    assert parallel == serial
+    for zlevel, plots in serial['plots'].items():
+        for filename in plots.values():
+            serial_png = tmpdir.join('serial', zlevel, filename).read_binary()
+            parallel_png = tmpdir.join('parallel', zlevel, filename).read_binary()
+            assert parallel_png == serial_png
+
+
+def test_shared_cube_round_trip(name_model_result):
+    # Arrange
+    cube = name_model_result.air_concentration.copy()
+    cube.data = np.ma.masked_greater(cube.data, 1e-3)
+    expected = cube.copy(data=mask_less_than(cube.data, 1e-5))
+    lead_dims, indices = _schedule_slices(cube)
+    shared = SharedCube(cube, mask_less=1e-5)
+
+    try:
+        # Act
+        references = [pickle.dumps(shared.slice(lead_dims, index)) for index in indices]
+        loaded = [pickle.loads(reference).load() for reference in references]
+    finally:
+        shared.close()
+
+    # Assert
+    # The cube data are moved into the shared block, with the original mask
+    assert np.shares_memory(cube.data, shared.data)
+    assert cube == expected
+    np.testing.assert_array_equal(cube.data.mask, cube.data > 1e-3)
+    yx_slices = list(expected.slices(['latitude', 'longitude']))
+    assert len(loaded) == len(yx_slices)
+    for reference, yx_slice, loaded_slice in zip(references, yx_slices, loaded):
+        assert len(reference) < yx_slice.data.nbytes
+        assert loaded_slice == yx_slice
+        np.testing.assert_array_equal(loaded_slice.data.mask, yx_slice.data.mask)
+        # Slices are read-only views of the blocks
+        assert not loaded_slice.data.data.flags.owndata
+        assert not loaded_slice.data.data.flags.writeable
+
+
+def test_shared_cube_close_removes_blocks(name_model_result):
+    cube = name_model_result.total_column.copy()
+    shared = SharedCube(cube)
+    reference = shared.slice([0], (0,))
+
+    shared.close()
+
+    # Arrays that are already mapped stay valid
+    assert cube.data.sum() > 0
+    with pytest.raises(FileNotFoundError):
+        reference.load()
+
+
+def test_plot_4d_shared_memory(name_model_result, tmpdir):
+    cube = name_model_result.air_concentration
+    cube.data = np.ma.masked_less(cube.data, 1e-5)
+
+    pickled = plot_4d_cube(cube, tmpdir.mkdir('pickled'), shared_memory=False)
+    shared = plot_4d_cube(cube, tmpdir.mkdir('shared'))
+
+    assert shared == pickled
+    for zlevel, plots in pickled['plots'].items():
+        for filename in plots.values():
+            pickled_png = tmpdir.join('pickled', zlevel, filename).read_binary()
+            shared_png = tmpdir.join('shared', zlevel, filename).read_binary()
+            assert shared_png == pickled_png
+
+
+def test_plot_3d_error_stops_tasks_before_removing_blocks(name_model_result, tmpdir,
+                                                          monkeypatch):
+    # Arrange
+    cube = name_model_result.total_column
+    cube.data
+    events = []
+    close_blocks = SharedCube.close
+    close_pool = plotting.close_pool
+
+    def recording_close_blocks(self):
+        events.append('close blocks')
+        close_blocks(self)
+
+    def recording_close_pool(terminate=False):
+        events.append(f'close pool, terminate={terminate}')
+        close_pool(terminate=terminate)
+
+    monkeypatch.setattr(SharedCube, 'close', recording_close_blocks)
+    monkeypatch.setattr(plotting, 'close_pool', recording_close_pool)
+
+    # Act
+    with pytest.raises(ValueError):
+        # Workers fail to save figures with an invalid format
+        plot_3d_cube(cube, tmpdir, workers=1, format='not_a_format')
+
+    # Assert
+    assert events[-2:] == ['close pool, terminate=True', 'close blocks']
+    assert plotting.running_pool() is None
+
+
+def test_plot_3d_incremental(name_model_result, tmpdir, monkeypatch):
+    # Arrange
+    cube = name_model_result.total_column
+    plotted = []
+    save_figure = plotting._save_yx_slice_figure
+
+    def recording_save_figure(yx_slice, *args, **kwargs):
+        timestamp, filename = save_figure(yx_slice, *args, **kwargs)
+        plotted.append(filename)
+        return timestamp, filename
+
+    monkeypatch.setattr(plotting, '_save_yx_slice_figure', recording_save_figure)
+    first_run = plot_3d_cube(cube, tmpdir, serial=True, incremental=True)
+    all_files = list(first_run['plots'].values())
+
+    # Act / Assert
+    plotted.clear()
+    assert plot_3d_cube(cube, tmpdir, serial=True, incremental=True) == first_run
+    assert plotted == []
+
+    # No pool is started when all figures are up to date
+    with monkeypatch.context() as patch:
+        patch.setattr(plotting, 'get_pool', None)
+        assert plot_3d_cube(cube, tmpdir, incremental=True) == first_run
+    assert plotted == []
+
+    # Missing figures are replotted
+    tmpdir.join(all_files[0]).remove()
+    assert plot_3d_cube(cube, tmpdir, serial=True, incremental=True) == first_run
+    assert plotted == all_files[:1]
+
+    # Changed data are replotted
+    plotted.clear()
+    changed = cube.copy()
+    changed.data[1] *= 2
+    plot_3d_cube(changed, tmpdir, serial=True, incremental=True)
+    assert plotted == all_files[1:]
+
+    # Changed render parameters replot everything
+    plotted.clear()
+    plot_3d_cube(changed, tmpdir, serial=True, incremental=True, dpi=50)
+    assert plotted == all_files
+    assert set(plotting._read_manifest(tmpdir)) == set(all_files)
+
+
+def test_plot_3d_incremental_removes_stale_entries(name_model_result, tmpdir):
+    # Arrange
+    cube = name_model_result.total_column
+    deposition = name_model_result.total_deposition
+    all_files = list(plot_3d_cube(cube, tmpdir, serial=True, incremental=True)['plots'].values())
+    deposition_files = list(plot_3d_cube(deposition, tmpdir, serial=True,
+                                         incremental=True)['plots'].values())
+
+    # Act
+    emptied = cube.copy()
+    emptied.data[0] = 0
+    plot_3d_cube(emptied, tmpdir, serial=True, incremental=True, empty_slices='skip')
+    after_empty = set(plotting._read_manifest(tmpdir))
+    plot_3d_cube(cube, tmpdir, serial=True, incremental=True)
+    plot_3d_cube(cube[1:], tmpdir, serial=True, incremental=True)
+    after_removed = set(plotting._read_manifest(tmpdir))
+
+    # Assert
+    # Entries of the other quantity in the same directory are kept
+    assert after_empty == set(all_files[1:] + deposition_files)
+    assert after_removed == set(all_files[1:] + deposition_files)
+
+
+@pytest.mark.parametrize('lazy', [True, False])
+def test_plot_3d_empty_slices_skip(name_model_result, tmpdir, lazy):
+    # Arrange
+    cube = name_model_result.total_column
+    cube.data[0] = 0
+    if lazy:
+        cube = cube.copy(data=da.from_array(cube.data))
+
+    # Act
+    metadata = plot_3d_cube(cube, tmpdir, serial=True, empty_slices='skip')
+
+    # Assert
+    assert metadata['plots'] == {
+        '20100418060000': 'VA_Tutorial_Total_Column_Mass_20100418060000.png'}
+    assert metadata['empty'] == ['20100418030000']
+    assert os.listdir(tmpdir) == ['VA_Tutorial_Total_Column_Mass_20100418060000.png']
+
+
+def test_plot_4d_empty_slices_placeholder(name_model_result, tmpdir):
+    # Arrange
+    cube = name_model_result.air_concentration
+    cube.data[1] = 0  # altitude 01000
+
+    # Act
+    metadata = plot_4d_cube(cube, tmpdir, empty_slices='placeholder')
+
+    # Assert
+    placeholder = 'VA_Tutorial_Air_Concentration_01000_no_ash.png'
+    assert metadata['plots']['01000'] == {'20100418030000': placeholder,
+                                          '20100418060000': placeholder}
+    assert metadata['empty'] == {'00500': [],
+                                 '01000': ['20100418030000', '20100418060000']}
+    assert os.listdir(tmpdir.join('01000')) == [placeholder]
+    assert len(os.listdir(tmpdir.join('00500'))) == 2
+
+
+def test_plot_4d_placeholders_drawn_in_main_thread(name_model_result, tmpdir,
+                                                   monkeypatch):
+    # Arrange
+    cube = name_model_result.air_concentration
+    cube.data[1] = 0  # altitude 01000
+    threads = []
+    for name in ('_save_placeholder_figure', '_slice_hash'):
+        def recording(*args, _func=getattr(plotting, name)):
+            threads.append(threading.current_thread())
+            return _func(*args)
+        monkeypatch.setattr(plotting, name, recording)
+
+    # Act
+    metadata = plot_4d_cube(cube, tmpdir, workers=2, incremental=True,
+                            empty_slices='placeholder')
+
+    # Assert
+    # pool.imap reads tasks in another thread, where pyplot is not safe
+    assert len(threads) == 3
+    assert set(threads) == {threading.main_thread()}
+    assert metadata['empty']['01000'] == ['20100418030000', '20100418060000']
+
+
+def test_plot_3d_empty_slices_unknown_option(name_model_result, tmpdir):
+    with pytest.raises(ValueError):
+        plot_3d_cube(name_model_result.total_column, tmpdir, empty_slices='ignore')
+
+
+def test_plot_3d_parallel_does_not_copy_cube(name_model_result, tmpdir):
+    # Arrange
+    template = name_model_result.total_column
+    latitude = iris.coords.DimCoord(
+        np.linspace(30, 75, 300), standard_name='latitude', units='degrees',
+        coord_system=template.coord('latitude').coord_system)
+    longitude = iris.coords.DimCoord(
+        np.linspace(-60, 30, 400), standard_name='longitude', units='degrees',
+        coord_system=template.coord('longitude').coord_system)
+    time = template.coord('time').copy(points=350000 + 3 * np.arange(12.), bounds=None)
+    data = np.random.default_rng(0).uniform(0, 1e-3, (12, 300, 400)).astype(np.float32)
+    cube = iris.cube.Cube(data, long_name=template.long_name, units=template.units,
+                          attributes=template.attributes,
+                          dim_coords_and_dims=[(time, 0), (latitude, 1), (longitude, 2)])
+
+    with worker_pool(2):
+        plot_3d_cube(cube[:1], tmpdir, workers=2)  # start workers
+        tracemalloc.start()
+        try:
+            # Act
+            metadata = plot_3d_cube(cube, tmpdir, workers=2, chunksize=1)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+    # Assert
+    # Only the mask and the slices in flight to workers are held in the
+    # parent, not a copy of the cube
+    assert len(metadata['plots']) == 12
+    assert peak < data.nbytes
+
+
+def test_plot_3d_default_chunksize(name_model_result, tmpdir, monkeypatch):
+    # Arrange
+    template = name_model_result.total_column
+    time = template.coord('time').copy(points=350000 + 3 * np.arange(12.), bounds=None)
+    data = np.zeros((12,) + template.shape[1:], dtype=np.float32)
+    data[0] = template.data[0]
+    cube = iris.cube.Cube(data, long_name=template.long_name, units=template.units,
+                          attributes=template.attributes,
+                          dim_coords_and_dims=[(time, 0),
+                                               (template.coord('latitude'), 1),
+                                               (template.coord('longitude'), 2)])
+    chunksizes = []
+    get_pool = plotting.get_pool
+
+    class RecordingPool:
+        def __init__(self, pool):
+            self.pool = pool
+
+        def imap_unordered(self, func, iterable, chunksize=1):
+            chunksizes.append(chunksize)
+            return self.pool.imap_unordered(func, iterable, chunksize)
+
+    monkeypatch.setattr(plotting, 'get_pool',
+                        lambda *args: RecordingPool(get_pool(*args)))
+
+    # Act
+    with worker_pool(1):
+        metadata = plot_3d_cube(cube, tmpdir, workers=1, empty_slices='skip')
+
+    # Assert
+    # Only the one slice with data is sent to workers
+    assert len(metadata['plots']) == 1
+    assert chunksizes == [1]
+
+
+def test_worker_pool_is_shared_between_calls(name_model_result, tmpdir):
+    with worker_pool() as pool:
+        plot_3d_cube(name_model_result.total_column, tmpdir)
+        plot_4d_cube(name_model_result.air_concentration, tmpdir)
+
+        assert get_pool() is pool
+
+    assert plotting._pool is None
+
+
+def test_worker_pool_processes(name_model_result, tmpdir):
+    with worker_pool(processes=1) as pool:
+        assert plotting._pool_processes == 1
+        assert get_pool() is pool
+
+        metadata = plot_3d_cube(name_model_result.total_column, tmpdir,
+                                workers=2, chunksize=1)
+
+        assert plotting._pool_processes == 2
+        assert get_pool() is not pool
+        assert len(metadata['plots']) == 2
+
+
+@pytest.mark.parametrize('schedule, expected', [
+    ('cube', [(0, 0), (0, 1), (1, 0), (1, 1)]),
+    ('latest_time_first', [(0, 1), (1, 1), (0, 0), (1, 0)]),
+    ('earliest_time_first', [(0, 0), (1, 0), (0, 1), (1, 1)]),
+    ('lowest_level_first', [(0, 0), (0, 1), (1, 0), (1, 1)]),
+    ('highest_level_first', [(1, 0), (1, 1), (0, 0), (0, 1)]),
+    ])
+def test_schedule_slices(name_model_result, schedule, expected):
+    # Cube dimensions are (altitude, time, latitude, longitude)
+    cube = name_model_result.air_concentration
+
+    lead_dims, indices = _schedule_slices(cube, schedule)
+
+    assert lead_dims == [0, 1]
+    assert indices == expected
+
+
+def test_schedule_slices_unknown_schedule(name_model_result):
+    with pytest.raises(ValueError):
+        _schedule_slices(name_model_result.air_concentration, 'random')
+
+
+def test_colour_scale_limits_lazy(name_model_result):
+    cube = name_model_result.air_concentration
+    expected_vmax = cube.copy().data.max()
+
+    vmin, vmax = colour_scale_limits(cube)
+
+    assert vmin == 0
+    assert vmax == pytest.approx(expected_vmax)
+    assert cube.has_lazy_data()
+
+
+def test_colour_scale_limits_percentile(name_model_result):
+    cube = name_model_result.air_concentration
+    data = cube.copy().data
+    expected_vmax = np.percentile(data[data >= 1e-8], 90)
+
+    _, vmax = colour_scale_limits(cube, vmax_percentile=90)
+
+    assert vmax == pytest.approx(expected_vmax)
+    assert cube.has_lazy_data()
+
+
+def test_colour_scale_limits_given_values(name_model_result):
+    cube = name_model_result.air_concentration
+
+    assert colour_scale_limits(cube, vmin=1, vmax=2) == (1, 2)
+
+
 def test_plot_2d_happy_path(name_model_result):
     cube = name_model_result.air_concentration[0, 0, :, :]
     fig, title = plot_2d_cube(cube)
@@ -141,6 +573,50 @@ def test_plot_2d_happy_path(name_model_result):
     assert title == 'VA_Tutorial_Air_Concentration_00500_20100418030000'
 
 
+def test_plot_2d_does_not_modify_cube(name_model_result):
+    cube = name_model_result.air_concentration[0, 0, :, :]
+    cube.data = np.ma.masked_less(cube.data, 1e-5)
+    data = cube.data
+    expected = data.copy()
+
+    plot_2d_cube(cube, mask_less=1e-3)
+
+    assert cube.data is data
+    np.testing.assert_array_equal(cube.data.mask, expected.mask)
+    np.testing.assert_array_equal(cube.data.data, expected.data)
+
+
+def test_plot_3d_does_not_modify_cube(name_model_result, tmpdir):
+    cube = name_model_result.total_column
+    expected = cube.copy()
+
+    plot_3d_cube(cube, tmpdir, serial=True)
+
+    assert cube.has_lazy_data()
+    assert cube == expected
+
+
+def test_mask_less_than_is_view():
+    data = np.ma.masked_array([0, 1e-9, 2, 3], mask=[0, 0, 0, 1])
+
+    masked = mask_less_than(data, 1e-8)
+
+    assert np.shares_memory(masked.data, data.data)
+    np.testing.assert_array_equal(masked.mask, [True, True, False, True])
+    np.testing.assert_array_equal(data.mask, [False, False, False, True])
+    assert mask_less_than(data, None) is data
+
+
+def test_mask_less_than_lazy():
+    data = np.ma.masked_array([0, 1e-9, 2, 3], mask=[0, 0, 0, 1])
+
+    masked = mask_less_than(da.from_array(data), 1e-8)
+
+    assert isinstance(masked, da.Array)
+    np.testing.assert_array_equal(np.ma.getmaskarray(masked.compute()),
+                                  [True, True, False, True])
+
+
 def test_plot_2d_no_altitude(name_model_result):
     cube = name_model_result.total_deposition[0, :, :]
     fig, title = plot_2d_cube(cube)
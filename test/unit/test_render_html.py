@@ -246,5 +246,29 @@ def test_render_html_4d():
     assert _remove_whitespace(html) == _remove_whitespace(EXPECTED_4D)
 
 
+def test_render_html_empty_slices():
+    # Arrange
+    source = 'some source'
+    placeholder = 'VA_Tutorial_Air_Concentration_01000_no_ash.png'
+    metadata = {
+        'created_by': 'plot_4d_cube',
+        'attributes': {'Title': 'VA_Tutorial'},
+        'plots': {
+            '00500':
+                {'20100418030000': 'VA_Tutorial_Air_Concentration_00500_20100418030000.png'},
+            '01000':
+                {'20100418030000': placeholder}
+        },
+        'empty': {'00500': [], '01000': ['20100418030000']}
+    }
+
+    # Act
+    html = _remove_whitespace(render_html(source, metadata))
+
+    # Assert
+    assert f'<img src="01000/{placeholder}" width="640"> </a> <br>No ash: 20100418030000' in html
+    assert html.count('No ash above threshold at: 20100418030000') == 1
+
+
 def _remove_whitespace(text):
     return " ".join(text.split())